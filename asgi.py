@@ -0,0 +1,279 @@
+"""점심 과비 관리 - ASGI(비동기) 실행 모드
+
+사용법:
+    uvicorn asgi:app --workers 2 --host 0.0.0.0 --port $PORT
+
+읽기 위주 화면(main.READ_VIEWS: /, /status, /meals, /games)은 asyncpg 풀로 쿼리를 비동기로 실행하고,
+main 의 같은 쿼리 정의와 렌더 함수를 그대로 쓴다. DB 응답을 기다리는 동안 스레드를 잡지 않으므로
+동시 접속이 많아도 대기열이 스레드 수에 묶이지 않는다.
+실시간 갱신(/events SSE)도 여기서 직접 서비스한다: 워커마다 LISTEN 연결 하나(LiveFanout)가 알림을 델타로 펼쳐
+브라우저마다의 asyncio.Queue 로 나눠 준다. 열린 연결은 큐를 기다릴 뿐이라 스레드도 DB 연결도 잡지 않는다.
+그 밖의 경로(쓰기, 게임 등)는 기존 Flask 앱을 스레드 풀(ASYNC_WSGI_THREADS)에서 그대로 실행한다.
+SQLite 저장소(DATABASE_URL=sqlite:///...)에서는 asyncpg 를 쓰지 않고 모든 경로를 Flask 앱으로 보낸다.
+"""
+import asyncio, io, json, os, sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import asyncpg
+from werkzeug.exceptions import HTTPException
+
+import main
+
+ASYNC_POOL_MIN = int(os.environ.get("ASYNC_POOL_MIN", "2"))
+ASYNC_POOL_MAX = int(os.environ.get("ASYNC_POOL_MAX", "10"))
+ASYNC_WSGI_THREADS = int(os.environ.get("ASYNC_WSGI_THREADS", "8"))
+ASYNC_LIVE_MAX_CLIENTS = int(os.environ.get("ASYNC_LIVE_MAX_CLIENTS", "1000"))   # 워커당 /events 동시 연결 (연결당 큐 하나)
+LIVE_HEARTBEAT_SECONDS = 15
+
+@lru_cache(maxsize=256)
+def to_asyncpg(sql):
+    # main 의 ? 플레이스홀더 → asyncpg 의 $1, $2, ... (리터럴 안의 ? 는 그대로, main.translate_sql 공용)
+    return main.translate_sql(sql).dollar
+
+def build_environ(scope, body=b""):
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf8").decode("latin1"),
+        "PATH_INFO": scope["path"].encode("utf8").decode("latin1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("ascii"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": (scope.get("client") or ("", 0))[0],
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+        "wsgi.version": (1, 0),
+    }
+    for name, value in scope.get("headers", []):
+        key = name.decode("latin1").upper().replace("-", "_")
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = "HTTP_" + key
+        value = value.decode("latin1")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+async def read_body(receive):
+    chunks = []
+    while True:
+        msg = await receive()
+        if msg["type"] == "http.disconnect":
+            break
+        chunks.append(msg.get("body", b""))
+        if not msg.get("more_body"):
+            break
+    return b"".join(chunks)
+
+async def wait_disconnect(receive):
+    while (await receive())["type"] != "http.disconnect":
+        pass
+
+class LiveFanout:
+    """워커당 LISTEN 연결 하나. 알림마다 델타를 한 번만 만들어(main.live_delta_query/live_delta) 구독자 큐에 넣는다."""
+    def __init__(self, fetch):
+        self.fetch = fetch
+        self.clients = set()
+        self.inbox = asyncio.Queue()
+        self.task = None
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+
+    def subscribe(self):
+        if len(self.clients) >= ASYNC_LIVE_MAX_CLIENTS:
+            return None
+        q = asyncio.Queue(maxsize=100)
+        self.clients.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        self.clients.discard(q)
+
+    async def run(self):
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(main.DB_URL, ssl=main.DB_SSLMODE)
+                await conn.add_listener(main.LIVE_CHANNEL, lambda _c, _pid, _ch, payload: self.inbox.put_nowait(payload))
+                while True:
+                    try:
+                        payload = await asyncio.wait_for(self.inbox.get(), 60)
+                    except asyncio.TimeoutError:
+                        await conn.execute("SELECT 1")  # 끊긴 연결을 찾아 다시 연결
+                        continue
+                    if not self.clients:
+                        continue
+                    msg = json.loads(payload)
+                    query = main.live_delta_query(msg)
+                    event = main.live_delta(msg, await self.fetch(*query) if query else [])
+                    for q in list(self.clients):
+                        try:
+                            q.put_nowait(event)
+                        except asyncio.QueueFull:
+                            pass  # 느린 클라이언트는 델타를 건너뛰고, 재접속 시 페이지가 새 값을 가져감
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError):
+                await asyncio.sleep(1)
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+
+class AsyncApp:
+    def __init__(self, flask_app):
+        self.flask = flask_app
+        self.threads = ThreadPoolExecutor(ASYNC_WSGI_THREADS, thread_name_prefix="wsgi")
+        self.urls = flask_app.url_map.bind("")
+        self.pool = None
+        self.live = None
+
+    async def startup(self):
+        if main.storage.dialect == "postgres":
+            self.pool = await asyncpg.create_pool(main.DB_URL, ssl=main.DB_SSLMODE,
+                                                  min_size=ASYNC_POOL_MIN, max_size=ASYNC_POOL_MAX)
+            self.live = LiveFanout(self.fetch)
+            self.live.start()
+        # 스키마 버전 확인(워커당 1회, 동기)은 이벤트 루프 밖에서 미리 끝내둔다
+        def check():
+            with self.flask.app_context():
+                main.schema_is_current()
+        await asyncio.to_thread(check)
+
+    async def shutdown(self):
+        if self.live is not None:
+            await self.live.stop()
+        if self.pool is not None:
+            await self.pool.close()
+        self.threads.shutdown(wait=False)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            return await self.lifespan(receive, send)
+        if scope["type"] == "http" and scope["method"] in ("GET", "HEAD") and self.pool is not None:
+            try:
+                endpoint, _ = self.urls.match(scope["path"], method="GET")
+            except HTTPException:
+                endpoint = None
+            if endpoint in main.READ_VIEWS:
+                return await self.read_view(endpoint, scope, send)
+            if endpoint == "events":
+                return await self.events(scope, receive, send)
+        if scope["type"] == "http":
+            return await self.run_wsgi(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            msg = await receive()
+            if msg["type"] == "lifespan.startup":
+                await self.startup()
+                await send({"type": "lifespan.startup.complete"})
+            elif msg["type"] == "lifespan.shutdown":
+                await self.shutdown()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def environ(self, scope, body=b""):
+        environ = build_environ(scope, body)
+        environ[main.LIVE_SSE_ENVIRON] = self.live is not None  # 화면의 live_script 가 SSE/폴링을 고른다
+        return environ
+
+    async def run_wsgi(self, scope, receive, send):
+        # 동기 Flask 앱을 스레드에서 실행하고, 응답 조각은 나오는 대로 이벤트 루프로 넘긴다(흘려보내는 화면 유지)
+        loop = asyncio.get_running_loop()
+        environ = self.environ(scope, await read_body(receive))
+
+        def emit(msg):
+            asyncio.run_coroutine_threadsafe(send(msg), loop).result()
+
+        def call():
+            started = []
+            def start_response(status, headers, exc_info=None):
+                started[:] = [int(status.split(" ", 1)[0]),
+                              [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in headers]]
+            result = self.flask(environ, start_response)
+            try:
+                emit({"type": "http.response.start", "status": started[0], "headers": started[1]})
+                for chunk in result:
+                    if chunk:
+                        emit({"type": "http.response.body", "body": chunk, "more_body": True})
+                emit({"type": "http.response.body", "body": b""})
+            finally:
+                if hasattr(result, "close"):
+                    result.close()
+
+        await loop.run_in_executor(self.threads, call)
+
+    async def fetch(self, sql, params):
+        async with self.pool.acquire() as conn:
+            return [dict(r) for r in await conn.fetch(to_asyncpg(sql), *params)]
+
+    async def read_view(self, endpoint, scope, send):
+        view = main.READ_VIEWS[endpoint]
+        environ = self.environ(scope)
+        # before_request(로그인/스키마 확인)는 Flask 그대로. 막히면(리다이렉트 등) 그 응답을 돌려준다.
+        with self.flask.request_context(environ):
+            rv = self.flask.preprocess_request()
+            if rv is not None:
+                return await self.respond(self.flask.process_response(self.flask.make_response(rv)), send)
+            queries = view.queries(main.request.args)
+        # 쿼리들은 풀의 서로 다른 연결에서 동시에 실행
+        keys = list(queries)
+        results = await asyncio.gather(*(self.fetch(*queries[k]) for k in keys))
+        data = dict(zip(keys, results))
+        with self.flask.request_context(environ):
+            resp = self.flask.make_response(main.render(view.page(main.request.args, data)))
+            resp = self.flask.process_response(resp)  # 세션 저장(플래시 소비 등)
+        return await self.respond(resp, send)
+
+    async def events(self, scope, receive, send):
+        environ = self.environ(scope)
+        with self.flask.request_context(environ):
+            rv = self.flask.preprocess_request()  # 로그인 확인
+            if rv is not None:
+                return await self.respond(self.flask.process_response(self.flask.make_response(rv)), send)
+        q = self.live.subscribe()
+        if q is None:
+            # 연결 한도 초과: 잠시 뒤 재접속하도록 안내
+            return await self.respond(self.flask.response_class("retry: 30000\n\n", mimetype="text/event-stream"), send)
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream; charset=utf-8"),
+                                (b"cache-control", b"no-cache"), (b"x-accel-buffering", b"no")]})
+        disconnected = asyncio.ensure_future(wait_disconnect(receive))
+        getter = None
+        try:
+            await send({"type": "http.response.body", "body": b"retry: 3000\n\n", "more_body": True})
+            while True:
+                getter = asyncio.ensure_future(q.get())
+                done, _ = await asyncio.wait({getter, disconnected}, timeout=LIVE_HEARTBEAT_SECONDS,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if disconnected in done:
+                    break
+                if getter in done:
+                    ev = getter.result()
+                    chunk = f"event: {ev['t']}\ndata: {json.dumps(ev, ensure_ascii=False)}\n\n"
+                else:
+                    getter.cancel()
+                    chunk = ": ping\n\n"
+                await send({"type": "http.response.body", "body": chunk.encode(), "more_body": True})
+        except OSError:
+            pass  # 보내는 중에 끊긴 연결
+        finally:
+            self.live.unsubscribe(q)
+            disconnected.cancel()
+            if getter is not None:
+                getter.cancel()
+
+    async def respond(self, resp, send):
+        body = resp.get_data()
+        headers = [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in resp.headers.items()]
+        await send({"type": "http.response.start", "status": resp.status_code, "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+app = AsyncApp(main.app)
@@ -0,0 +1,435 @@
+"""점심 과비 관리 - 성능 측정 스크립트
+
+사용법:
+    python bench.py startup [--runs 5]
+    python bench.py ladder [--players 200] [--repeat 200]
+    python bench.py oddcard [--players 41] [--repeat 20000] [--deals 1000000]
+    python bench.py settle [--members 500] [--repeat 50]
+    python bench.py schema [--repeat 10]
+    python bench.py sql [--repeat 300]
+    python bench.py load [--path /games] [--concurrency 50,100,200] [--seconds 10] [--db-delay-ms 20]
+
+각 하위 명령은 결과를 표준출력으로 요약한다. DB가 필요한 측정은 DATABASE_URL 을 사용한다.
+DATABASE_URL=sqlite:///bench.db 로 두면 서버 없이 SQLite 파일로 돌린다(먼저 migrate / seed).
+"""
+import argparse, asyncio, os, random, socket, statistics, subprocess, sys, threading, time
+import urllib.error, urllib.parse, urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# ------------------ 기동 시간 ------------------
+_FIRST_RESPONSE_SNIPPET = """
+import time
+t0 = time.perf_counter()
+import main
+t1 = time.perf_counter()
+resp = main.app.test_client().get("/ping")
+t2 = time.perf_counter()
+assert resp.status_code == 200, resp.status_code
+print(f"{t1-t0:.6f} {t2-t0:.6f}")
+"""
+
+def _run_py(args, env=None):
+    return subprocess.run([sys.executable, *args], cwd=HERE, env=env or os.environ.copy(),
+                          capture_output=True, text=True)
+
+def _parse_importtime(stderr):
+    """`python -X importtime` 출력 → {모듈: 누적 마이크로초}"""
+    out = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3:
+            continue
+        out[parts[2].strip()] = int(parts[1].strip())
+    return out
+
+def bench_startup(runs=5):
+    # 1) import 프로파일 (가장 무거운 모듈 상위 10개)
+    res = _run_py(["-X", "importtime", "-c", "import main"])
+    if res.returncode != 0:
+        print(res.stderr[-2000:]); sys.exit(1)
+    cum = _parse_importtime(res.stderr)
+    print("== python -X importtime -c 'import main' ==")
+    print(f"main 누적: {cum.get('main', 0)/1000:.1f} ms")
+    heavy = sorted(((v, k) for k, v in cum.items() if k != "main" and "." not in k), reverse=True)[:10]
+    for us, name in heavy:
+        print(f"  {name:<24} {us/1000:8.1f} ms")
+
+    # 2) 새 프로세스에서 import → 첫 응답(/ping)까지 걸린 시간
+    imports, firsts = [], []
+    for _ in range(runs):
+        res = _run_py(["-c", _FIRST_RESPONSE_SNIPPET])
+        if res.returncode != 0:
+            print(res.stderr[-2000:]); sys.exit(1)
+        a, b = map(float, res.stdout.split())
+        imports.append(a); firsts.append(b)
+    print(f"== time-to-first-response (/ping, {runs}회 중앙값) ==")
+    print(f"import: {statistics.median(imports)*1000:.1f} ms · 첫 응답: {statistics.median(firsts)*1000:.1f} ms")
+
+# ------------------ 사다리 ------------------
+def _legacy_ladder(n, rng):
+    # 이전 구현: 가로줄마다 전체 목록 any() 검사 + 행×가로줄 이중 루프
+    rows = max(8, min(16, 6 + n*2))
+    rungs = []
+    for r in range(rows):
+        avail_cols = list(range(n-1))
+        rng.shuffle(avail_cols)
+        for c in avail_cols:
+            if rng.random() < 0.35:
+                if any((rr['r']==r and abs(rr['c']-c)==1) for rr in rungs):
+                    continue
+                rungs.append({"r": r, "c": c})
+    end_cols = list(range(n))
+    for r in range(rows):
+        for rc in rungs:
+            if rc["r"] == r:
+                end_cols[rc["c"]], end_cols[rc["c"]+1] = end_cols[rc["c"]+1], end_cols[rc["c"]]
+    return end_cols
+
+def _timeit(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat
+
+def bench_ladder(players=200, repeat=200):
+    import main
+    names = [f"p{i}" for i in range(players)]
+    rng = random.Random(1)
+    legacy = _timeit(lambda: _legacy_ladder(players, rng), repeat)
+    seeds = iter(range(10**9))
+    current = _timeit(lambda: main.generate_ladder(names, next(seeds)), repeat)
+    print(f"== 사다리 생성+판정 ({players}명, {main.ladder_rows_for(players)}행, {repeat}회 평균) ==")
+    print(f"이전: {legacy*1000:8.2f} ms · 현재: {current*1000:8.2f} ms · {legacy/current:.1f}x")
+
+# ------------------ 외톨이 카드 ------------------
+_ANIMALS = ["사자","호랑이","코끼리","코뿔소","원숭이","늑대","여우","팬더","토끼","수달",
+            "고래","돌고래","하마","치타","사슴","곰","양","염소","표범","기린"]
+
+def _legacy_deal(names):
+    # 이전 구현: 요청마다 동물 목록 셔플 + 덱 새로 구성 + 다시 셔플 (41명 초과 시 IndexError)
+    animals = list(_ANIMALS)
+    random.shuffle(animals)
+    deck = []
+    for i in range((len(names)-1)//2):
+        deck += [animals[i], animals[i]]
+    deck.append("외톨이")
+    random.shuffle(deck)
+    return dict(zip(names, deck))
+
+def bench_oddcard(players=41, repeat=20000, deals=1_000_000):
+    import main
+    names = [f"p{i}" for i in range(players)]
+    legacy = _timeit(lambda: _legacy_deal(names), repeat)
+    rng = random.Random(1)
+    current = _timeit(lambda: main.deal_oddcard(players, rng), repeat)
+    print(f"== 외톨이 카드 배분 ({players}명, {repeat}회 평균) ==")
+    print(f"이전: {legacy*1e6:8.2f} us · 현재: {current*1e6:8.2f} us · {legacy/current:.1f}x")
+    for n in (5, 101):
+        t0 = time.perf_counter()
+        res = main.simulate_oddcard_uniformity(n, deals if n == 5 else deals // 100, seed=1)
+        secs = time.perf_counter() - t0
+        crit = res["dof"] + 3 * (2 * res["dof"]) ** 0.5
+        print(f"균등성 {n}명 · {res['deals']:,}회: {secs:.2f}초 · chi2={res['chi2']:.1f} (dof={res['dof']}, 기준 {crit:.1f}) "
+              f"→ {'균등' if res['chi2'] < crit else '불균등'}")
+
+# ------------------ 일괄 정산 ------------------
+def bench_settle(members=500, repeat=50):
+    import main
+    rng = random.Random(1)
+    big = {f"m{i}": rng.randint(-500, 500) * 100 for i in range(members)}
+    greedy = _timeit(lambda: main.plan_settlement(big, "greedy"), repeat)
+    print(f"== 정산 계획 ({members}명) ==")
+    print(f"탐욕: {greedy*1000:8.2f} ms · 송금 {len(main.plan_settlement(big, 'greedy'))}건")
+    for k in (8, 12, main.SETTLE_EXACT_MAX - 1):
+        small = {f"m{i}": rng.choice([-1, 1]) * rng.choice([1, 2, 3, 5, 8]) * 1000 for i in range(k)}
+        exact = _timeit(lambda: main.plan_settlement(small, "exact"), 3)
+        print(f"최적 {k:>2}명: {exact*1000:8.2f} ms · 송금 {len(main.plan_settlement(small, 'exact'))}건 "
+              f"(탐욕 {len(main.plan_settlement(small, 'greedy'))}건)")
+
+# ------------------ 스키마: 인덱스 크기 / 조인 시간 ------------------
+_SCHEMA_SIZES_SQL = {
+    "postgres": """
+        SELECT t.relname AS tbl, i.relname AS idx, pg_relation_size(i.oid) AS bytes
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_class t ON t.oid = x.indrelid
+        WHERE t.relname IN ('members', 'deposits', 'meals', 'meal_parts')
+        ORDER BY t.relname, i.relname;
+    """,
+    "sqlite": """
+        SELECT m.tbl_name AS tbl, m.name AS idx, SUM(s.pgsize) AS bytes
+        FROM sqlite_master m JOIN dbstat s ON s.name = m.name
+        WHERE m.type = 'index' AND m.tbl_name IN ('members', 'deposits', 'meals', 'meal_parts')
+        GROUP BY m.tbl_name, m.name
+        ORDER BY m.tbl_name, m.name;
+    """,
+}
+
+def bench_schema(repeat=10):
+    import main
+    with main.app.app_context():
+        rows = main.db_execute(_SCHEMA_SIZES_SQL[main.storage.dialect]).fetchall()
+        counts = {t: main.db_execute(f"SELECT COUNT(*) AS n FROM {t};").fetchone()["n"]
+                  for t in ("members", "deposits", "meals", "meal_parts")}
+        print("== 행 수 ==")
+        print(" · ".join(f"{t} {n:,}" for t, n in counts.items()))
+        print("== 인덱스 크기 ==")
+        for r in rows:
+            print(f"  {r['tbl']:<12}{r['idx']:<28}{r['bytes']/1024/1024:8.2f} MB")
+        print(f"  {'합계':<38}{sum(r['bytes'] for r in rows)/1024/1024:8.2f} MB")
+
+        members = main.get_members()
+        diner = main.db_execute(main.meals_list_query(main._meals_filters({}), 1)[0], (1,)).fetchone()["diner_names"].split(", ")[0]
+        cases = {
+            "잔액 전체 집계": (main.BALANCES_SQL, ()),
+            "잔액 (팀원 지정)": (main.BALANCES_FOR_SQL, (members,)),
+            "식사 목록": main.meals_list_query(main._meals_filters({})),
+            "식사 목록 (식사자)": main.meals_list_query(main._meals_filters({"diner": diner})),
+            "팀원별 식사 횟수": (main.MEAL_COUNTS_SQL, ()),
+        }
+        print(f"== 조인/집계 시간 ({repeat}회 중앙값) ==")
+        for label, (sql, params) in cases.items():
+            main.db_execute(sql, params).fetchall()  # 캐시 워밍업
+            times = []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                main.db_execute(sql, params).fetchall()
+                times.append(time.perf_counter() - t0)
+            print(f"  {label:<20}{statistics.median(times)*1000:8.2f} ms")
+
+# ------------------ SQL: 연결 풀 / PREPARE ------------------
+def bench_sql(repeat=300):
+    # 요청(app context) 하나에 짧은 질의 하나씩. 연결마다 새로 / 풀 / 풀 + PREPARE 세 가지로 비교
+    import main
+    with main.app.app_context():
+        members = main.get_members()[:2]
+        meal_id = main.db_execute("SELECT MAX(id) AS id FROM meals;").fetchone()["id"]
+    spec = {"parts": [(n, 5000, 0, 5000) for n in members]}
+
+    def insert_parts():
+        main.insert_meal_parts(meal_id, spec)
+        main.get_db().rollback()
+
+    cases = {
+        "팀원 id 조회": lambda: main.db_execute(main.MEMBER_ID_SQL[1:-1] + ";", (members[0],)).fetchone(),
+        "잔액 (팀원 지정)": lambda: main.db_execute(main.BALANCES_FOR_SQL, (members,)).fetchall(),
+        "식사 목록 20건": lambda: main.db_execute(*main.meals_list_query(main._meals_filters({}), 20)).fetchall(),
+        "분담 insert(롤백)": insert_parts,
+    }
+    modes = {"연결마다 새로": (0, 0), "풀": (main.DB_POOL_IDLE or 8, 0), "풀 + PREPARE": (main.DB_POOL_IDLE or 8, 1)}
+    saved = main.db_pool.idle_max, main.DB_PREPARE_AFTER
+    print(f"== 요청당 질의 시간 ({repeat}회 중앙값, ms) ==")
+    print(f"  {'':<20}" + "".join(f"{m:>16}" for m in modes))
+    try:
+        for label, fn in cases.items():
+            line = f"  {label:<20}"
+            for idle_max, prepare_after in modes.values():
+                main.db_pool.idle_max, main.DB_PREPARE_AFTER = idle_max, prepare_after
+                while main.db_pool.idle:
+                    main.db_pool.idle.pop().close()  # 모드마다 PREPARE 없는 새 연결로 시작
+                times = []
+                for i in range(repeat + 5):
+                    t0 = time.perf_counter()
+                    with main.app.app_context():
+                        fn()
+                    if i >= 5:  # 워밍업(첫 연결·PREPARE) 제외
+                        times.append(time.perf_counter() - t0)
+                line += f"{statistics.median(times)*1000:16.3f}"
+            print(line)
+    finally:
+        main.db_pool.idle_max, main.DB_PREPARE_AFTER = saved
+
+# ------------------ 동시 접속 부하 (gunicorn vs uvicorn/asgi) ------------------
+LOAD_SERVERS = {
+    "gunicorn": ["-m", "gunicorn", "main:app", "--preload", "--workers", "2", "--threads", "4",
+                 "--timeout", "120", "-b", "127.0.0.1:{port}"],
+    "asgi": ["-m", "uvicorn", "asgi:app", "--workers", "2", "--port", "{port}", "--log-level", "warning"],
+}
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _start_delay_proxy(db_url, delay):
+    """DB 앞에 왕복 지연(delay 초)을 넣는 TCP 프록시를 띄우고, 프록시를 가리키는 DATABASE_URL 을 돌려준다.
+    같은 머신의 DB로도 원격 DB(왕복 수 ms)를 흉내 내기 위함."""
+    u = urllib.parse.urlsplit(db_url)
+    query = urllib.parse.parse_qs(u.query)
+    host = (query.pop("host", [None])[0] or u.hostname or "localhost")
+    port = u.port or 5432
+    port_out = _free_port()
+    loop = asyncio.new_event_loop()
+
+    async def pipe(reader, writer, lag):
+        try:
+            while data := await reader.read(65536):
+                if lag:
+                    await asyncio.sleep(lag)
+                writer.write(data)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle(cr, cw):
+        if host.startswith("/"):
+            sr, sw = await asyncio.open_unix_connection(f"{host}/.s.PGSQL.{port}")
+        else:
+            sr, sw = await asyncio.open_connection(host, port)
+        # 요청 방향에만 지연 → 질의 1회당 delay 만큼 늦어짐
+        await asyncio.gather(pipe(cr, sw, delay), pipe(sr, cw, 0))
+
+    async def serve():
+        await asyncio.start_server(handle, "127.0.0.1", port_out)
+
+    loop.run_until_complete(serve())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    auth = u.netloc.rsplit("@", 1)[0] + "@" if "@" in u.netloc else ""
+    return urllib.parse.urlunsplit((u.scheme, f"{auth}127.0.0.1:{port_out}", u.path,
+                                    urllib.parse.urlencode(query, doseq=True), ""))
+
+def _wait_ready(base, proc, timeout=30):
+    t0 = time.time()
+    while time.time() - t0 < timeout:
+        if proc.poll() is not None:
+            raise RuntimeError(f"서버가 종료됨 (코드 {proc.returncode})")
+        try:
+            urllib.request.urlopen(base + "/ping", timeout=1).read()
+            return
+        except (urllib.error.URLError, ConnectionError, OSError):
+            time.sleep(0.2)
+    raise RuntimeError("서버 기동 대기 시간 초과")
+
+class _NoRedirect(urllib.request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+def _login_cookie(base):
+    data = urllib.parse.urlencode({"password": os.environ.get("APP_PASSWORD", "7467")}).encode()
+    try:
+        urllib.request.build_opener(_NoRedirect).open(base + "/login", data)
+    except urllib.error.HTTPError as e:  # 로그인 성공 = 302
+        return e.headers["Set-Cookie"].split(";", 1)[0]
+    raise RuntimeError("로그인 실패 (APP_PASSWORD 확인)")
+
+async def _load_client(port, path, cookie, deadline, lat, errors):
+    # keep-alive 연결 하나로 deadline 까지 GET 반복
+    req = (f"GET {path} HTTP/1.1\r\nHost: 127.0.0.1\r\nCookie: {cookie}\r\n\r\n").encode()
+    reader = writer = None
+    while time.perf_counter() < deadline:
+        t0 = time.perf_counter()
+        try:
+            if writer is None:
+                reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(req)
+            head = await reader.readuntil(b"\r\n\r\n")
+            status = int(head.split(b" ", 2)[1])
+            length = 0
+            for line in head.split(b"\r\n"):
+                if line.lower().startswith(b"content-length:"):
+                    length = int(line.split(b":", 1)[1])
+            await reader.readexactly(length)
+            if status != 200:
+                errors.append(status)
+            else:
+                lat.append(time.perf_counter() - t0)
+            if b"connection: close" in head.lower():
+                writer.close(); writer = None
+        except (ConnectionError, OSError, asyncio.IncompleteReadError):
+            errors.append("conn")
+            if writer is not None:
+                writer.close()
+            writer = None
+            await asyncio.sleep(0.05)
+    if writer is not None:
+        writer.close()
+
+def _run_load(port, path, cookie, concurrency, seconds):
+    lat, errors = [], []
+    async def go():
+        deadline = time.perf_counter() + seconds
+        await asyncio.gather(*(_load_client(port, path, cookie, deadline, lat, errors) for _ in range(concurrency)))
+    asyncio.run(go())
+    return lat, errors
+
+def bench_load(path="/games", concurrency=(50, 100, 200), seconds=10, db_delay_ms=20, servers=("gunicorn", "asgi")):
+    env = os.environ.copy()
+    if not env.get("DATABASE_URL"):
+        print("DATABASE_URL 이 필요합니다."); sys.exit(1)
+    if env["DATABASE_URL"].startswith("sqlite:"):
+        db_delay_ms = 0  # 지연 프록시는 PostgreSQL 연결에만
+    if db_delay_ms:
+        env["DATABASE_URL"] = _start_delay_proxy(env["DATABASE_URL"], db_delay_ms / 1000)
+    print(f"== 동시 접속 부하: GET {path} · {seconds}초씩 · DB 지연 {db_delay_ms} ms/질의 ==")
+    print(f"{'서버':<10}{'동시':>6}{'처리량(req/s)':>16}{'p50(ms)':>10}{'p99(ms)':>10}{'오류':>8}")
+    for name in servers:
+        port = _free_port()
+        cmd = [sys.executable] + [a.format(port=port) for a in LOAD_SERVERS[name]]
+        proc = subprocess.Popen(cmd, cwd=HERE, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            base = f"http://127.0.0.1:{port}"
+            _wait_ready(base, proc)
+            cookie = _login_cookie(base)
+            _run_load(port, path, cookie, 4, 1)  # 워밍업(커넥션 풀, 스키마 확인)
+            for conc in concurrency:
+                lat, errors = _run_load(port, path, cookie, conc, seconds)
+                if not lat:
+                    print(f"{name:<10}{conc:>6}{'-':>16}{'-':>10}{'-':>10}{len(errors):>8}")
+                    continue
+                lat.sort()
+                p50, p99 = lat[len(lat) // 2], lat[min(len(lat) - 1, int(len(lat) * 0.99))]
+                print(f"{name:<10}{conc:>6}{len(lat)/seconds:>16.1f}{p50*1000:>10.1f}{p99*1000:>10.1f}{len(errors):>8}")
+        finally:
+            proc.terminate()
+            proc.wait(timeout=30)
+
+# ------------------ 진입점 ------------------
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="점심 과비 관리 성능 측정")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    p = sub.add_parser("startup", help="import 시간 및 첫 응답까지의 시간")
+    p.add_argument("--runs", type=int, default=5)
+    p = sub.add_parser("ladder", help="대규모 인원 사다리 생성/판정 시간")
+    p.add_argument("--players", type=int, default=200)
+    p.add_argument("--repeat", type=int, default=200)
+    p = sub.add_parser("oddcard", help="외톨이 카드 배분 시간 및 자리별 균등성")
+    p.add_argument("--players", type=int, default=41)
+    p.add_argument("--repeat", type=int, default=20000)
+    p.add_argument("--deals", type=int, default=1_000_000)
+    p = sub.add_parser("settle", help="일괄 정산 계획 계산 시간")
+    p.add_argument("--members", type=int, default=500)
+    p.add_argument("--repeat", type=int, default=50)
+    p = sub.add_parser("schema", help="팀원 참조 테이블의 인덱스 크기와 조인/집계 시간")
+    p.add_argument("--repeat", type=int, default=10)
+    p = sub.add_parser("sql", help="연결 풀·PREPARE 유무에 따른 짧은 질의 시간")
+    p.add_argument("--repeat", type=int, default=300)
+    p = sub.add_parser("load", help="동시 접속 처리량·지연 (gunicorn 스레드 vs uvicorn 비동기)")
+    p.add_argument("--path", default="/games")
+    p.add_argument("--concurrency", default="50,100,200")
+    p.add_argument("--seconds", type=float, default=10)
+    p.add_argument("--db-delay-ms", type=float, default=20, help="DB 질의마다 더할 지연(원격 DB 흉내), 0=끔")
+    p.add_argument("--servers", default="gunicorn,asgi")
+    args = ap.parse_args(argv)
+    if args.cmd == "startup":
+        bench_startup(args.runs)
+    elif args.cmd == "ladder":
+        bench_ladder(args.players, args.repeat)
+    elif args.cmd == "oddcard":
+        bench_oddcard(args.players, args.repeat, args.deals)
+    elif args.cmd == "settle":
+        bench_settle(args.members, args.repeat)
+    elif args.cmd == "schema":
+        bench_schema(args.repeat)
+    elif args.cmd == "sql":
+        bench_sql(args.repeat)
+    elif args.cmd == "load":
+        bench_load(args.path, [int(c) for c in args.concurrency.split(",")], args.seconds,
+                   args.db_delay_ms, args.servers.split(","))
+
+if __name__ == "__main__":
+    main()
@@ -1,112 +1,848 @@
-from flask import Flask, request, redirect, url_for, render_template_string, g, session, flash, send_file
-from datetime import date, datetime
-import os, io, json, random
+from flask import Flask, request, redirect, url_for, render_template_string, g, session, flash, send_file, Response, stream_with_context
+from datetime import date, datetime, timedelta
+import os, io, csv, json, random, secrets, hmac, hashlib, re, select, shutil, sqlite3, tempfile, traceback, threading, time
+from collections import namedtuple
+from functools import lru_cache
+from urllib.parse import quote
+import click
 import psycopg2
+import psycopg2.extensions
 import psycopg2.extras
-from openpyxl import Workbook
 
 # ------------------ 앱 설정 ------------------
 app = Flask(__name__)
 app.secret_key = os.environ.get("SECRET_KEY", "change-me")
 APP_PASSWORD = os.environ.get("APP_PASSWORD", "7467")
-DB_URL = os.environ.get("DATABASE_URL")  # Render Env에 넣은 값
+DB_URL = os.environ.get("DATABASE_URL")  # Render Env에 넣은 값. 로컬 실행은 sqlite:///lunch.db 도 가능
+DB_SSLMODE = os.environ.get("DB_SSLMODE", "require")  # 로컬 DB는 disable/prefer
 
 # ------------------ DB 연결/헬퍼 ------------------
+# 요청이 끝나면 연결을 닫지 않고 워커의 풀에 돌려준다(롤백 후). 연결마다 PREPARE 해 둔 문장이 다음 요청에서도 쓰인다.
+DB_POOL_IDLE = int(os.environ.get("DB_POOL_IDLE", "8"))   # 워커당 보관할 유휴 연결 수
+
+class PooledConnection(psycopg2.extensions.connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()   # 이 연결에 PREPARE 한 문장 이름
+        self.stale = False      # 풀에 돌려주지 않고 닫을 연결
+
+class SqliteConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()   # 쓰지 않음(SQLite 는 모듈의 문장 캐시가 대신함)
+        self.stale = False
+        self.closed = 0         # psycopg2 연결과 같은 모양
+
+    def close(self):
+        self.closed = 1
+        super().close()
+
+class ConnectionPool:
+    def __init__(self, idle_max):
+        self.idle_max = idle_max
+        self.idle = []
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+
+    def get(self):
+        with self.lock:
+            if self.pid != os.getpid():
+                self.idle, self.pid = [], os.getpid()  # fork 된 워커는 부모의 연결을 쓰지 않는다
+            while self.idle:
+                conn = self.idle.pop()
+                if not conn.closed:
+                    return conn
+        return storage.connect()
+
+    def put(self, conn):
+        if conn.closed:
+            return
+        if not conn.stale:
+            try:
+                storage.reset(conn)
+            except storage.Error:
+                conn.stale = True
+        with self.lock:
+            if not conn.stale and self.pid == os.getpid() and len(self.idle) < self.idle_max:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+db_pool = ConnectionPool(DB_POOL_IDLE)
+
 def get_db():
     conn = getattr(g, "_db_conn", None)
     if conn is None:
         if not DB_URL:
-            raise RuntimeError("DATABASE_URL not set")
-        conn = g._db_conn = psycopg2.connect(DB_URL, sslmode="require")
+            raise RuntimeError("DATABASE_URL not set (postgresql://... 또는 sqlite:///lunch.db)")
+        conn = g._db_conn = db_pool.get()
     return conn
 
+# ------------------ SQL 문장 등록부 ------------------
+# SQL 문자열마다 한 번만 변환(? → %s / $n, SQLite 는 storage.translate)하고 호출 수·시간을 센다. 문자열 리터럴·인용 식별자·주석·$$ 본문 안의
+# ? 와 % 는 플레이스홀더로 보지 않는다. DB_PREPARE_AFTER 번 이상 쓰인 문장은 연결마다 서버에 PREPARE 해 두고
+# EXECUTE 로 실행한다(파싱·계획 생략). PREPARE 가 안 되는 문장(파라미터 타입 추론 불가 등)은 그냥 실행한다.
+DB_PREPARE_AFTER = int(os.environ.get("DB_PREPARE_AFTER", "3"))   # 0 = PREPARE 안 함
+SQL_REGISTRY_LIMIT = 1000   # 이보다 많은 서로 다른 문장은 변환만 하고 등록하지 않는다
+_SQL_TOKEN = re.compile(r"""'(?:[^']|'')*'|"(?:[^"]|"")*"|--[^\n]*|/\*.*?\*/|\$(\w*)\$.*?\$\1\$|[?%;]""", re.S)
+_SQL_PREPARABLE = ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "VALUES")
+
+TranslatedSql = namedtuple("TranslatedSql", "text dollar nparams single")
+
+def translate_sql(sql):
+    """? 플레이스홀더 SQL → (psycopg2 용 %s 문장, PREPARE/asyncpg 용 $n 문장, 파라미터 수, 단일 문장 여부)"""
+    text, dollar, n, semis, pos = [], [], 0, 0, 0
+    body = sql.strip().rstrip(";")
+    for m in _SQL_TOKEN.finditer(body):
+        text.append(body[pos:m.start()]); dollar.append(body[pos:m.start()])
+        tok, pos = m.group(0), m.end()
+        if tok == "?":
+            n += 1
+            text.append("%s"); dollar.append(f"${n}")
+        elif tok == ";":
+            semis += 1
+            text.append(tok); dollar.append(tok)
+        else:
+            text.append(tok.replace("%", "%%")); dollar.append(tok)  # psycopg2 는 리터럴 안의 % 도 해석한다
+    text.append(body[pos:].replace("%", "%%")); dollar.append(body[pos:])
+    return TranslatedSql("".join(text) + ";", "".join(dollar), n, semis == 0)
+
+class SqlStatement:
+    def __init__(self, name, sql):
+        self.name = name
+        self.sql = sql
+        self.tr = storage.translate(sql)
+        self.preparable = (bool(name) and storage.can_prepare and self.tr.single
+                           and sql.lstrip().upper().startswith(_SQL_PREPARABLE))
+        args = ", ".join(["%s"] * self.tr.nparams)
+        self.execute = f"EXECUTE {name}({args});" if args else f"EXECUTE {name};"
+        self.calls = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.prepared_calls = 0
+
+class SqlRegistry:
+    def __init__(self, limit):
+        self.lock = threading.Lock()
+        self.stmts = {}
+        self.limit = limit
+
+    def get(self, sql):
+        st = self.stmts.get(sql)
+        if st is None:
+            with self.lock:
+                st = self.stmts.get(sql)
+                if st is None:
+                    if len(self.stmts) >= self.limit:
+                        return SqlStatement("", sql)  # 등록부가 가득 참: 변환만
+                    st = self.stmts[sql] = SqlStatement(f"lunch_q{len(self.stmts) + 1}", sql)
+        return st
+
+    def record(self, st, seconds, prepared):
+        with self.lock:
+            st.calls += 1
+            st.seconds += seconds
+            st.max_seconds = max(st.max_seconds, seconds)
+            st.prepared_calls += prepared
+
+sql_registry = SqlRegistry(SQL_REGISTRY_LIMIT)
+
+def _prepare(conn, st):
+    # 실패해도 진행 중인 트랜잭션은 살리도록 SAVEPOINT 안에서 (autocommit 연결·오류 상태 트랜잭션은 건너뜀)
+    if conn.autocommit or conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_INERROR:
+        return False
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SAVEPOINT lunch_prepare; PREPARE {st.name} AS {st.tr.dollar}; RELEASE SAVEPOINT lunch_prepare;")
+    except psycopg2.Error:
+        cur.execute("ROLLBACK TO SAVEPOINT lunch_prepare; RELEASE SAVEPOINT lunch_prepare;")
+        st.preparable = False
+        return False
+    conn.prepared.add(st.name)
+    return True
+
 def db_execute(sql: str, params=()):
-    # sqlite 스타일의 ? 플레이스홀더를 postgres %s 로 치환
-    sql = sql.replace("?", "%s")
-    cur = get_db().cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-    cur.execute(sql, params)
+    st = sql_registry.get(sql)
+    conn = get_db()
+    prepared = st.name in conn.prepared or (
+        st.preparable and DB_PREPARE_AFTER and st.calls + 1 >= DB_PREPARE_AFTER and _prepare(conn, st))
+    cur = storage.cursor(conn)
+    t0 = time.perf_counter()
+    try:
+        cur.execute(st.execute if prepared else st.tr.text, storage.adapt(params))
+    except psycopg2.errors.FeatureNotSupported:
+        # 다른 프로세스의 마이그레이션으로 결과 형태가 바뀐 PREPARE 문장("cached plan must not change result type")
+        if prepared:
+            conn.stale = True
+        raise
+    sql_registry.record(st, time.perf_counter() - t0, prepared)
     return cur
 
+DB_STREAM_ROWS = 500   # db_stream 이 서버에서 한 번에 가져오는 행 수
+
+def db_stream(sql: str, params=(), batch=DB_STREAM_ROWS):
+    """결과를 서버측 커서로 batch 건씩 가져오며 한 행씩 내준다(전체를 메모리에 올리지 않음).
+    제너레이터라 첫 행을 꺼낼 때 실행된다. PREPARE 한 문장은 커서로 열 수 없어 본문 그대로 실행."""
+    st = sql_registry.get(sql)
+    cur = storage.stream_cursor(get_db(), batch)
+    t0 = time.perf_counter()
+    cur.execute(st.tr.text, storage.adapt(params))
+    sql_registry.record(st, time.perf_counter() - t0, False)
+    try:
+        yield from cur
+    finally:
+        cur.close()
+
 @app.teardown_appcontext
 def close_db(_exc):
     conn = getattr(g, "_db_conn", None)
     if conn is not None:
-        conn.close()
-
-def init_db():
-    # 스키마 생성
-    db_execute("""CREATE TABLE IF NOT EXISTS members(
-      name TEXT PRIMARY KEY
-    );""")
-
-    db_execute("""CREATE TABLE IF NOT EXISTS deposits(
-      id SERIAL PRIMARY KEY,
-      dt TEXT NOT NULL,
-      name TEXT NOT NULL,
-      amount INTEGER NOT NULL,
-      note TEXT DEFAULT '',
-      CONSTRAINT fk_dep_member FOREIGN KEY(name) REFERENCES members(name) ON DELETE CASCADE
-    );""")
+        db_pool.put(conn)
+
+# ------------------ 저장소 백엔드 (PostgreSQL / SQLite) ------------------
+# DATABASE_URL 이 sqlite:///경로 이면 내장 SQLite 파일(WAL)을 쓴다. 로컬 실행·벤치마크를 서버 없이 돌리기 위한 것.
+# 쿼리는 PostgreSQL 문법 그대로 두고, SQLite 백엔드가 등록부에서 문장마다 한 번 바꿔 쓴다:
+#   ?::type 캐스트 제거, = ANY(?) → IN (json_each), unnest(?, ...) [WITH ORDINALITY] → json_each 조인,
+#   FOR UPDATE SKIP LOCKED 제거. 배열 파라미터(list)는 JSON 문자열로 넘긴다.
+# 바꿔 쓸 수 없는 문장(데이터 변경 CTE, LATERAL)은 호출부가 storage.dialect 로 나눈다.
+# NOTIFY/LISTEN 은 SQLite 에서 notifications 테이블(같은 트랜잭션에 기록, 커밋 후 보임)과 폴링으로 대신한다.
+SQLITE_CACHED_STATEMENTS = 512    # sqlite3 모듈의 연결별 준비 문장 캐시
+SQLITE_LISTEN_POLL = 0.2          # 알림 테이블 폴링 간격(초)
+SQLITE_NOTIFY_KEEP = 1000         # 알림 테이블에 남겨 둘 최근 행 수
+
+class PgListener:
+    def __init__(self, channels):
+        self.conn = psycopg2.connect(DB_URL, sslmode=DB_SSLMODE)
+        self.conn.autocommit = True
+        for ch in channels:
+            self.conn.cursor().execute(f"LISTEN {ch};")
+
+    def wait(self, timeout):
+        """알림이 올 때까지 최대 timeout 초 대기. return: [(채널, payload), ...] (시간 초과면 [])"""
+        if not select.select([self.conn], [], [], timeout)[0]:
+            return []
+        self.conn.poll()
+        notes = [(n.channel, n.payload) for n in self.conn.notifies]
+        self.conn.notifies.clear()
+        return notes
+
+    def ping(self):
+        self.conn.cursor().execute("SELECT 1;")  # 끊긴 연결을 알아채기 위한 확인
+
+    def fetchall(self, sql, params=()):
+        cur = storage.cursor(self.conn)
+        cur.execute(storage.translate(sql).text, storage.adapt(params))
+        return cur.fetchall()
+
+    def close(self):
+        self.conn.close()
+
+class SqliteListener:
+    def __init__(self, channels):
+        self.conn = storage.connect()
+        self.channels = list(channels)
+        self.last = self.conn.execute("SELECT COALESCE(MAX(id), 0) AS n FROM notifications;").fetchone()["n"]
+
+    def wait(self, timeout):
+        deadline = time.monotonic() + timeout
+        marks = ",".join("?" * len(self.channels))
+        while True:
+            rows = self.conn.execute(f"SELECT id, channel, payload FROM notifications WHERE id > ? AND channel IN ({marks}) ORDER BY id;",
+                                     (self.last, *self.channels)).fetchall()
+            if rows:
+                self.last = rows[-1]["id"]
+                return [(r["channel"], r["payload"]) for r in rows]
+            if time.monotonic() >= deadline:
+                return []
+            time.sleep(min(SQLITE_LISTEN_POLL, max(deadline - time.monotonic(), 0)))
+
+    def ping(self):
+        self.conn.execute("SELECT 1;")
+
+    def fetchall(self, sql, params=()):
+        return self.conn.execute(storage.translate(sql).text, storage.adapt(params)).fetchall()
+
+    def close(self):
+        self.conn.close()
+
+class PostgresStorage:
+    dialect = "postgres"
+    can_prepare = True
+    Error = psycopg2.Error
+    UniqueViolation = psycopg2.errors.UniqueViolation
+    UndefinedTable = psycopg2.errors.UndefinedTable
+
+    def connect(self):
+        return psycopg2.connect(DB_URL, sslmode=DB_SSLMODE, connection_factory=PooledConnection)
+
+    def reset(self, conn):
+        conn.rollback()
+        conn.autocommit = False
+
+    def cursor(self, conn):
+        return conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+
+    def stream_cursor(self, conn, batch):
+        # 이름 있는 커서 = DECLARE ... CURSOR (트랜잭션 안, 요청 끝의 롤백으로 닫힘)
+        cur = conn.cursor(name=f"lunch_stream_{secrets.token_hex(4)}", cursor_factory=psycopg2.extras.RealDictCursor)
+        cur.itersize = batch
+        return cur
+
+    def translate(self, sql):
+        return translate_sql(sql)
+
+    def adapt(self, params):
+        return params
+
+    def binary(self, data):
+        return psycopg2.Binary(data) if data is not None else None
+
+    def notify(self, channel, payload=""):
+        db_execute("SELECT pg_notify(?, ?);", (channel, payload))  # 커밋될 때 전달
+
+    def listen(self, channels):
+        return PgListener(channels)
+
+    def lock_migrations(self):
+        # 여러 인스턴스가 동시에 migrate 해도 한 번만 적용되도록 advisory lock
+        db_execute("SELECT pg_advisory_xact_lock(7467);")
+
+    def lock_table(self, table):
+        db_execute(f"LOCK TABLE {table} IN EXCLUSIVE MODE;")
+
+    def copy_rows(self, table, cols, rows):
+        # COPY ... FROM STDIN (CSV) 로 대량 적재
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        buf.seek(0)
+        get_db().cursor().copy_expert(f"COPY {table}({','.join(cols)}) FROM STDIN WITH (FORMAT csv)", buf)
+
+    def sync_serial(self, table):
+        db_execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), COALESCE((SELECT MAX(id) FROM {table}), 0) + 1, false);")
+
+_SQLITE_CAST = re.compile(r"::\w+(\[\])?")
+_SQLITE_ANY = re.compile(r"=\s*ANY\(\s*\?\s*\)", re.I)
+_SQLITE_UNNEST = re.compile(r"unnest\(([?,\s]*)\)(\s+WITH\s+ORDINALITY)?\s+AS\s+(\w+)(?:\(([\w,\s]*)\))?", re.I)
+_SQLITE_SKIP_LOCKED = re.compile(r"\s+FOR\s+UPDATE\s+SKIP\s+LOCKED", re.I)
+
+def _sqlite_unnest(m):
+    n, ordinality, alias = m.group(1).count("?"), m.group(2), m.group(3)
+    cols = [c.strip() for c in m.group(4).split(",")] if m.group(4) else [alias]
+    sel = [f"j{i}.value AS {cols[i]}" for i in range(n)]
+    if ordinality:
+        sel.append(f"j0.key + 1 AS {cols[n]}")
+    src = " ".join(["json_each(?) j0"] + [f"JOIN json_each(?) j{i} ON j{i}.key = j0.key" for i in range(1, n)])
+    return f"(SELECT {', '.join(sel)} FROM {src}) AS {alias}"
+
+def _dict_row(cur, row):
+    return dict(zip([d[0] for d in cur.description], row))
+
+class SqliteStorage:
+    dialect = "sqlite"
+    can_prepare = False
+    Error = sqlite3.Error
+    UniqueViolation = sqlite3.IntegrityError
+    UndefinedTable = sqlite3.OperationalError
+
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        # 요청 스레드가 바뀌어도 풀의 연결을 쓰도록 check_same_thread=False (한 번에 한 요청만 쓴다)
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, factory=SqliteConnection,
+                               cached_statements=SQLITE_CACHED_STATEMENTS)
+        conn.row_factory = _dict_row
+        conn.execute("PRAGMA journal_mode=WAL;")
+        conn.execute("PRAGMA synchronous=NORMAL;")
+        conn.execute("PRAGMA foreign_keys=ON;")
+        return conn
+
+    def reset(self, conn):
+        conn.rollback()
+
+    def cursor(self, conn):
+        return conn.cursor()
+
+    def stream_cursor(self, conn, batch):
+        return conn.cursor()  # sqlite3 커서는 순회할 때 한 행씩 계산한다
+
+    def translate(self, sql):
+        # 리터럴·주석은 그대로 두고 나머지 부분만 바꿔 쓴다
+        parts, pos, n = [], 0, 0
+        body = sql.strip().rstrip(";")
+        for m in _SQL_TOKEN.finditer(body):
+            if m.group(0) in "?%;":
+                n += m.group(0) == "?"
+                continue
+            parts.append(("code", body[pos:m.start()])); parts.append(("lit", m.group(0)))
+            pos = m.end()
+        parts.append(("code", body[pos:]))
+        code = "\0".join(p for kind, p in parts if kind == "code")
+        code = _SQLITE_SKIP_LOCKED.sub("", code)
+        code = _SQLITE_CAST.sub("", code)
+        code = _SQLITE_ANY.sub("IN (SELECT value FROM json_each(?))", code)
+        code = _SQLITE_UNNEST.sub(_sqlite_unnest, code)
+        lits = iter(p for kind, p in parts if kind == "lit")
+        text = re.sub("\0", lambda _: next(lits), code)
+        return TranslatedSql(text + ";", None, n, ";" not in code)
+
+    def adapt(self, params):
+        return tuple(json.dumps(p, ensure_ascii=False) if isinstance(p, (list, tuple)) else p for p in params)
+
+    def binary(self, data):
+        return bytes(data) if data is not None else None
+
+    def notify(self, channel, payload=""):
+        cur = db_execute("INSERT INTO notifications(channel, payload) VALUES (?, ?);", (channel, payload))
+        db_execute("DELETE FROM notifications WHERE id <= ?;", (cur.lastrowid - SQLITE_NOTIFY_KEEP,))
+
+    def listen(self, channels):
+        return SqliteListener(channels)
+
+    def lock_migrations(self):
+        # 쓰기 잠금을 먼저 잡아 두면 DDL 까지 한 트랜잭션이 된다
+        if not get_db().in_transaction:
+            get_db().execute("BEGIN IMMEDIATE;")
+
+    def lock_table(self, table):
+        self.lock_migrations()  # SQLite 는 쓰기 잠금이 DB 전체
+
+    def copy_rows(self, table, cols, rows):
+        get_db().executemany(f"INSERT INTO {table}({','.join(cols)}) VALUES ({','.join('?' * len(cols))});", rows)
+
+    def sync_serial(self, table):
+        pass  # AUTOINCREMENT 는 명시한 id 로 삽입해도 따라간다
+
+def open_storage(url):
+    if url and url.startswith("sqlite:///"):
+        return SqliteStorage(url[len("sqlite:///"):])
+    return PostgresStorage()
+
+storage = open_storage(DB_URL)
+
+# ------------------ 스키마 버전/마이그레이션 ------------------
+# 부팅 시에는 DDL을 실행하지 않는다. 스키마 변경은 버전을 붙여 MIGRATIONS 끝에 추가하고
+# `flask --app main migrate` 로 적용한다. (v1 = 기존 init_db 테이블들)
+MIGRATIONS = [
+    (1, "기본 테이블", [
+        """CREATE TABLE IF NOT EXISTS members(
+          name TEXT PRIMARY KEY
+        );""",
+        """CREATE TABLE IF NOT EXISTS deposits(
+          id SERIAL PRIMARY KEY,
+          dt TEXT NOT NULL,
+          name TEXT NOT NULL,
+          amount INTEGER NOT NULL,
+          note TEXT DEFAULT '',
+          CONSTRAINT fk_dep_member FOREIGN KEY(name) REFERENCES members(name) ON DELETE CASCADE
+        );""",
+        """CREATE TABLE IF NOT EXISTS meals(
+          id SERIAL PRIMARY KEY,
+          dt TEXT NOT NULL,
+          entry_mode TEXT NOT NULL DEFAULT 'total',  -- 'total' | 'detailed'
+          main_mode TEXT NOT NULL DEFAULT 'custom',  -- 'equal' | 'custom'
+          side_mode TEXT NOT NULL DEFAULT 'none',    -- 'equal' | 'custom' | 'none'
+          main_total INTEGER NOT NULL DEFAULT 0,
+          side_total INTEGER NOT NULL DEFAULT 0,
+          grand_total INTEGER NOT NULL DEFAULT 0,
+          payer_name TEXT,
+          guest_total INTEGER NOT NULL DEFAULT 0,
+          CONSTRAINT fk_meal_payer FOREIGN KEY(payer_name) REFERENCES members(name) ON DELETE SET NULL
+        );""",
+        """CREATE TABLE IF NOT EXISTS meal_parts(
+          id SERIAL PRIMARY KEY,
+          meal_id INTEGER NOT NULL,
+          name TEXT NOT NULL,
+          main_amount INTEGER NOT NULL DEFAULT 0,
+          side_amount INTEGER NOT NULL DEFAULT 0,
+          total_amount INTEGER NOT NULL DEFAULT 0,
+          CONSTRAINT fk_mp_meal FOREIGN KEY(meal_id) REFERENCES meals(id) ON DELETE CASCADE,
+          CONSTRAINT fk_mp_member FOREIGN KEY(name) REFERENCES members(name) ON DELETE CASCADE
+        );""",
+        """CREATE TABLE IF NOT EXISTS notices(
+          id SERIAL PRIMARY KEY,
+          dt TEXT NOT NULL,
+          content TEXT NOT NULL
+        );""",
+        # 감사 로그
+        """CREATE TABLE IF NOT EXISTS audit_logs(
+          id SERIAL PRIMARY KEY,
+          dt TEXT NOT NULL,
+          action TEXT NOT NULL,        -- insert/update/delete
+          target_table TEXT NOT NULL,  -- deposits/meals/meal_parts/notices
+          target_id INTEGER,
+          payload TEXT                  -- JSON string
+        );""",
+        # 게임 기록 & 통계
+        """CREATE TABLE IF NOT EXISTS games(
+          id SERIAL PRIMARY KEY,
+          dt TEXT NOT NULL,
+          game_type TEXT NOT NULL,     -- dice/ladder/oddcard
+          rule TEXT NOT NULL,          -- rule text
+          participants TEXT NOT NULL,  -- JSON list of names
+          winner TEXT,                 -- optional
+          loser TEXT,                  -- main loser
+          extra TEXT                   -- JSON for extra info
+        );""",
+        """CREATE TABLE IF NOT EXISTS hogu_stats(
+          name TEXT PRIMARY KEY,
+          losses INTEGER NOT NULL DEFAULT 0
+        );""",
+    ]),
+    (2, "호구 일별 롤업", [
+        # 기간/게임종류별 순위용 롤업: (일자, 게임, 이름) 당 1행 → 기간 조회는 PK 범위 스캔
+        """CREATE TABLE IF NOT EXISTS hogu_daily(
+          day TEXT NOT NULL,           -- YYYY-MM-DD (games.dt 앞 10자리)
+          game_type TEXT NOT NULL,
+          name TEXT NOT NULL,
+          losses INTEGER NOT NULL DEFAULT 0,
+          PRIMARY KEY(day, game_type, name)
+        );""",
+        "CREATE INDEX IF NOT EXISTS ix_games_dt ON games(dt);",
+        """INSERT INTO hogu_daily(day, game_type, name, losses)
+           SELECT substr(dt, 1, 10), game_type, loser, COUNT(*) FROM games
+           WHERE loser IS NOT NULL AND loser <> ''
+           GROUP BY 1, 2, 3
+           ON CONFLICT DO NOTHING;""",
+    ]),
+    (3, "게임 참가자 테이블", [
+        # 참가자별 1행 → "X가 참여한 모든 게임"을 (name, game_id) 인덱스로 조회
+        """CREATE TABLE IF NOT EXISTS game_participants(
+          game_id INTEGER NOT NULL,
+          seat INTEGER NOT NULL,       -- 0부터, games.participants 순서
+          name TEXT NOT NULL,
+          is_loser BOOLEAN NOT NULL DEFAULT FALSE,
+          PRIMARY KEY(game_id, seat),
+          CONSTRAINT fk_gp_game FOREIGN KEY(game_id) REFERENCES games(id) ON DELETE CASCADE
+        );""",
+        "CREATE INDEX IF NOT EXISTS ix_gp_name ON game_participants(name, game_id);",
+        "CREATE INDEX IF NOT EXISTS ix_games_type_dt ON games(game_type, dt);",
+        """INSERT INTO game_participants(game_id, seat, name, is_loser)
+           SELECT g.id, p.ord - 1, p.name, p.name = COALESCE(g.loser, '')
+           FROM games g, json_array_elements_text(g.participants::json) WITH ORDINALITY AS p(name, ord)
+           ON CONFLICT DO NOTHING;""",
+    ]),
+    (4, "게임 기록 멱등 키", [
+        # 같은 플레이 화면의 재전송(더블클릭/새로고침)은 같은 키 → 한 번만 기록
+        "ALTER TABLE games ADD COLUMN IF NOT EXISTS idem_key TEXT;",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_games_idem_key ON games(idem_key);",
+    ]),
+    (5, "식사 템플릿", [
+        """CREATE TABLE IF NOT EXISTS meal_templates(
+          id SERIAL PRIMARY KEY,
+          name TEXT NOT NULL UNIQUE,
+          fields TEXT NOT NULL,        -- JSON: 식사 폼 값(날짜 제외) 그대로
+          updated_at TEXT NOT NULL
+        );""",
+    ]),
+    (6, "백그라운드 작업 큐", [
+        """CREATE TABLE IF NOT EXISTS jobs(
+          id SERIAL PRIMARY KEY,
+          kind TEXT NOT NULL,            -- JOB_HANDLERS 키
+          params TEXT NOT NULL DEFAULT '{}',
+          input BYTEA,                   -- 업로드 파일 등
+          status TEXT NOT NULL DEFAULT 'queued',   -- queued/running/done/failed
+          attempts INTEGER NOT NULL DEFAULT 0,
+          created_at TEXT NOT NULL,
+          started_at TEXT,
+          finished_at TEXT,
+          message TEXT,
+          error TEXT,
+          result BYTEA,
+          result_name TEXT,
+          result_mime TEXT
+        );""",
+        "CREATE INDEX IF NOT EXISTS ix_jobs_queued ON jobs(id) WHERE status = 'queued';",
+    ]),
+    (7, "팀원별 합계 인덱스", [
+        # 실시간 갱신에서 변경된 팀원 몇 명의 잔액만 다시 계산 (index-only scan)
+        "CREATE INDEX IF NOT EXISTS ix_deposits_name ON deposits(name) INCLUDE (amount);",
+        "CREATE INDEX IF NOT EXISTS ix_meal_parts_name ON meal_parts(name) INCLUDE (total_amount);",
+    ]),
+    (8, "식사 목록 인덱스", [
+        # 목록은 최근 id 몇 개를 먼저 고르고 그 식사들의 명단만 집계 → 식사별 조회용 (meal_id) 인덱스
+        "CREATE INDEX IF NOT EXISTS ix_meal_parts_meal ON meal_parts(meal_id) INCLUDE (name, total_amount);",
+        # 식사자 필터: (name, meal_id) 역순 스캔으로 최근 식사부터. 잔액 합계용 INCLUDE 는 그대로 유지
+        "CREATE INDEX IF NOT EXISTS ix_meal_parts_name_meal ON meal_parts(name, meal_id) INCLUDE (total_amount);",
+        "DROP INDEX IF EXISTS ix_meal_parts_name;",
+        "CREATE INDEX IF NOT EXISTS ix_meals_payer ON meals(payer_name, id);",
+        "CREATE INDEX IF NOT EXISTS ix_meals_dt ON meals(dt);",
+    ]),
+    (9, "팀원 변경 알림", [
+        # members 가 바뀌면(추가/삭제, seed, 외부 수정 포함) 문장 단위로 NOTIFY → 워커별 팀원 목록 캐시 무효화
+        """CREATE OR REPLACE FUNCTION notify_members_changed() RETURNS trigger AS $$
+           BEGIN
+             PERFORM pg_notify('lunch_members', TG_OP);
+             RETURN NULL;
+           END $$ LANGUAGE plpgsql;""",
+        "DROP TRIGGER IF EXISTS tr_members_notify ON members;",
+        """CREATE TRIGGER tr_members_notify AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON members
+           FOR EACH STATEMENT EXECUTE FUNCTION notify_members_changed();""",
+    ]),
+    (10, "팀원 정수 키", [
+        # 입금/식사/분담 행은 이름 대신 members.id 를 참조 → 인덱스·조인이 작아지고 이름 변경이 한 행 수정으로 끝난다.
+        # 게임 기록(games, game_participants, hogu_*)은 게스트도 포함하는 '당시 이름' 기록이라 그대로 둔다.
+        "ALTER TABLE members ADD COLUMN IF NOT EXISTS id SERIAL;",
+        "ALTER TABLE deposits ADD COLUMN IF NOT EXISTS member_id INTEGER;",
+        "UPDATE deposits d SET member_id = mb.id FROM members mb WHERE mb.name = d.name;",
+        "ALTER TABLE meal_parts ADD COLUMN IF NOT EXISTS member_id INTEGER;",
+        "UPDATE meal_parts p SET member_id = mb.id FROM members mb WHERE mb.name = p.name;",
+        "ALTER TABLE meals ADD COLUMN IF NOT EXISTS payer_id INTEGER;",
+        "UPDATE meals m SET payer_id = mb.id FROM members mb WHERE mb.name = m.payer_name;",
+        "ALTER TABLE deposits DROP CONSTRAINT IF EXISTS fk_dep_member;",
+        "ALTER TABLE meal_parts DROP CONSTRAINT IF EXISTS fk_mp_member;",
+        "ALTER TABLE meals DROP CONSTRAINT IF EXISTS fk_meal_payer;",
+        "ALTER TABLE members DROP CONSTRAINT members_pkey;",
+        "ALTER TABLE members ADD PRIMARY KEY (id);",
+        "ALTER TABLE members ADD CONSTRAINT ux_members_name UNIQUE (name);",
+        "ALTER TABLE deposits ALTER COLUMN member_id SET NOT NULL;",
+        "ALTER TABLE meal_parts ALTER COLUMN member_id SET NOT NULL;",
+        "ALTER TABLE deposits ADD CONSTRAINT fk_dep_member FOREIGN KEY(member_id) REFERENCES members(id) ON DELETE CASCADE;",
+        "ALTER TABLE meal_parts ADD CONSTRAINT fk_mp_member FOREIGN KEY(member_id) REFERENCES members(id) ON DELETE CASCADE;",
+        "ALTER TABLE meals ADD CONSTRAINT fk_meal_payer FOREIGN KEY(payer_id) REFERENCES members(id) ON DELETE SET NULL;",
+        # 이름 컬럼과 그 위의 인덱스(ix_deposits_name, ix_meal_parts_meal/_name_meal, ix_meals_payer)를 함께 제거
+        "ALTER TABLE deposits DROP COLUMN name;",
+        "ALTER TABLE meal_parts DROP COLUMN name;",
+        "ALTER TABLE meals DROP COLUMN payer_name;",
+        "CREATE INDEX IF NOT EXISTS ix_deposits_member ON deposits(member_id) INCLUDE (amount);",
+        "CREATE INDEX IF NOT EXISTS ix_meal_parts_meal ON meal_parts(meal_id) INCLUDE (member_id, total_amount);",
+        "CREATE INDEX IF NOT EXISTS ix_meal_parts_member_meal ON meal_parts(member_id, meal_id) INCLUDE (total_amount);",
+        "CREATE INDEX IF NOT EXISTS ix_meals_payer ON meals(payer_id, id);",
+    ]),
+    (11, "팀원별 입금 내역 인덱스", [
+        # 거래 내역(/member/<name>)의 (날짜, id) 순 스캔. 잔액 합계용 INCLUDE (amount) 는 그대로 유지
+        "CREATE INDEX IF NOT EXISTS ix_deposits_member_dt ON deposits(member_id, dt, id) INCLUDE (amount);",
+        "DROP INDEX IF EXISTS ix_deposits_member;",
+    ]),
+    (12, "데이터 변경 카운터", [
+        # 내보내기 캐시 키. 문장 단위 트리거가 같은 트랜잭션에서 올리므로 커밋된 변경만 버전에 반영된다.
+        "CREATE TABLE IF NOT EXISTS data_versions(tbl TEXT PRIMARY KEY, version BIGINT NOT NULL DEFAULT 0);",
+        """INSERT INTO data_versions(tbl) VALUES ('members'),('deposits'),('meals'),('meal_parts'),('notices'),
+           ('audit_logs'),('games'),('hogu_stats') ON CONFLICT (tbl) DO NOTHING;""",
+        """CREATE OR REPLACE FUNCTION bump_data_version() RETURNS trigger AS $$
+           BEGIN
+             UPDATE data_versions SET version = version + 1 WHERE tbl = TG_TABLE_NAME;
+             RETURN NULL;
+           END $$ LANGUAGE plpgsql;""",
+        """DO $$
+           DECLARE t TEXT;
+           BEGIN
+             FOR t IN SELECT tbl FROM data_versions LOOP
+               EXECUTE format('DROP TRIGGER IF EXISTS tr_%s_version ON %I', t, t);
+               EXECUTE format('CREATE TRIGGER tr_%s_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I '
+                              'FOR EACH STATEMENT EXECUTE FUNCTION bump_data_version()', t, t);
+             END LOOP;
+           END $$;""",
+    ]),
+    (13, "주사위 진행 상태", [
+        # 순번/건너뛰기/종료 여부는 서버에 둔다. 순번은 WHERE turn=? 조건부 UPDATE 로만 넘어가므로
+        # 같은 요청을 다시 보내거나 옛 상태로 보내도 한 순번이 두 번 진행되지 않는다.
+        """CREATE TABLE IF NOT EXISTS dice_games(
+          nonce TEXT PRIMARY KEY,
+          players TEXT NOT NULL,       -- JSON list of names
+          rule_id TEXT NOT NULL,
+          max_dice INTEGER NOT NULL,
+          turn INTEGER NOT NULL DEFAULT 0,
+          skips TEXT NOT NULL DEFAULT '[]',
+          finished BOOLEAN NOT NULL DEFAULT FALSE,
+          created_at TEXT NOT NULL
+        );""",
+    ]),
+]
 
-    db_execute("""CREATE TABLE IF NOT EXISTS meals(
-      id SERIAL PRIMARY KEY,
-      dt TEXT NOT NULL,
-      entry_mode TEXT NOT NULL DEFAULT 'total',  -- 'total' | 'detailed'
-      main_mode TEXT NOT NULL DEFAULT 'custom',  -- 'equal' | 'custom'
-      side_mode TEXT NOT NULL DEFAULT 'none',    -- 'equal' | 'custom' | 'none'
-      main_total INTEGER NOT NULL DEFAULT 0,
-      side_total INTEGER NOT NULL DEFAULT 0,
-      grand_total INTEGER NOT NULL DEFAULT 0,
-      payer_name TEXT,
-      guest_total INTEGER NOT NULL DEFAULT 0,
-      CONSTRAINT fk_meal_payer FOREIGN KEY(payer_name) REFERENCES members(name) ON DELETE SET NULL
-    );""")
+# SQLite 는 새 파일에만 쓰므로 버전별 이력 대신 현재 스키마를 한 번에 만든다. 이후 버전은 두 목록 끝에 함께 추가.
+# (SERIAL → INTEGER PRIMARY KEY AUTOINCREMENT, BYTEA → BLOB, INCLUDE 인덱스 → 복합 인덱스, NOTIFY 트리거 → notifications 행)
+SQLITE_MIGRATIONS = [
+    (10, "SQLite 기본 스키마", [
+        """CREATE TABLE IF NOT EXISTS members(
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          name TEXT NOT NULL CONSTRAINT ux_members_name UNIQUE
+        );""",
+        """CREATE TABLE IF NOT EXISTS deposits(
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          dt TEXT NOT NULL,
+          member_id INTEGER NOT NULL REFERENCES members(id) ON DELETE CASCADE,
+          amount INTEGER NOT NULL,
+          note TEXT DEFAULT ''
+        );""",
+        """CREATE TABLE IF NOT EXISTS meals(
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          dt TEXT NOT NULL,
+          entry_mode TEXT NOT NULL DEFAULT 'total',
+          main_mode TEXT NOT NULL DEFAULT 'custom',
+          side_mode TEXT NOT NULL DEFAULT 'none',
+          main_total INTEGER NOT NULL DEFAULT 0,
+          side_total INTEGER NOT NULL DEFAULT 0,
+          grand_total INTEGER NOT NULL DEFAULT 0,
+          guest_total INTEGER NOT NULL DEFAULT 0,
+          payer_id INTEGER REFERENCES members(id) ON DELETE SET NULL
+        );""",
+        """CREATE TABLE IF NOT EXISTS meal_parts(
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          meal_id INTEGER NOT NULL REFERENCES meals(id) ON DELETE CASCADE,
+          main_amount INTEGER NOT NULL DEFAULT 0,
+          side_amount INTEGER NOT NULL DEFAULT 0,
+          total_amount INTEGER NOT NULL DEFAULT 0,
+          member_id INTEGER NOT NULL REFERENCES members(id) ON DELETE CASCADE
+        );""",
+        """CREATE TABLE IF NOT EXISTS notices(
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          dt TEXT NOT NULL,
+          content TEXT NOT NULL
+        );""",
+        """CREATE TABLE IF NOT EXISTS audit_logs(
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          dt TEXT NOT NULL,
+          action TEXT NOT NULL,
+          target_table TEXT NOT NULL,
+          target_id INTEGER,
+          payload TEXT
+        );""",
+        """CREATE TABLE IF NOT EXISTS games(
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          dt TEXT NOT NULL,
+          game_type TEXT NOT NULL,
+          rule TEXT NOT NULL,
+          participants TEXT NOT NULL,
+          winner TEXT,
+          loser TEXT,
+          extra TEXT,
+          idem_key TEXT
+        );""",
+        """CREATE TABLE IF NOT EXISTS hogu_stats(
+          name TEXT PRIMARY KEY,
+          losses INTEGER NOT NULL DEFAULT 0
+        );""",
+        """CREATE TABLE IF NOT EXISTS hogu_daily(
+          day TEXT NOT NULL,
+          game_type TEXT NOT NULL,
+          name TEXT NOT NULL,
+          losses INTEGER NOT NULL DEFAULT 0,
+          PRIMARY KEY(day, game_type, name)
+        );""",
+        """CREATE TABLE IF NOT EXISTS game_participants(
+          game_id INTEGER NOT NULL REFERENCES games(id) ON DELETE CASCADE,
+          seat INTEGER NOT NULL,
+          name TEXT NOT NULL,
+          is_loser BOOLEAN NOT NULL DEFAULT FALSE,
+          PRIMARY KEY(game_id, seat)
+        );""",
+        """CREATE TABLE IF NOT EXISTS meal_templates(
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          name TEXT NOT NULL UNIQUE,
+          fields TEXT NOT NULL,
+          updated_at TEXT NOT NULL
+        );""",
+        """CREATE TABLE IF NOT EXISTS jobs(
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          kind TEXT NOT NULL,
+          params TEXT NOT NULL DEFAULT '{}',
+          input BLOB,
+          status TEXT NOT NULL DEFAULT 'queued',
+          attempts INTEGER NOT NULL DEFAULT 0,
+          created_at TEXT NOT NULL,
+          started_at TEXT,
+          finished_at TEXT,
+          message TEXT,
+          error TEXT,
+          result BLOB,
+          result_name TEXT,
+          result_mime TEXT
+        );""",
+        """CREATE TABLE IF NOT EXISTS notifications(
+          id INTEGER PRIMARY KEY AUTOINCREMENT,
+          channel TEXT NOT NULL,
+          payload TEXT NOT NULL DEFAULT ''
+        );""",
+        "CREATE INDEX IF NOT EXISTS ix_games_dt ON games(dt);",
+        "CREATE INDEX IF NOT EXISTS ix_games_type_dt ON games(game_type, dt);",
+        "CREATE UNIQUE INDEX IF NOT EXISTS ux_games_idem_key ON games(idem_key);",
+        "CREATE INDEX IF NOT EXISTS ix_gp_name ON game_participants(name, game_id);",
+        "CREATE INDEX IF NOT EXISTS ix_jobs_queued ON jobs(id) WHERE status = 'queued';",
+        "CREATE INDEX IF NOT EXISTS ix_deposits_member ON deposits(member_id, amount);",
+        "CREATE INDEX IF NOT EXISTS ix_meal_parts_meal ON meal_parts(meal_id, member_id, total_amount);",
+        "CREATE INDEX IF NOT EXISTS ix_meal_parts_member_meal ON meal_parts(member_id, meal_id, total_amount);",
+        "CREATE INDEX IF NOT EXISTS ix_meals_payer ON meals(payer_id, id);",
+        "CREATE INDEX IF NOT EXISTS ix_meals_dt ON meals(dt);",
+        # PostgreSQL 의 tr_members_notify 와 같은 역할: 팀원 목록 캐시 무효화
+        """CREATE TRIGGER IF NOT EXISTS tr_members_insert AFTER INSERT ON members
+           BEGIN INSERT INTO notifications(channel, payload) VALUES ('lunch_members', 'INSERT'); END;""",
+        """CREATE TRIGGER IF NOT EXISTS tr_members_update AFTER UPDATE ON members
+           BEGIN INSERT INTO notifications(channel, payload) VALUES ('lunch_members', 'UPDATE'); END;""",
+        """CREATE TRIGGER IF NOT EXISTS tr_members_delete AFTER DELETE ON members
+           BEGIN INSERT INTO notifications(channel, payload) VALUES ('lunch_members', 'DELETE'); END;""",
+    ]),
+    (11, "팀원별 입금 내역 인덱스", [
+        "CREATE INDEX IF NOT EXISTS ix_deposits_member_dt ON deposits(member_id, dt, id, amount);",
+        "DROP INDEX IF EXISTS ix_deposits_member;",
+    ]),
+    (12, "데이터 변경 카운터", [
+        "CREATE TABLE IF NOT EXISTS data_versions(tbl TEXT PRIMARY KEY, version BIGINT NOT NULL DEFAULT 0);",
+        """INSERT INTO data_versions(tbl) VALUES ('members'),('deposits'),('meals'),('meal_parts'),('notices'),
+           ('audit_logs'),('games'),('hogu_stats') ON CONFLICT (tbl) DO NOTHING;""",
+        # 문장 단위 트리거가 없어 행 단위로 올린다(여러 행 문장이면 그만큼 올라갈 뿐 키로서는 같다).
+        *(f"""CREATE TRIGGER IF NOT EXISTS tr_{t}_version_{op.lower()} AFTER {op} ON {t}
+              BEGIN UPDATE data_versions SET version = version + 1 WHERE tbl = '{t}'; END;"""
+          for t in ("members", "deposits", "meals", "meal_parts", "notices", "audit_logs", "games", "hogu_stats")
+          for op in ("INSERT", "UPDATE", "DELETE")),
+    ]),
+    (13, "주사위 진행 상태", [
+        """CREATE TABLE IF NOT EXISTS dice_games(
+          nonce TEXT PRIMARY KEY,
+          players TEXT NOT NULL,
+          rule_id TEXT NOT NULL,
+          max_dice INTEGER NOT NULL,
+          turn INTEGER NOT NULL DEFAULT 0,
+          skips TEXT NOT NULL DEFAULT '[]',
+          finished INTEGER NOT NULL DEFAULT 0,
+          created_at TEXT NOT NULL
+        );""",
+    ]),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+assert SQLITE_MIGRATIONS[-1][0] == SCHEMA_VERSION
+PostgresStorage.migrations = MIGRATIONS
+SqliteStorage.migrations = SQLITE_MIGRATIONS
 
-    db_execute("""CREATE TABLE IF NOT EXISTS meal_parts(
-      id SERIAL PRIMARY KEY,
-      meal_id INTEGER NOT NULL,
+def get_schema_version():
+    # schema_migrations 가 없으면(마이그레이션 도입 전 DB) 0
+    try:
+        row = db_execute("SELECT COALESCE(MAX(version), 0) AS v FROM schema_migrations;").fetchone()
+    except storage.UndefinedTable:
+        get_db().rollback()
+        return 0
+    return row["v"]
+
+def migrate():
+    """미적용 버전을 순서대로 적용(버전마다 한 트랜잭션). 적용한 버전 목록 반환."""
+    db_execute("""CREATE TABLE IF NOT EXISTS schema_migrations(
+      version INTEGER PRIMARY KEY,
       name TEXT NOT NULL,
-      main_amount INTEGER NOT NULL DEFAULT 0,
-      side_amount INTEGER NOT NULL DEFAULT 0,
-      total_amount INTEGER NOT NULL DEFAULT 0,
-      CONSTRAINT fk_mp_meal FOREIGN KEY(meal_id) REFERENCES meals(id) ON DELETE CASCADE,
-      CONSTRAINT fk_mp_member FOREIGN KEY(name) REFERENCES members(name) ON DELETE CASCADE
-    );""")
-
-    db_execute("""CREATE TABLE IF NOT EXISTS notices(
-      id SERIAL PRIMARY KEY,
-      dt TEXT NOT NULL,
-      content TEXT NOT NULL
-    );""")
-
-    # 감사 로그
-    db_execute("""CREATE TABLE IF NOT EXISTS audit_logs(
-      id SERIAL PRIMARY KEY,
-      dt TEXT NOT NULL,
-      action TEXT NOT NULL,        -- insert/update/delete
-      target_table TEXT NOT NULL,  -- deposits/meals/meal_parts/notices
-      target_id INTEGER,
-      payload TEXT                  -- JSON string
-    );""")
-
-    # 게임 기록 & 통계
-    db_execute("""CREATE TABLE IF NOT EXISTS games(
-      id SERIAL PRIMARY KEY,
-      dt TEXT NOT NULL,
-      game_type TEXT NOT NULL,     -- dice/ladder/oddcard
-      rule TEXT NOT NULL,          -- rule text
-      participants TEXT NOT NULL,  -- JSON list of names
-      winner TEXT,                 -- optional
-      loser TEXT,                  -- main loser
-      extra TEXT                   -- JSON for extra info
+      applied_at TEXT NOT NULL
     );""")
+    get_db().commit()
+    applied = []
+    for version, name, statements in storage.migrations:
+        storage.lock_migrations()
+        if get_schema_version() >= version:
+            get_db().rollback()
+            continue
+        for stmt in statements:
+            db_execute(stmt)
+        db_execute("INSERT INTO schema_migrations(version, name, applied_at) VALUES (?,?,?);",
+                   (version, name, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+        get_db().commit()
+        applied.append(version)
+    return applied
 
-    db_execute("""CREATE TABLE IF NOT EXISTS hogu_stats(
-      name TEXT PRIMARY KEY,
-      losses INTEGER NOT NULL DEFAULT 0
-    );""")
+_schema_checked = False
 
-    get_db().commit()
+def schema_is_current():
+    # 워커당 최초 1회만 버전 조회(쿼리 1개). 최신이면 이후로는 DB를 보지 않는다.
+    global _schema_checked
+    if not _schema_checked:
+        _schema_checked = get_schema_version() >= SCHEMA_VERSION
+    return _schema_checked
 
 def log_audit(action, table, target_id=None, payload=None):
     db_execute(
@@ -114,17 +850,89 @@ def log_audit(action, table, target_id=None, payload=None):
         (datetime.now().strftime("%Y-%m-%d %H:%M:%S"), action, table, target_id, json.dumps(payload or {}, ensure_ascii=False))
     )
 
-# Flask 3.x 호환: 모듈 임포트 시 테이블 보장
-with app.app_context():
-    try:
-        init_db()
-    except Exception as e:
-        app.logger.warning(f"DB init skipped or already exists: {e}")
+# ------------------ 팀원 목록 캐시 ------------------
+# 팀원 목록은 거의 안 바뀌는데 대부분의 화면이 쓴다. 워커마다 한 번 읽어 <option> HTML 까지 만들어 두고,
+# members 트리거의 NOTIFY(lunch_members)를 받는 리스너 스레드가 버전을 올리면 다음 사용 때 다시 읽는다.
+# 리스너가 연결돼 있지 않은 동안에는 캐시를 믿지 않고 매번 조회한다.
+MEMBERS_CHANNEL = "lunch_members"
+
+MemberSnapshot = namedtuple("MemberSnapshot", "version names options datalist")
+MEMBER_NAMES_SQL = "SELECT name FROM members ORDER BY name;"
+
+def member_datalist_html(names):
+    return "".join([f"<option value='{html_escape(n)}'>" for n in names])
+
+class MemberDirectory:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = 0          # 변경 알림마다 +1
+        self.snap = None
+        self.listening = threading.Event()
+        self.thread = None
+
+    def invalidate(self):
+        with self.lock:
+            self.version += 1
+
+    def snapshot(self):
+        self._ensure_listener()
+        with self.lock:
+            version, snap = self.version, self.snap
+        if snap is not None and snap.version == version and self.listening.is_set():
+            return snap
+        names = [r["name"] for r in db_execute(MEMBER_NAMES_SQL).fetchall()]
+        esc = [html_escape(n) for n in names]
+        snap = MemberSnapshot(version, tuple(names),
+                              "".join([f"<option value='{e}'>{e}</option>" for e in esc]),
+                              member_datalist_html(names))
+        with self.lock:
+            self.snap = snap
+        return snap
+
+    def _ensure_listener(self):
+        with self.lock:
+            started = self.thread is None or not self.thread.is_alive()
+            if started:
+                # --preload 로 fork 된 뒤 워커 안에서 처음 쓸 때 시작
+                self.thread = threading.Thread(target=self._run, name="member-listener", daemon=True)
+                self.thread.start()
+        if started:
+            self.listening.wait(2)
+
+    def _run(self):
+        while True:
+            listener = None
+            try:
+                listener = storage.listen([MEMBERS_CHANNEL])
+                self.invalidate()  # 연결 전(또는 끊긴 동안)의 변경은 알림을 못 받았으므로
+                self.listening.set()
+                while True:
+                    if listener.wait(60):
+                        self.invalidate()
+                    else:
+                        listener.ping()
+            except storage.Error:
+                self.listening.clear()
+                if listener is not None:
+                    listener.close()
+                time.sleep(1)
+
+member_directory = MemberDirectory()
 
-# ------------------ 유틸 ------------------
 def get_members():
-    cur = db_execute("SELECT name FROM members ORDER BY name;")
-    return [r["name"] for r in cur.fetchall()]
+    return list(member_directory.snapshot().names)
+
+def member_options(selected=None):
+    opts = member_directory.snapshot().options
+    if selected:
+        e = html_escape(selected)
+        opts = opts.replace(f"<option value='{e}'>", f"<option value='{e}' selected>", 1)
+    return opts
+
+def member_datalist():
+    return member_directory.snapshot().datalist
+
+# ------------------ 유틸 ------------------
 
 def split_even(total, n):
     if n <= 0: return []
@@ -134,24 +942,63 @@ def split_even(total, n):
     for i in range(rem): shares[i] += 1
     return shares
 
+# 이름은 members 에만 있다. 입금/식사/분담 행은 member_id(payer_id)로 참조하고, 화면용으로 이름을 붙여 읽는다.
+MEMBER_ID_SQL = "(SELECT id FROM members WHERE name = ?)"
+DEPOSIT_SELECT = "SELECT d.*, mb.name FROM deposits d JOIN members mb ON mb.id = d.member_id"
+MEAL_SELECT = "SELECT m.*, pm.name AS payer_name FROM meals m LEFT JOIN members pm ON pm.id = m.payer_id"
+MEAL_PARTS_SELECT = "SELECT p.*, mb.name FROM meal_parts p JOIN members mb ON mb.id = p.member_id"
+
+# (dt, 이름, 금액, 메모) 배열 → 입금 행 여러 개를 한 문장으로. 없는 이름은 건너뛴다.
+INSERT_DEPOSITS_SQL = """
+    INSERT INTO deposits(dt, member_id, amount, note)
+    SELECT x.dt, mb.id, x.amount, x.note
+    FROM unnest(?::text[], ?::text[], ?::int[], ?::text[]) AS x(dt, name, amount, note)
+    JOIN members mb ON mb.name = x.name;
+"""
+
+# 입금/사용/잔액을 원본 테이블에서 한 번에 집계 (팀원별 1행)
+BALANCES_SQL = """
+    SELECT m.name,
+           COALESCE(d.s, 0) AS deposit,
+           COALESCE(u.s, 0) AS used,
+           COALESCE(d.s, 0) - COALESCE(u.s, 0) AS balance
+    FROM members m
+    LEFT JOIN (SELECT member_id, SUM(amount) AS s FROM deposits GROUP BY member_id) d ON d.member_id = m.id
+    LEFT JOIN (SELECT member_id, SUM(total_amount) AS s FROM meal_parts GROUP BY member_id) u ON u.member_id = m.id
+    ORDER BY m.name;
+"""
+
 def get_balances():
-    members = get_members()
-    dep_map = {m: 0 for m in members}
-    cur = db_execute("SELECT name, SUM(amount) AS s FROM deposits GROUP BY name;")
-    for r in cur.fetchall(): dep_map[r["name"]] = r["s"] or 0
-    use_map = {m: 0 for m in members}
-    cur = db_execute("SELECT name, SUM(total_amount) AS s FROM meal_parts GROUP BY name;")
-    for r in cur.fetchall(): use_map[r["name"]] = r["s"] or 0
-    return [{"name": m, "deposit": dep_map.get(m,0), "used": use_map.get(m,0),
-             "balance": dep_map.get(m,0)-use_map.get(m,0)} for m in members]
+    return [dict(r) for r in db_execute(BALANCES_SQL).fetchall()]
+
+BALANCES_FOR_SQL = """
+    SELECT m.name,
+           COALESCE((SELECT SUM(amount) FROM deposits d WHERE d.member_id = m.id), 0) AS deposit,
+           COALESCE((SELECT SUM(total_amount) FROM meal_parts p WHERE p.member_id = m.id), 0) AS used
+    FROM members m WHERE m.name = ANY(?);
+"""
+
+# 팀원 전체(이름순) 잔액을 팀원마다 인덱스만 훑어 계산 — 행을 이름순으로 바로 내보낼 수 있어 흘려보내는 화면용
+MEMBER_BALANCES_SQL = """
+    SELECT m.name,
+           COALESCE((SELECT SUM(amount) FROM deposits d WHERE d.member_id = m.id), 0)
+           - COALESCE((SELECT SUM(total_amount) FROM meal_parts p WHERE p.member_id = m.id), 0) AS balance
+    FROM members m ORDER BY m.name;
+"""
 
 def get_balance_of(name):
-    dep = (db_execute("SELECT COALESCE(SUM(amount),0) AS s FROM deposits WHERE name=?;", (name,)).fetchone() or {}).get("s",0)
-    used = (db_execute("SELECT COALESCE(SUM(total_amount),0) AS s FROM meal_parts WHERE name=?;", (name,)).fetchone() or {}).get("s",0)
+    dep = (db_execute(f"SELECT COALESCE(SUM(amount),0) AS s FROM deposits WHERE member_id={MEMBER_ID_SQL};", (name,)).fetchone() or {}).get("s",0)
+    used = (db_execute(f"SELECT COALESCE(SUM(total_amount),0) AS s FROM meal_parts WHERE member_id={MEMBER_ID_SQL};", (name,)).fetchone() or {}).get("s",0)
     return dep - used
 
+MEAL_COUNTS_SQL = """
+    SELECT mb.name, c.c
+    FROM (SELECT member_id, COUNT(*) AS c FROM meal_parts GROUP BY member_id) c
+    JOIN members mb ON mb.id = c.member_id;
+"""
+
 def get_meal_counts_map():
-    rows = db_execute("SELECT name, COUNT(*) AS c FROM meal_parts GROUP BY name;").fetchall()
+    rows = db_execute(MEAL_COUNTS_SQL).fetchall()
     return {r["name"]: (r["c"] or 0) for r in rows}
 
 def html_escape(s):
@@ -160,14 +1007,219 @@ def html_escape(s):
 
 def delete_auto_deposit_for_meal(meal_id:int):
     db_execute("DELETE FROM deposits WHERE note LIKE ?;", (f"%식사 #{meal_id} 선결제 상환%",))
-    get_db().commit()
     log_audit("delete", "deposits", None, {"auto_by_meal": meal_id})
+    get_db().commit()
 
-def upsert_hogu_loss(name, n=1):
-    if not name:
-        return
-    db_execute("INSERT INTO hogu_stats(name, losses) VALUES (?,?) ON CONFLICT(name) DO UPDATE SET losses=hogu_stats.losses+?;",
-               (name, n, n))
+GAME_TYPES = {"dice": "주사위", "ladder": "사다리", "oddcard": "외톨이 카드"}
+
+# games 행 + 참가자 행 + 호구 카운터(누적/일별)를 한 문장(한 왕복)으로 기록.
+# idem_key 가 이미 있으면 아무것도 쓰지 않고 기존 게임 id 를 돌려준다.
+RECORD_GAME_SQL = """
+WITH g AS (
+  INSERT INTO games(dt, game_type, rule, participants, winner, loser, extra, idem_key)
+  VALUES (?,?,?,?,?,?,?,?)
+  ON CONFLICT (idem_key) DO NOTHING
+  RETURNING id, dt, game_type, loser
+), gp AS (
+  INSERT INTO game_participants(game_id, seat, name, is_loser)
+  SELECT g.id, p.ord - 1, p.name, p.name = COALESCE(g.loser, '')
+  FROM g, unnest(?::text[]) WITH ORDINALITY AS p(name, ord)
+), hs AS (
+  INSERT INTO hogu_stats(name, losses)
+  SELECT loser, 1 FROM g WHERE loser <> ''
+  ON CONFLICT(name) DO UPDATE SET losses = hogu_stats.losses + 1
+), hd AS (
+  INSERT INTO hogu_daily(day, game_type, name, losses)
+  SELECT substr(dt, 1, 10), game_type, loser, 1 FROM g WHERE loser <> ''
+  ON CONFLICT(day, game_type, name) DO UPDATE SET losses = hogu_daily.losses + 1
+)
+SELECT id, TRUE AS created FROM g
+UNION ALL
+SELECT id, FALSE FROM games WHERE idem_key = ? AND NOT EXISTS (SELECT 1 FROM g);
+"""
+
+def _record_game_sqlite(dt, game_type, rule, players, loser, extra, winner, idem_key):
+    # SQLite 에는 데이터 변경 CTE 가 없어 RECORD_GAME_SQL 과 같은 내용을 문장 여러 개로 (같은 트랜잭션)
+    g = db_execute("""INSERT INTO games(dt, game_type, rule, participants, winner, loser, extra, idem_key)
+                      VALUES (?,?,?,?,?,?,?,?) ON CONFLICT (idem_key) DO NOTHING RETURNING id;""",
+                   (dt, game_type, rule, json.dumps(players, ensure_ascii=False), winner, loser,
+                    json.dumps(extra or {}, ensure_ascii=False), idem_key)).fetchone()
+    if g is None:
+        return db_execute("SELECT id, FALSE AS created FROM games WHERE idem_key=?;", (idem_key,)).fetchone()
+    db_execute("""INSERT INTO game_participants(game_id, seat, name, is_loser)
+                  SELECT ?, p.ord - 1, p.name, p.name = ? FROM unnest(?::text[]) WITH ORDINALITY AS p(name, ord);""",
+               (g["id"], loser or "", list(players)))
+    if loser:
+        db_execute("INSERT INTO hogu_stats(name, losses) VALUES (?, 1) ON CONFLICT(name) DO UPDATE SET losses = hogu_stats.losses + 1;",
+                   (loser,))
+        db_execute("""INSERT INTO hogu_daily(day, game_type, name, losses) VALUES (?, ?, ?, 1)
+                      ON CONFLICT(day, game_type, name) DO UPDATE SET losses = hogu_daily.losses + 1;""",
+                   (dt[:10], game_type, loser))
+    return {"id": g["id"], "created": True}
+
+def record_game_result(game_type, rule, players, loser, extra=None, winner=None, idem_key=None):
+    """모든 게임 결과의 단일 기록 경로. return: (game_id, 새로 기록했는지)"""
+    dt = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    if storage.dialect == "sqlite":
+        row = _record_game_sqlite(dt, game_type, rule, players, loser, extra, winner, idem_key)
+    else:
+        row = db_execute(RECORD_GAME_SQL, (
+            dt, game_type, rule, json.dumps(players, ensure_ascii=False), winner, loser,
+            json.dumps(extra or {}, ensure_ascii=False), idem_key, list(players), idem_key,
+        )).fetchone()
+    if row and row["created"]:
+        notify_live("game", id=row["id"], type=game_type, loser=loser)
+    get_db().commit()
+    if row is None:
+        # 같은 키로 동시에 들어온 요청이 먼저 커밋한 경우: 이 문장의 스냅샷에는 안 보였으므로 다시 조회
+        row = db_execute("SELECT id, FALSE AS created FROM games WHERE idem_key=?;", (idem_key,)).fetchone()
+    return row["id"], row["created"]
+
+def find_recorded_game(idem_key):
+    row = db_execute("SELECT id FROM games WHERE idem_key=?;", (idem_key,)).fetchone() if idem_key else None
+    return row["id"] if row else None
+
+# ------------------ 읽기 화면: 쿼리 / 렌더 분리 ------------------
+# 읽기 위주 화면은 queries(args) → {키: (sql, params)} 와 page(args, data) → body html 로 나눈다.
+# 동기 라우트는 db_execute 로, asgi.py(비동기 모드)는 asyncpg 로 같은 쿼리를 실행해 같은 page 로 렌더한다.
+ReadView = namedtuple("ReadView", "queries page")
+READ_VIEWS = {}
+
+def read_view(endpoint, queries):
+    def deco(page):
+        READ_VIEWS[endpoint] = ReadView(queries, page)
+        return page
+    return deco
+
+def run_read_queries(queries):
+    return {k: [dict(r) for r in db_execute(sql, params).fetchall()] for k, (sql, params) in queries.items()}
+
+def serve_read_view(endpoint):
+    view = READ_VIEWS[endpoint]
+    return render(view.page(request.args, run_read_queries(view.queries(request.args))))
+
+# ------------------ 실시간 갱신 (LISTEN/NOTIFY → SSE, 폴링 대체) ------------------
+# 쓰기 경로는 커밋 전에 storage.notify(pg_notify) 로 "무엇이 바뀌었는지"만 알린다(커밋될 때 전달).
+# asgi.py(비동기 모드)는 워커마다 LISTEN 연결 하나로 알림을 받아 필요한 값만 한 번 조회하고(live_delta_query →
+# live_delta), 접속한 브라우저마다의 큐로 /events SSE 델타를 뿌린다. 연결은 이벤트 루프에서 기다리므로 스레드를 잡지 않는다.
+# 스레드 모드(gunicorn)나 SQLite 에서는 연결마다 스레드를 점유하는 SSE 대신, 화면이 LIVE_POLL_SECONDS 마다
+# /live 에 커서를 보내 바뀐 것만 받는다(작은 쿼리 1개, 갱신은 최대 LIVE_POLL_SECONDS 늦음).
+LIVE_CHANNEL = "lunch_live"
+LIVE_SSE_ENVIRON = "lunch.live_sse"   # asgi 가 /events 를 서비스하는 요청이면 environ 에 True
+
+def notify_live(kind, **payload):
+    storage.notify(LIVE_CHANNEL, json.dumps({"t": kind, **payload}, ensure_ascii=False))
+
+def notify_balances(*names):
+    names = sorted({n for n in names if n})
+    if names:
+        notify_live("balance", names=names)
+
+def live_delta_query(msg):
+    """알림 → 델타를 만드는 데 필요한 (sql, params). 조회가 필요 없으면 None"""
+    if msg.get("t") == "balance":
+        return BALANCES_FOR_SQL, (msg["names"],)
+    if msg.get("t") == "game" and msg.get("loser"):
+        return "SELECT losses FROM hogu_stats WHERE name=?;", (msg["loser"],)
+    return None
+
+def live_delta(msg, rows):
+    if msg.get("t") == "balance":
+        return {"t": "balance", "rows": [{"name": r["name"], "deposit": r["deposit"], "used": r["used"],
+                                          "balance": r["deposit"] - r["used"]} for r in rows]}
+    if msg.get("t") == "game" and msg.get("loser"):
+        return {**msg, "losses": rows[0]["losses"] if rows else 0}
+    return msg
+
+@app.get("/events")
+def events():
+    # SSE 는 asgi.py 가 이 경로를 가로채 서비스한다. 여기(스레드 모드)로 오면 204 → EventSource 가 재접속하지 않음
+    return Response(status=204)
+
+LIVE_POLL_SECONDS = int(os.environ.get("LIVE_POLL_SECONDS", "5"))
+LIVE_GAMES_MAX = 10   # 한 번에 보내는 게임 결과 수 (오래 숨겨져 있던 화면은 최근 것만)
+LIVE_CURSOR_SQL = """
+    SELECT (SELECT COALESCE(MAX(id), 0) FROM games) AS game,
+           (SELECT CAST(COALESCE(SUM(version), 0) AS BIGINT) FROM data_versions
+            WHERE tbl IN ('members', 'deposits', 'meals', 'meal_parts')) AS bal;
+"""
+LIVE_GAMES_SQL = """
+    SELECT g.id, g.game_type, g.loser, COALESCE(h.losses, 0) AS losses
+    FROM games g LEFT JOIN hogu_stats h ON h.name = g.loser
+    WHERE g.id > ? ORDER BY g.id DESC LIMIT ?;
+"""
+
+class LiveBalances:
+    """잔액 버전(커서의 bal)별 전체 잔액 행. 같은 버전을 묻는 화면들은 마지막 집계를 그대로 받는다."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version, self.rows = None, []
+
+    def get(self, version):
+        with self.lock:
+            if self.version == version:
+                return self.rows
+        rows = get_balances()
+        with self.lock:
+            self.version, self.rows = version, rows
+        return rows
+
+live_balances = LiveBalances()
+
+def live_cursor():
+    return dict(db_execute(LIVE_CURSOR_SQL).fetchone())
+
+@app.get("/live")
+def live():
+    cursor = live_cursor()
+    since_game = request.args.get("game", type=int)
+    since_bal = request.args.get("bal", type=int)
+    events = []
+    if since_game is not None and cursor["game"] > since_game:
+        rows = db_execute(LIVE_GAMES_SQL, (since_game, LIVE_GAMES_MAX)).fetchall()
+        events += [{"t": "game", "id": r["id"], "type": r["game_type"], "loser": r["loser"], "losses": r["losses"]}
+                   for r in reversed(rows)]
+    if since_bal is not None and cursor["bal"] != since_bal:
+        events.append({"t": "balance", "rows": live_balances.get(cursor["bal"])})
+    return {"cursor": cursor, "events": events}
+
+LIVE_SSE_JS = """
+<script>
+  (function(){
+    if (!window.EventSource) return;
+    const es = new EventSource('%s');
+    ['balance', 'game'].forEach(function(t){
+      es.addEventListener(t, function(e){ document.dispatchEvent(new CustomEvent('live:' + t, {detail: JSON.parse(e.data)})); });
+    });
+  })();
+</script>
+"""
+
+LIVE_JS = """
+<script>
+  (function(){
+    let cursor = %s;
+    async function poll() {
+      if (!document.hidden) {
+        try {
+          const resp = await fetch('%s?' + new URLSearchParams(cursor));
+          const res = await resp.json();
+          cursor = res.cursor;
+          res.events.forEach(function(ev){ document.dispatchEvent(new CustomEvent('live:' + ev.t, {detail: ev})); });
+        } catch (e) {}
+      }
+      setTimeout(poll, %d);
+    }
+    setTimeout(poll, %d);
+  })();
+</script>
+"""
+
+def live_script(cursor):
+    # asgi 면 SSE, 아니면 폴링. cursor: 화면을 만든 시점의 live_cursor() — 폴링은 그 뒤의 변경부터 받는다
+    if request.environ.get(LIVE_SSE_ENVIRON):
+        return LIVE_SSE_JS % url_for("events")
+    return LIVE_JS % (json.dumps(cursor), url_for("live"), LIVE_POLL_SECONDS * 1000, LIVE_POLL_SECONDS * 1000)
 
 # ------------------ 로그인 보호 ------------------
 @app.before_request
@@ -176,6 +1228,15 @@ def require_login():
         if not session.get("authed"):
             return redirect(url_for("login"))
 
+@app.before_request
+def require_current_schema():
+    # 부팅 시 DDL 대신 워커별 첫 요청에서 스키마 버전만 확인
+    if request.path in ("/login", "/favicon.ico", "/ping") or request.endpoint == "static":
+        return
+    if not schema_is_current():
+        return (f"DB 스키마가 최신이 아닙니다. (필요: v{SCHEMA_VERSION}) "
+                f"`flask --app main migrate` 를 먼저 실행하세요.", 503)
+
 # ------------------ 템플릿 ------------------
 BASE = """
 <!doctype html>
@@ -271,6 +1332,26 @@ BASE = """
 def render(body_html, **ctx):
     # BASE 템플릿에 body_html 꽂아서 렌더링
     return render_template_string(BASE, body=body_html, **ctx)
+
+# 큰 표는 본문을 다 만든 뒤 보내지 않고 흘려보낸다: BASE 머리 + 표 머리를 바로 보내고(첫 바이트가 행 수와 무관),
+# 행 html 은 STREAM_CHUNK_ROWS 개씩 묶어 보낸 뒤 나머지 본문과 BASE 꼬리를 보낸다.
+ROWS_MARK = "<!--rows-->"
+STREAM_CHUNK_ROWS = 200
+
+def render_stream(body_html, rows, after_rows=None):
+    """body_html 의 ROWS_MARK 자리에 rows(행 html 들)를 흘려보내는 응답.
+    after_rows(): 행을 다 보낸 뒤 같은 자리에 붙일 html(빈 목록 안내, 합계 채우기 등)."""
+    top, bottom = render(body_html).split(ROWS_MARK)  # 플래시는 여기서(응답 헤더 전에) 소비
+    def gen():
+        yield top
+        chunk = []
+        for html in rows:
+            chunk.append(html)
+            if len(chunk) >= STREAM_CHUNK_ROWS:
+                yield "".join(chunk)
+                chunk = []
+        yield "".join(chunk) + (after_rows() if after_rows else "") + bottom
+    return Response(stream_with_context(gen()), mimetype="text/html")
     
 # ------------------ 로그인/로그아웃/핑 ------------------
 @app.route("/login", methods=["GET", "POST"])
@@ -312,14 +1393,20 @@ def ping():
     return "OK", 200
 
 # ------------------ 홈 ------------------
-@app.route("/")
-def home():
-    members = get_members()
+def _home_queries(args):
+    return {"balances": (BALANCES_SQL, ()),
+            "notices": ("SELECT dt, content FROM notices ORDER BY id DESC LIMIT 5;", ()),
+            "counts": (MEAL_COUNTS_SQL, ())}
+
+@read_view("home", _home_queries)
+def home_page(args, data):
+    balances = data["balances"]  # 팀원 전체(이름순)
+    members = [b["name"] for b in balances]
 
     # 마이너스 잔액 공지
     notice_html = ""
     if members:
-        negatives = [b for b in get_balances() if b["balance"] < 0]
+        negatives = [b for b in balances if b["balance"] < 0]
         if negatives:
             items = "".join([
                 f"<li><strong>{b['name']}</strong> : <span class='text-danger'>{b['balance']:,}원</span></li>"
@@ -336,7 +1423,7 @@ def home():
 
     # 공지 5개
     notices_html = ""
-    nrows = db_execute("SELECT dt, content FROM notices ORDER BY id DESC LIMIT 5;").fetchall()
+    nrows = data["notices"]
     if nrows:
         lis = "".join([
             f"<li><span class='text-muted me-2'>[{r['dt']}]</span>{html_escape(r['content'])}</li>"
@@ -348,8 +1435,8 @@ def home():
           <ul class="mb-0">{lis}</ul>
         </div>"""
 
-    balances_map = {b["name"]: b["balance"] for b in get_balances()}
-    counts_map = get_meal_counts_map()
+    balances_map = {b["name"]: b["balance"] for b in balances}
+    counts_map = {r["name"]: (r["c"] or 0) for r in data["counts"]}
     member_items = "".join([
         f"<li class='d-flex justify-content-between'><span>{n}</span>"
         f"<span class='text-white-50'>잔액 {balances_map.get(n,0):,}원 · 식사 {counts_map.get(n,0)}회</span></li>"
@@ -372,7 +1459,11 @@ def home():
       </div>
     </div>
     """
-    return render(body)
+    return body
+
+@app.route("/")
+def home():
+    return serve_read_view("home")
 
 # ------------------ 공지사항 ------------------
 @app.route("/notices", methods=["GET", "POST"])
@@ -382,8 +1473,8 @@ def notices():
         if content:
             db_execute("INSERT INTO notices(dt, content) VALUES (?,?);",
                        (datetime.now().strftime("%Y-%m-%d %H:%M"), content))
-            get_db().commit()
             log_audit("insert", "notices", None, {"content": content})
+            get_db().commit()
             flash("공지사항이 등록되었습니다.", "success")
         else:
             flash("내용을 입력하세요.", "warning")
@@ -434,8 +1525,8 @@ def notice_delete():
     if nid:
         row = db_execute("SELECT * FROM notices WHERE id=?;", (nid,)).fetchone()
         db_execute("DELETE FROM notices WHERE id=?;", (nid,))
-        get_db().commit()
         log_audit("delete", "notices", nid, row)
+        get_db().commit()
         flash("삭제되었습니다.", "info")
     return redirect(url_for("notices"))
 
@@ -447,30 +1538,13 @@ def settings():
         if new_name:
             cur = db_execute("INSERT INTO members(name) VALUES (?) ON CONFLICT (name) DO NOTHING;", (new_name,))
             get_db().commit()
+            member_directory.invalidate()
             if cur.rowcount == 0:
                 flash("이미 존재하는 이름입니다.", "warning")
             else:
                 flash(f"팀원 <b>{html_escape(new_name)}</b> 추가 완료.", "success")
         return redirect(url_for('settings'))
 
-    members = get_members()
-    rows = ""
-    for nm in members:
-        bal = get_balance_of(nm)
-        bal_html = f"{bal:,}"
-        badge = f"<span class='badge bg-danger'>잔액 {bal_html}원</span>" if bal != 0 else "<span class='badge bg-success'>잔액 0원</span>"
-        rows += f"""
-        <tr>
-          <td>{nm}</td>
-          <td class="num">{bal_html}</td>
-          <td>{badge}</td>
-          <td>
-            <form method="post" action="{ url_for('member_delete') }" onsubmit="return confirmDelete('{nm}', {bal});">
-              <input type="hidden" name="name" value="{nm}">
-              <button class="btn btn-sm btn-outline-danger">삭제</button>
-            </form>
-          </td>
-        </tr>"""
     body = f"""
     <div class="row g-3">
       <div class="col-12 col-lg-7">
@@ -481,7 +1555,7 @@ def settings():
             <div class="table-responsive">
               <table class="table table-sm align-middle">
                 <thead><tr><th>이름</th><th class='text-end'>잔액</th><th>상태</th><th>관리</th></tr></thead>
-                <tbody>{rows}</tbody>
+                <tbody>{ROWS_MARK}</tbody>
               </table>
             </div>
           </div>
@@ -510,7 +1584,30 @@ def settings():
       }}
     </script>
     """
-    return render(body)
+    return render_stream(body, (_settings_row_html(r["name"], r["balance"]) for r in db_stream(MEMBER_BALANCES_SQL)))
+
+def _settings_row_html(nm, bal):
+    bal_html = f"{bal:,}"
+    badge = f"<span class='badge bg-danger'>잔액 {bal_html}원</span>" if bal != 0 else "<span class='badge bg-success'>잔액 0원</span>"
+    return f"""
+        <tr>
+          <td>{nm}</td>
+          <td class="num">{bal_html}</td>
+          <td>{badge}</td>
+          <td>
+            <div class="d-flex gap-1">
+              <form method="post" action="{ url_for('member_rename') }" class="d-flex gap-1">
+                <input type="hidden" name="name" value="{nm}">
+                <input class="form-control form-control-sm" name="new_name" placeholder="새 이름" style="max-width:120px">
+                <button class="btn btn-sm btn-outline-primary">이름 변경</button>
+              </form>
+              <form method="post" action="{ url_for('member_delete') }" onsubmit="return confirmDelete('{nm}', {bal});">
+                <input type="hidden" name="name" value="{nm}">
+                <button class="btn btn-sm btn-outline-danger">삭제</button>
+              </form>
+            </div>
+          </td>
+        </tr>"""
 
 @app.post("/member/delete")
 def member_delete():
@@ -521,11 +1618,80 @@ def member_delete():
         flash(f"잔액이 0원이 아닌 팀원은 삭제할 수 없습니다. (현재: {bal:,}원)", "warning")
         return redirect(url_for('settings'))
     db_execute("DELETE FROM members WHERE name=?;", (nm,))
-    get_db().commit()
     log_audit("delete", "members", None, {"name": nm})
+    get_db().commit()
+    member_directory.invalidate()
     flash(f"<b>{html_escape(nm)}</b> 삭제 완료.", "success")
     return redirect(url_for('settings'))
 
+MEAL_FIELD_PREFIXES = ("ate", "main", "side", "tot")  # 식사 폼의 팀원별 필드: <접두>_<이름>
+
+def _rename_in_template_fields(fields, old, new):
+    out = {}
+    for k, v in fields.items():
+        prefix, _, who = k.partition("_")
+        out[f"{prefix}_{new}" if who == old and prefix in MEAL_FIELD_PREFIXES else k] = v
+    if out.get("payer_name") == old:
+        out["payer_name"] = new
+    return out
+
+def _rename_in_json(value, old, new):
+    # 게임 extra 처럼 이름이 값(또는 oddcard assignment 의 키)으로 들어 있는 JSON. 이름과 정확히 같은 문자열만 바꾼다.
+    if value == old:
+        return new
+    if isinstance(value, list):
+        return [_rename_in_json(v, old, new) for v in value]
+    if isinstance(value, dict):
+        return {(new if k == old else k): _rename_in_json(v, old, new) for k, v in value.items()}
+    return value
+
+def rename_game_records(old, new):
+    """게임 기록(games, game_participants)과 호구 롤업의 이름을 바꾼다. 새 이름으로 이미 쌓인 기록(같은 이름의 게스트)과는 합친다."""
+    for game in db_execute("""SELECT g.id, g.participants, g.winner, g.loser, g.extra FROM games g
+                           WHERE g.id IN (SELECT game_id FROM game_participants WHERE name=?);""", (old,)).fetchall():
+        db_execute("UPDATE games SET participants=?, winner=?, loser=?, extra=? WHERE id=?;", (
+            json.dumps(_rename_in_json(json.loads(game["participants"]), old, new), ensure_ascii=False),
+            _rename_in_json(game["winner"], old, new), _rename_in_json(game["loser"], old, new),
+            json.dumps(_rename_in_json(json.loads(game["extra"] or "{}"), old, new), ensure_ascii=False), game["id"]))
+    db_execute("UPDATE game_participants SET name=? WHERE name=?;", (new, old))
+    db_execute("""INSERT INTO hogu_stats(name, losses) SELECT ?, losses FROM hogu_stats WHERE name=?
+                  ON CONFLICT(name) DO UPDATE SET losses = hogu_stats.losses + EXCLUDED.losses;""", (new, old))
+    db_execute("DELETE FROM hogu_stats WHERE name=?;", (old,))
+    db_execute("""INSERT INTO hogu_daily(day, game_type, name, losses) SELECT day, game_type, ?, losses FROM hogu_daily WHERE name=?
+                  ON CONFLICT(day, game_type, name) DO UPDATE SET losses = hogu_daily.losses + EXCLUDED.losses;""", (new, old))
+    db_execute("DELETE FROM hogu_daily WHERE name=?;", (old,))
+
+@app.post("/member/rename")
+def member_rename():
+    # 기록은 member_id 로 연결돼 있어 members 한 행만 바꾸면 된다. 식사 템플릿과 게임 기록·호구 롤업은
+    # 이름으로 저장돼 있어 같은 트랜잭션에서 함께 고친다(/games/history?player= 와 순위가 새 이름으로 이어진다).
+    old = (request.form.get("name") or "").strip()
+    new = (request.form.get("new_name") or "").strip()
+    if not old or not new or old == new:
+        flash("새 이름을 확인하세요.", "warning")
+        return redirect(url_for('settings'))
+    try:
+        row = db_execute("UPDATE members SET name=? WHERE name=? RETURNING id;", (new, old)).fetchone()
+    except storage.UniqueViolation:
+        get_db().rollback()
+        flash("이미 존재하는 이름입니다.", "warning")
+        return redirect(url_for('settings'))
+    if row is None:
+        get_db().rollback()
+        flash("해당 팀원이 없습니다.", "warning")
+        return redirect(url_for('settings'))
+    for t in db_execute("SELECT id, fields FROM meal_templates;").fetchall():
+        fields = json.loads(t["fields"])
+        renamed = _rename_in_template_fields(fields, old, new)
+        if renamed != fields:
+            db_execute("UPDATE meal_templates SET fields=? WHERE id=?;", (json.dumps(renamed, ensure_ascii=False), t["id"]))
+    rename_game_records(old, new)
+    log_audit("update", "members", row["id"], {"rename": {"before": old, "after": new}})
+    get_db().commit()
+    member_directory.invalidate()
+    flash(f"<b>{html_escape(old)}</b> → <b>{html_escape(new)}</b> 이름 변경 완료.", "success")
+    return redirect(url_for('settings'))
+
 # ------------------ 입금: 등록/목록/수정/삭제 ------------------
 @app.route("/deposit", methods=["GET", "POST"])
 def deposit():
@@ -536,17 +1702,18 @@ def deposit():
         amount = int(request.form.get("amount") or 0)
         note = (request.form.get("note") or "").strip()
         if name and amount > 0:
-            cur = db_execute("INSERT INTO deposits(dt, name, amount, note) VALUES (?,?,?,?) RETURNING id;",
+            cur = db_execute(f"INSERT INTO deposits(dt, member_id, amount, note) VALUES (?,{MEMBER_ID_SQL},?,?) RETURNING id;",
                              (dt, name, amount, note))
             new_id = cur.fetchone()["id"]
-            get_db().commit()
+            notify_balances(name)
             log_audit("insert", "deposits", new_id, {"dt":dt,"name":name,"amount":amount,"note":note})
+            get_db().commit()
             flash("입금 등록 완료.", "success")
         else:
             flash("이름과 금액을 확인하세요.", "warning")
         return redirect(url_for("deposit"))
 
-    rows = db_execute("SELECT id, dt, name, amount, note FROM deposits ORDER BY id DESC LIMIT 100;").fetchall()
+    rows = db_execute(DEPOSIT_SELECT + " ORDER BY d.id DESC LIMIT 100;").fetchall()
     hist = "".join([
         f"<tr><td>{r['dt']}</td><td>{r['name']}</td><td class='num'>{r['amount']:,}</td>"
         f"<td>{html_escape(r['note'] or '')}</td>"
@@ -554,7 +1721,7 @@ def deposit():
         f"<a class='btn btn-sm btn-outline-danger' href='{ url_for('deposit_delete', dep_id=r['id']) }' onclick='return confirm(\"삭제할까요?\");'>삭제</a></td></tr>"
         for r in rows
     ])
-    opts = "".join([f"<option value='{n}'>{n}</option>" for n in members])
+    opts = member_options()
     body = f"""
     <div class="row g-3">
       <div class="col-12 col-lg-5">
@@ -600,11 +1767,11 @@ def deposit():
 
 @app.get("/deposit/<int:dep_id>/edit")
 def deposit_edit(dep_id):
-    r = db_execute("SELECT * FROM deposits WHERE id=?;", (dep_id,)).fetchone()
+    r = db_execute(DEPOSIT_SELECT + " WHERE d.id=?;", (dep_id,)).fetchone()
     if not r:
         flash("입금 내역이 없습니다.", "danger"); return redirect(url_for("deposit"))
     members = get_members()
-    opts = "".join([f"<option value='{n}'{' selected' if n==r['name'] else ''}>{n}</option>" for n in members])
+    opts = member_options(r["name"])
     body = f"""
     <div class="card shadow-sm">
       <div class="card-body">
@@ -640,15 +1807,16 @@ def deposit_edit(dep_id):
 
 @app.post("/deposit/<int:dep_id>/edit")
 def deposit_update(dep_id):
-    old = db_execute("SELECT * FROM deposits WHERE id=?;", (dep_id,)).fetchone()
+    old = db_execute(DEPOSIT_SELECT + " WHERE d.id=?;", (dep_id,)).fetchone()
     dt = request.form.get("dt") or str(date.today())
     name = request.form.get("name")
     amount = int(request.form.get("amount") or 0)
     note = (request.form.get("note") or "").strip()
     if name and amount >= 0:
-        db_execute("UPDATE deposits SET dt=?, name=?, amount=?, note=? WHERE id=?;", (dt, name, amount, note, dep_id))
-        get_db().commit()
+        db_execute(f"UPDATE deposits SET dt=?, member_id={MEMBER_ID_SQL}, amount=?, note=? WHERE id=?;", (dt, name, amount, note, dep_id))
+        notify_balances(name, old and old["name"])
         log_audit("update", "deposits", dep_id, {"before": old, "after": {"dt":dt,"name":name,"amount":amount,"note":note}})
+        get_db().commit()
         flash("수정되었습니다.", "success")
     else:
         flash("입력값을 확인하세요.", "warning")
@@ -656,10 +1824,11 @@ def deposit_update(dep_id):
 
 @app.get("/deposit/<int:dep_id>/delete")
 def deposit_delete(dep_id):
-    old = db_execute("SELECT * FROM deposits WHERE id=?;", (dep_id,)).fetchone()
+    old = db_execute(DEPOSIT_SELECT + " WHERE d.id=?;", (dep_id,)).fetchone()
     db_execute("DELETE FROM deposits WHERE id=?;", (dep_id,))
-    get_db().commit()
+    notify_balances(old and old["name"])
     log_audit("delete", "deposits", dep_id, old)
+    get_db().commit()
     flash("삭제되었습니다.", "info")
     return redirect(url_for("deposit"))
 
@@ -669,6 +1838,7 @@ def _meal_form_html(members, initial=None, edit_target_id=None):
     entry_mode = (initial or {}).get("entry_mode", "total")
     main_mode  = (initial or {}).get("main_mode", "custom")
     side_mode  = (initial or {}).get("side_mode", "none")
+    dist_mode  = (initial or {}).get("total_dist_mode", "equal")
     dt_val     = (initial or {}).get("dt", today_str)
     payer_name = (initial or {}).get("payer_name", "") or ""
     grand_total = int((initial or {}).get("grand_total", 0) or 0)
@@ -700,7 +1870,7 @@ def _meal_form_html(members, initial=None, edit_target_id=None):
           <td class="side-custom-cell"><input class="form-control form-control-sm num" type="number" name="side_{m}" min="0" step="1" value="{m_side}" {'disabled' if side_mode!='custom' else ''}></td>
         </tr>"""
 
-    payer_options = "<option value=''></option>" + "".join([f"<option value='{n}'{' selected' if n==payer_name else ''}>{n}</option>" for n in members])
+    payer_options = "<option value=''></option>" + member_options(payer_name)
 
     em_total_ck = "checked" if entry_mode=="total" else ""
     em_detail_ck = "checked" if entry_mode=="detailed" else ""
@@ -710,6 +1880,13 @@ def _meal_form_html(members, initial=None, edit_target_id=None):
     sm_custom_ck = "checked" if side_mode=="custom" else ""
     sm_none_ck   = "checked" if side_mode=="none" else ""
 
+    template_box = "" if edit_target_id is not None else f"""
+          <div class="mt-3 pt-2 border-top d-flex gap-2 flex-wrap align-items-center">
+            <input class="form-control form-control-sm w-auto" name="template_name" placeholder="템플릿 이름 (예: 화요일 정식)">
+            <button class="btn btn-sm btn-outline-success" formaction="{ url_for('meal_template_save') }">템플릿으로 저장</button>
+            <a class="btn btn-sm btn-outline-secondary" href="{ url_for('meal_templates') }">템플릿 / 일괄 등록</a>
+          </div>"""
+
     html = f"""
     <div class="card shadow-sm">
       <div class="card-body">
@@ -753,11 +1930,11 @@ def _meal_form_html(members, initial=None, edit_target_id=None):
                   <label class="form-label d-block">분배 방식(총액)</label>
                   <div class="d-flex gap-3 align-items-center flex-wrap">
                     <div class="form-check">
-                      <input class="form-check-input" type="radio" name="total_dist_mode" id="td_equal" value="equal" checked>
+                      <input class="form-check-input" type="radio" name="total_dist_mode" id="td_equal" value="equal" {'checked' if dist_mode != 'custom' else ''}>
                       <label class="form-check-label" for="td_equal">균등분할</label>
                     </div>
                     <div class="form-check">
-                      <input class="form-check-input" type="radio" name="total_dist_mode" id="td_custom" value="custom">
+                      <input class="form-check-input" type="radio" name="total_dist_mode" id="td_custom" value="custom" {'checked' if dist_mode == 'custom' else ''}>
                       <label class="form-check-label" for="td_custom">강제입력(사람별 총액)</label>
                     </div>
                     <div class="form-text">팀원 총액 = 총 식비 - 게스트 총액</div>
@@ -832,6 +2009,7 @@ def _meal_form_html(members, initial=None, edit_target_id=None):
             <a class="btn btn-outline-primary" href="{ url_for('meals') }">식사 기록</a>
             <a class="btn btn-outline-secondary" href="{ url_for('home') }">뒤로</a>
           </div>
+          {template_box}
         </form>
       </div>
     </div>
@@ -900,105 +2078,116 @@ def _meal_form_html(members, initial=None, edit_target_id=None):
     """
     return html
 
+# ------------------ 식사 분담 계산 ------------------
+def compute_meal_split(form, members):
+    """식사 폼 값(request.form 또는 템플릿 dict) → 저장할 식사 값 + 팀원별 분담. 식사한 팀원이 없으면 None."""
+    entry_mode = form.get("entry_mode") or "total"
+    payer_name = form.get("payer_name") or None
+    guest_total = max(0, int(form.get("guest_total") or 0))
+    diners = [m for m in members if form.get(f"ate_{m}") == "on"]
+    if not diners:
+        return None
+
+    main_mode, side_mode, dist_mode = "custom", "none", "equal"
+    main_total = side_total = grand_total = 0
+    main_dict = {m: 0 for m in diners}
+    side_dict = {m: 0 for m in diners}
+
+    if entry_mode == "total":
+        grand_total = int(form.get("grand_total") or 0)
+        dist_mode = form.get("total_dist_mode") or "equal"
+        member_sum_target = max(0, grand_total - guest_total)
+        if dist_mode == "equal":
+            shares = split_even(member_sum_target, len(diners))
+            for i, m in enumerate(diners): main_dict[m] = shares[i]
+        else:
+            for m in diners: main_dict[m] = max(0, int(form.get(f"tot_{m}") or 0))
+    else:
+        main_mode = form.get("main_mode") or "custom"
+        side_mode = form.get("side_mode") or "none"
+        if main_mode == "equal":
+            main_total = int(form.get("main_total") or 0)
+            ms = split_even(main_total, len(diners))
+            for i, m in enumerate(diners): main_dict[m] = ms[i]
+        else:
+            for m in diners: main_dict[m] = max(0, int(form.get(f"main_{m}") or 0))
+        if side_mode == "equal":
+            side_total = int(form.get("side_total") or 0)
+            ss = split_even(side_total, len(diners))
+            for i, m in enumerate(diners): side_dict[m] = ss[i]
+        elif side_mode == "custom":
+            for m in diners: side_dict[m] = max(0, int(form.get(f"side_{m}") or 0))
+            side_total = sum(side_dict.values())
+
+    parts = [(m, int(main_dict[m]), int(side_dict[m]), int(main_dict[m] + side_dict[m])) for m in diners]
+    return {"entry_mode": entry_mode, "main_mode": main_mode, "side_mode": side_mode, "total_dist_mode": dist_mode,
+            "main_total": int(main_total), "side_total": int(side_total), "grand_total": int(grand_total),
+            "payer_name": payer_name, "guest_total": int(guest_total), "diners": diners, "parts": parts,
+            "member_sum": sum(p[3] for p in parts)}
+
+def insert_meal_parts(meal_id, spec):
+    names, mains, sides, totals = (list(col) for col in zip(*spec["parts"]))
+    db_execute("""INSERT INTO meal_parts(meal_id, member_id, main_amount, side_amount, total_amount)
+                  SELECT ?::int, mb.id, x.main, x.side, x.total
+                  FROM unnest(?::text[], ?::int[], ?::int[], ?::int[]) AS x(name, main, side, total)
+                  JOIN members mb ON mb.name = x.name;""",
+               (meal_id, names, mains, sides, totals))
+
+def insert_auto_deposit(meal_id, dt, spec, members):
+    # 결제자가 팀원이면 팀원 몫 합계를 결제자 입금으로 (게스트 몫 제외)
+    payer_name, member_sum = spec["payer_name"], spec["member_sum"]
+    if payer_name and (payer_name in members) and member_sum > 0:
+        cur = db_execute(f"INSERT INTO deposits(dt, member_id, amount, note) VALUES (?,{MEMBER_ID_SQL},?,?) RETURNING id;",
+                         (dt, payer_name, member_sum, f"[자동정산] 식사 #{meal_id} 선결제 상환(게스트 제외)"))
+        log_audit("insert", "deposits", cur.fetchone()["id"], {"auto_for_meal": meal_id, "amount": member_sum, "payer": payer_name})
+
+def _meal_audit(dt, spec):
+    return {"dt": dt, **{k: spec[k] for k in ("entry_mode", "main_mode", "side_mode", "grand_total", "payer_name", "guest_total", "diners")}}
+
+def _meal_initial(spec, dt):
+    # 분담 결과 → _meal_form_html 의 initial 형식 (템플릿 불러오기용)
+    parts = [{"name": n, "main_amount": a, "side_amount": b, "total_amount": t} for n, a, b, t in spec["parts"]]
+    return {**{k: v for k, v in spec.items() if k != "parts"}, "dt": dt, "parts": parts}
+
 # ------------------ 식사 등록/상세/수정/삭제 ------------------
 @app.route("/meal", methods=["GET", "POST"])
 def meal():
     members = get_members()
     if request.method == "POST":
         dt = request.form.get("dt") or str(date.today())
-        entry_mode = request.form.get("entry_mode") or "total"
-        payer_name = request.form.get("payer_name") or None
-        guest_total = int(request.form.get("guest_total") or 0)
-        if guest_total < 0: guest_total = 0
-
-        ate_flags = {m: (request.form.get(f"ate_{m}") == "on") for m in members}
-        diners = [m for m in members if ate_flags.get(m)]
-        if not diners:
+        spec = compute_meal_split(request.form, members)
+        if not spec:
             flash("식사한 팀원을 최소 1명 선택하세요.", "warning"); return redirect(url_for("meal"))
 
-        member_totals = {m: 0 for m in diners}
-        main_mode, side_mode = "custom", "none"
-        main_total = side_total = grand_total = 0
-
-        if entry_mode == "total":
-            grand_total = int(request.form.get("grand_total") or 0)
-            dist_mode = request.form.get("total_dist_mode") or "equal"
-            member_sum_target = max(0, grand_total - guest_total)
-            if dist_mode == "equal":
-                shares = split_even(member_sum_target, len(diners))
-                for i, m in enumerate(diners): member_totals[m] = shares[i]
-            else:
-                for m in diners:
-                    member_totals[m] = max(0, int(request.form.get(f"tot_{m}") or 0))
-        else:
-            main_mode = request.form.get("main_mode") or "custom"
-            side_mode = request.form.get("side_mode") or "none"
-
-            main_dict = {m:0 for m in diners}
-            if main_mode == "equal":
-                main_total = int(request.form.get("main_total") or 0)
-                ms = split_even(main_total, len(diners))
-                for i,m in enumerate(diners): main_dict[m] = ms[i]
-            else:
-                for m in diners: main_dict[m] = max(0, int(request.form.get(f"main_{m}") or 0))
-
-            side_dict = {m:0 for m in diners}
-            if side_mode == "equal":
-                side_total = int(request.form.get("side_total") or 0)
-                ss = split_even(side_total, len(diners))
-                for i,m in enumerate(diners): side_dict[m] = ss[i]
-            elif side_mode == "custom":
-                for m in diners: side_dict[m] = max(0, int(request.form.get(f"side_{m}") or 0))
-                side_total = sum(side_dict.values())
-            else:
-                side_total = 0
-
-            for m in diners: member_totals[m] = main_dict[m] + side_dict[m]
-
-        cur = db_execute("""
-          INSERT INTO meals(dt, entry_mode, main_mode, side_mode, main_total, side_total, grand_total, payer_name, guest_total)
-          VALUES (?,?,?,?,?,?,?,?,?) RETURNING id;
-        """, (dt, entry_mode, main_mode, side_mode, int(main_total), int(side_total), int(grand_total),
-              payer_name, int(guest_total)))
+        cur = db_execute(f"""
+          INSERT INTO meals(dt, entry_mode, main_mode, side_mode, main_total, side_total, grand_total, payer_id, guest_total)
+          VALUES (?,?,?,?,?,?,?,{MEMBER_ID_SQL},?) RETURNING id;
+        """, (dt, spec["entry_mode"], spec["main_mode"], spec["side_mode"], spec["main_total"], spec["side_total"],
+              spec["grand_total"], spec["payer_name"], spec["guest_total"]))
         meal_id = cur.fetchone()["id"]
+        insert_meal_parts(meal_id, spec)
+        insert_auto_deposit(meal_id, dt, spec, members)
+        notify_balances(spec["payer_name"], *spec["diners"])
 
-        member_sum = 0
-        for m in diners:
-            total = int(member_totals[m]); member_sum += total
-            if entry_mode == "detailed":
-                if main_mode == "equal":
-                    m_main = split_even(int(main_total), len(diners))[diners.index(m)]
-                else:
-                    m_main = int(request.form.get(f"main_{m}") or 0)
-                if side_mode == "equal":
-                    m_side = split_even(int(side_total), len(diners))[diners.index(m)]
-                elif side_mode == "custom":
-                    m_side = int(request.form.get(f"side_{m}") or 0)
-                else:
-                    m_side = 0
-            else:
-                m_main, m_side = total, 0
-            db_execute("INSERT INTO meal_parts(meal_id, name, main_amount, side_amount, total_amount) VALUES (?,?,?,?,?);",
-                       (meal_id, m, int(m_main), int(m_side), int(total)))
-
-        if payer_name and (payer_name in members) and member_sum > 0:
-            cur2 = db_execute("INSERT INTO deposits(dt, name, amount, note) VALUES (?,?,?,?) RETURNING id;",
-                              (dt, payer_name, int(member_sum), f"[자동정산] 식사 #{meal_id} 선결제 상환(게스트 제외)"))
-            dep_id = cur2.fetchone()["id"]
-            log_audit("insert", "deposits", dep_id, {"auto_for_meal": meal_id, "amount": member_sum, "payer": payer_name})
-
+        log_audit("insert", "meals", meal_id, _meal_audit(dt, spec))
         get_db().commit()
-        log_audit("insert", "meals", meal_id, {"dt":dt,"entry_mode":entry_mode,"main_mode":main_mode,"side_mode":side_mode,"grand_total":grand_total,"payer_name":payer_name,"guest_total":guest_total,"diners":diners})
         flash(f"식사 #{meal_id} 등록 완료.", "success")
         return redirect(url_for("meal_detail", meal_id=meal_id))
 
-    body = _meal_form_html(members)
+    # ?template=<id> : 저장된 템플릿으로 폼 채우기
+    initial = None
+    tpl = db_execute("SELECT fields FROM meal_templates WHERE id=?;", (int(request.args["template"]),)).fetchone() \
+        if (request.args.get("template") or "").isdigit() else None
+    if tpl:
+        spec = compute_meal_split(json.loads(tpl["fields"]), members)
+        initial = _meal_initial(spec, str(date.today())) if spec else None
+    body = _meal_form_html(members, initial=initial)
     return render(body)
 
 @app.get("/meal/<int:meal_id>")
 def meal_detail(meal_id):
-    meal = db_execute("SELECT * FROM meals WHERE id=?;", (meal_id,)).fetchone()
-    parts = db_execute("SELECT name, main_amount, side_amount, total_amount FROM meal_parts WHERE meal_id=? ORDER BY name;", (meal_id,)).fetchall()
+    meal = db_execute(MEAL_SELECT + " WHERE m.id=?;", (meal_id,)).fetchone()
+    parts = db_execute(MEAL_PARTS_SELECT + " WHERE p.meal_id=? ORDER BY mb.name;", (meal_id,)).fetchall()
     if not meal:
         flash("해당 식사 기록이 없습니다.", "danger"); return redirect(url_for("home"))
     rows = "".join([f"<tr><td>{p['name']}</td><td class='num'>{p['main_amount']:,}</td><td class='num'>{p['side_amount']:,}</td><td class='num'>{p['total_amount']:,}</td></tr>" for p in parts])
@@ -1038,96 +2227,35 @@ def meal_detail(meal_id):
 @app.route("/meal/<int:meal_id>/edit", methods=["GET","POST"])
 def meal_edit(meal_id):
     members = get_members()
-    meal = db_execute("SELECT * FROM meals WHERE id=?;", (meal_id,)).fetchone()
+    meal = db_execute(MEAL_SELECT + " WHERE m.id=?;", (meal_id,)).fetchone()
     if not meal:
         flash("해당 식사 기록이 없습니다.", "danger"); return redirect(url_for("meal"))
 
     if request.method == "POST":
         old_meal = dict(meal)
         dt = request.form.get("dt") or str(date.today())
-        entry_mode = request.form.get("entry_mode") or "total"
-        payer_name = request.form.get("payer_name") or None
-        guest_total = int(request.form.get("guest_total") or 0)
-        if guest_total < 0: guest_total = 0
-
-        ate_flags = {m: (request.form.get(f"ate_{m}") == "on") for m in members}
-        diners = [m for m in members if ate_flags.get(m)]
-        if not diners:
+        spec = compute_meal_split(request.form, members)
+        if not spec:
             flash("식사한 팀원을 최소 1명 선택하세요.", "warning"); return redirect(url_for("meal_edit", meal_id=meal_id))
 
-        member_totals = {m: 0 for m in diners}
-        main_mode, side_mode = "custom", "none"
-        main_total = side_total = grand_total = 0
-
-        if entry_mode == "total":
-            grand_total = int(request.form.get("grand_total") or 0)
-            dist_mode = request.form.get("total_dist_mode") or "equal"
-            member_sum_target = max(0, grand_total - guest_total)
-            if dist_mode == "equal":
-                shares = split_even(member_sum_target, len(diners))
-                for i, m in enumerate(diners): member_totals[m] = shares[i]
-            else:
-                for m in diners: member_totals[m] = max(0, int(request.form.get(f"tot_{m}") or 0))
-        else:
-            main_mode = request.form.get("main_mode") or "custom"
-            side_mode = request.form.get("side_mode") or "none"
-            main_dict = {m:0 for m in diners}
-            if main_mode == "equal":
-                main_total = int(request.form.get("main_total") or 0)
-                ms = split_even(main_total, len(diners))
-                for i,m in enumerate(diners): main_dict[m] = ms[i]
-            else:
-                for m in diners: main_dict[m] = max(0, int(request.form.get(f"main_{m}") or 0))
-            side_dict = {m:0 for m in diners}
-            if side_mode == "equal":
-                side_total = int(request.form.get("side_total") or 0)
-                ss = split_even(side_total, len(diners))
-                for i,m in enumerate(diners): side_dict[m] = ss[i]
-            elif side_mode == "custom":
-                for m in diners: side_dict[m] = max(0, int(request.form.get(f"side_{m}") or 0))
-                side_total = sum(side_dict.values())
-            else:
-                side_total = 0
-            for m in diners: member_totals[m] = main_dict[m] + side_dict[m]
-
-        db_execute("""UPDATE meals SET dt=?, entry_mode=?, main_mode=?, side_mode=?, 
-                      main_total=?, side_total=?, grand_total=?, payer_name=?, guest_total=? WHERE id=?;""",
-                   (dt, entry_mode, main_mode, side_mode, int(main_total), int(side_total),
-                    int(grand_total), payer_name, int(guest_total), meal_id))
+        db_execute(f"""UPDATE meals SET dt=?, entry_mode=?, main_mode=?, side_mode=?,
+                      main_total=?, side_total=?, grand_total=?, payer_id={MEMBER_ID_SQL}, guest_total=? WHERE id=?;""",
+                   (dt, spec["entry_mode"], spec["main_mode"], spec["side_mode"], spec["main_total"], spec["side_total"],
+                    spec["grand_total"], spec["payer_name"], spec["guest_total"], meal_id))
 
+        old_names = [r["name"] for r in db_execute(MEAL_PARTS_SELECT + " WHERE p.meal_id=?;", (meal_id,)).fetchall()]
         db_execute("DELETE FROM meal_parts WHERE meal_id=?;", (meal_id,))
-        member_sum = 0
-        for m in diners:
-            total = int(member_totals[m]); member_sum += total
-            if entry_mode == "detailed":
-                if main_mode == "equal":
-                    m_main = split_even(int(main_total), len(diners))[diners.index(m)]
-                else:
-                    m_main = int(request.form.get(f"main_{m}") or 0)
-                if side_mode == "equal":
-                    m_side = split_even(int(side_total), len(diners))[diners.index(m)]
-                elif side_mode == "custom":
-                    m_side = int(request.form.get(f"side_{m}") or 0)
-                else:
-                    m_side = 0
-            else:
-                m_main, m_side = total, 0
-            db_execute("INSERT INTO meal_parts(meal_id, name, main_amount, side_amount, total_amount) VALUES (?,?,?,?,?);",
-                       (meal_id, m, int(m_main), int(m_side), int(total)))
-
+        insert_meal_parts(meal_id, spec)
         delete_auto_deposit_for_meal(meal_id)
-        if payer_name and (payer_name in members) and member_sum > 0:
-            cur_dep = db_execute("INSERT INTO deposits(dt, name, amount, note) VALUES (?,?,?,?) RETURNING id;",
-                       (dt, payer_name, int(member_sum), f"[자동정산] 식사 #{meal_id} 선결제 상환(게스트 제외)"))
-            dep_id = cur_dep.fetchone()["id"]
-            log_audit("insert", "deposits", dep_id, {"auto_for_meal": meal_id, "amount": member_sum, "payer": payer_name})
+        insert_auto_deposit(meal_id, dt, spec, members)
+        notify_balances(spec["payer_name"], *spec["diners"], old_meal["payer_name"], *old_names)
 
+        log_audit("update", "meals", meal_id, {"before": old_meal, "after": _meal_audit(dt, spec)})
         get_db().commit()
-        log_audit("update", "meals", meal_id, {"before": old_meal, "after": {"dt":dt,"entry_mode":entry_mode,"main_mode":main_mode,"side_mode":side_mode,"grand_total":grand_total,"payer_name":payer_name,"guest_total":guest_total,"diners":diners}})
         flash("수정되었습니다.", "success")
         return redirect(url_for("meal_detail", meal_id=meal_id))
 
-    parts = db_execute("SELECT name, main_amount, side_amount, total_amount FROM meal_parts WHERE meal_id=? ORDER BY name;", (meal_id,)).fetchall()
+    parts = db_execute(MEAL_PARTS_SELECT + " WHERE p.meal_id=? ORDER BY mb.name;", (meal_id,)).fetchall()
     init = dict(meal)
     init["parts"] = parts
     body = _meal_form_html(members, initial=init, edit_target_id=meal_id)
@@ -1135,78 +2263,322 @@ def meal_edit(meal_id):
 
 @app.get("/meal/<int:meal_id>/delete")
 def meal_delete(meal_id):
-    old_meal = db_execute("SELECT * FROM meals WHERE id=?;", (meal_id,)).fetchone()
-    old_parts = db_execute("SELECT * FROM meal_parts WHERE meal_id=?;", (meal_id,)).fetchall()
+    old_meal = db_execute(MEAL_SELECT + " WHERE m.id=?;", (meal_id,)).fetchone()
+    old_parts = db_execute(MEAL_PARTS_SELECT + " WHERE p.meal_id=?;", (meal_id,)).fetchall()
     delete_auto_deposit_for_meal(meal_id)
     db_execute("DELETE FROM meal_parts WHERE meal_id=?;", (meal_id,))
     db_execute("DELETE FROM meals WHERE id=?;", (meal_id,))
-    get_db().commit()
+    notify_balances(old_meal and old_meal["payer_name"], *[p["name"] for p in old_parts])
     log_audit("delete", "meals", meal_id, {"meal": old_meal, "parts": old_parts})
+    get_db().commit()
     flash("삭제되었습니다.", "info")
     return redirect(url_for("meal"))
 
+# ------------------ 식사 템플릿 / 일괄 등록 ------------------
+MEAL_BULK_MAX_DATES = 366
+
+# 템플릿 1개 × N일: meals / meal_parts / 자동정산 deposits 를 한 문장(한 트랜잭션)으로
+BULK_MEALS_SQL = """
+WITH m AS (
+  INSERT INTO meals(dt, entry_mode, main_mode, side_mode, main_total, side_total, grand_total, payer_id, guest_total)
+  SELECT d, ?, ?, ?, ?, ?, ?, (SELECT id FROM members WHERE name = ?), ? FROM unnest(?::text[]) AS d
+  RETURNING id, dt
+), p AS (
+  INSERT INTO meal_parts(meal_id, member_id, main_amount, side_amount, total_amount)
+  SELECT m.id, mb.id, x.main, x.side, x.total
+  FROM m, unnest(?::text[], ?::int[], ?::int[], ?::int[]) AS x(name, main, side, total)
+  JOIN members mb ON mb.name = x.name
+), dep AS (
+  INSERT INTO deposits(dt, member_id, amount, note)
+  SELECT m.dt, (SELECT id FROM members WHERE name = ?), ?, '[자동정산] 식사 #' || m.id || ' 선결제 상환(게스트 제외)' FROM m WHERE ?
+)
+SELECT id, dt FROM m ORDER BY id;
+"""
+
+# SQLite 에는 데이터 변경 CTE 가 없어 같은 내용을 세 문장으로 (식사 id 목록을 다음 문장의 배열 파라미터로)
+BULK_MEALS_SQLITE = [
+    """INSERT INTO meals(dt, entry_mode, main_mode, side_mode, main_total, side_total, grand_total, payer_id, guest_total)
+       SELECT d, ?, ?, ?, ?, ?, ?, (SELECT id FROM members WHERE name = ?), ? FROM unnest(?::text[]) AS d
+       RETURNING id, dt;""",
+    """INSERT INTO meal_parts(meal_id, member_id, main_amount, side_amount, total_amount)
+       SELECT m.id, mb.id, x.main, x.side, x.total
+       FROM unnest(?::int[]) AS m(id)
+       CROSS JOIN unnest(?::text[], ?::int[], ?::int[], ?::int[]) AS x(name, main, side, total)
+       JOIN members mb ON mb.name = x.name;""",
+    """INSERT INTO deposits(dt, member_id, amount, note)
+       SELECT m.dt, (SELECT id FROM members WHERE name = ?), ?, '[자동정산] 식사 #' || m.id || ' 선결제 상환(게스트 제외)'
+       FROM unnest(?::int[], ?::text[]) AS m(id, dt);""",
+]
+
+def insert_meals_bulk(spec, dates, members):
+    names, mains, sides, totals = (list(col) for col in zip(*spec["parts"]))
+    auto_dep = bool(spec["payer_name"] and spec["payer_name"] in members and spec["member_sum"] > 0)
+    if storage.dialect == "sqlite":
+        meals_sql, parts_sql, dep_sql = BULK_MEALS_SQLITE
+        rows = sorted(db_execute(meals_sql, (
+            spec["entry_mode"], spec["main_mode"], spec["side_mode"], spec["main_total"], spec["side_total"],
+            spec["grand_total"], spec["payer_name"], spec["guest_total"], list(dates),
+        )).fetchall(), key=lambda r: r["id"])
+        ids = [r["id"] for r in rows]
+        db_execute(parts_sql, (ids, names, mains, sides, totals))
+        if auto_dep:
+            db_execute(dep_sql, (spec["payer_name"], spec["member_sum"], ids, [r["dt"] for r in rows]))
+        return rows
+    return db_execute(BULK_MEALS_SQL, (
+        spec["entry_mode"], spec["main_mode"], spec["side_mode"], spec["main_total"], spec["side_total"],
+        spec["grand_total"], spec["payer_name"], spec["guest_total"], list(dates),
+        names, mains, sides, totals,
+        spec["payer_name"], spec["member_sum"], auto_dep,
+    )).fetchall()
+
+def _parse_meal_dates(form):
+    # 날짜 직접 입력(쉼표/줄바꿈) + 기간·요일 선택을 합쳐 정렬된 고유 날짜 목록으로
+    days = {date.fromisoformat(t) for t in re.split(r"[\s,]+", form.get("dates") or "") if t}
+    if form.get("from") and form.get("to"):
+        d, end = date.fromisoformat(form["from"]), date.fromisoformat(form["to"])
+        wds = {int(w) for w in form.getlist("wd")} or set(range(5))
+        while d <= end and len(days) <= MEAL_BULK_MAX_DATES:
+            if d.weekday() in wds:
+                days.add(d)
+            d += timedelta(days=1)
+    return [str(d) for d in sorted(days)]
+
+@app.post("/meal/templates/save")
+def meal_template_save():
+    members = get_members()
+    name = (request.form.get("template_name") or "").strip()
+    fields = {k: v for k, v in request.form.to_dict().items() if k not in ("dt", "template_name")}
+    if not name:
+        flash("템플릿 이름을 입력하세요.", "warning"); return redirect(url_for("meal"))
+    if not compute_meal_split(fields, members):
+        flash("식사한 팀원을 최소 1명 선택하세요.", "warning"); return redirect(url_for("meal"))
+    cur = db_execute("""INSERT INTO meal_templates(name, fields, updated_at) VALUES (?,?,?)
+                        ON CONFLICT(name) DO UPDATE SET fields=EXCLUDED.fields, updated_at=EXCLUDED.updated_at RETURNING id;""",
+                     (name, json.dumps(fields, ensure_ascii=False), datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+    tpl_id = cur.fetchone()["id"]
+    log_audit("insert", "meal_templates", tpl_id, {"name": name})
+    get_db().commit()
+    flash(f"템플릿 '{name}' 저장 완료.", "success")
+    return redirect(url_for("meal_templates"))
+
+@app.get("/meal/templates")
+def meal_templates():
+    members = get_members()
+    tpls = db_execute("SELECT id, name, fields, updated_at FROM meal_templates ORDER BY name;").fetchall()
+    wd_labels = "월화수목금토일"
+    cards = ""
+    for t in tpls:
+        spec = compute_meal_split(json.loads(t["fields"]), members)
+        if spec:
+            summary = (f"{len(spec['diners'])}명 · {'총액' if spec['entry_mode'] == 'total' else '상세'} · "
+                       f"팀원 몫 {spec['member_sum']:,}원 · 결제자 {html_escape(spec['payer_name'] or '-')}"
+                       f"<div class='small text-muted'>{html_escape(', '.join(spec['diners']))}</div>")
+        else:
+            summary = "<span class='text-danger'>식사한 팀원이 모두 삭제됨</span>"
+        wds = "".join([f"<label class='form-check form-check-inline mb-0'><input class='form-check-input' type='checkbox' name='wd' value='{i}'"
+                       f"{' checked' if i < 5 else ''}> {w}</label>" for i, w in enumerate(wd_labels)])
+        cards += f"""
+        <div class="border rounded p-2 mb-2">
+          <div class="d-flex justify-content-between align-items-start">
+            <div><b>{html_escape(t['name'])}</b> <span class="small text-muted">({t['updated_at']})</span><div>{summary}</div></div>
+            <div class="d-flex gap-1">
+              <a class="btn btn-sm btn-outline-primary" href="{ url_for('meal', template=t['id']) }">불러오기</a>
+              <form method="post" action="{ url_for('meal_template_delete', tpl_id=t['id']) }" onsubmit="return confirm('삭제할까요?');">
+                <button class="btn btn-sm btn-outline-danger">삭제</button></form>
+            </div>
+          </div>
+          <form method="post" action="{ url_for('meal_template_apply', tpl_id=t['id']) }" class="row g-2 align-items-end mt-1">
+            <div class="col-12 col-md-4"><label class="form-label small mb-0">날짜 (쉼표/줄바꿈)</label>
+              <textarea class="form-control form-control-sm" name="dates" rows="1" placeholder="2025-03-04, 2025-03-06"></textarea></div>
+            <div class="col-6 col-md-2"><label class="form-label small mb-0">기간 시작</label><input class="form-control form-control-sm" type="date" name="from"></div>
+            <div class="col-6 col-md-2"><label class="form-label small mb-0">기간 끝</label><input class="form-control form-control-sm" type="date" name="to"></div>
+            <div class="col-12 col-md-3 small">{wds}</div>
+            <div class="col-12 col-md-1"><button class="btn btn-sm btn-success w-100"{'' if spec else ' disabled'}>일괄 등록</button></div>
+          </form>
+        </div>"""
+    body = f"""
+    <div class="card shadow-sm">
+      <div class="card-body">
+        <h5 class="card-title">식사 템플릿 / 일괄 등록</h5>
+        {cards or "<div class='text-muted mb-2'>저장된 템플릿이 없습니다. 식사 등록 화면에서 '템플릿으로 저장'을 누르세요.</div>"}
+        <a class="btn btn-outline-secondary btn-sm" href="{ url_for('meal') }">식사 등록</a>
+      </div>
+    </div>
+    """
+    return render(body)
+
+@app.post("/meal/templates/<int:tpl_id>/apply")
+def meal_template_apply(tpl_id):
+    members = get_members()
+    tpl = db_execute("SELECT name, fields FROM meal_templates WHERE id=?;", (tpl_id,)).fetchone()
+    spec = compute_meal_split(json.loads(tpl["fields"]), members) if tpl else None
+    if not spec:
+        flash("템플릿을 적용할 수 없습니다.", "danger"); return redirect(url_for("meal_templates"))
+    try:
+        dates = _parse_meal_dates(request.form)
+    except ValueError:
+        flash("날짜 형식을 확인하세요 (YYYY-MM-DD).", "warning"); return redirect(url_for("meal_templates"))
+    if not dates or len(dates) > MEAL_BULK_MAX_DATES:
+        flash(f"날짜를 1~{MEAL_BULK_MAX_DATES}개 지정하세요.", "warning"); return redirect(url_for("meal_templates"))
+
+    rows = insert_meals_bulk(spec, dates, members)
+    notify_balances(spec["payer_name"], *spec["diners"])
+    log_audit("insert", "meals", None, {"template": tpl["name"], "meal_ids": [r["id"] for r in rows], **_meal_audit(None, spec)})
+    get_db().commit()
+    flash(f"'{tpl['name']}' 템플릿으로 식사 {len(rows)}건 등록 ({dates[0]} ~ {dates[-1]}).", "success")
+    return redirect(url_for("meals"))
+
+@app.post("/meal/templates/<int:tpl_id>/delete")
+def meal_template_delete(tpl_id):
+    db_execute("DELETE FROM meal_templates WHERE id=?;", (tpl_id,))
+    log_audit("delete", "meal_templates", tpl_id)
+    get_db().commit()
+    flash("템플릿을 삭제했습니다.", "info")
+    return redirect(url_for("meal_templates"))
+
 # ------------------ 식사 기록 리스트 ------------------
-@app.get("/meals")
-def meals():
-    rows = db_execute("""
-        SELECT
-          m.id,
-          m.dt,
-          m.payer_name,
-          m.entry_mode,
-          m.main_mode,
-          m.side_mode,
-          COALESCE(SUM(p.total_amount), 0) AS team_total,
-          COALESCE(COUNT(p.id), 0)         AS diners,
-          COALESCE(string_agg(p.name, ', ' ORDER BY p.name), '') AS diner_names,
-          m.guest_total
-        FROM meals m
-        LEFT JOIN meal_parts p ON p.meal_id = m.id
-        GROUP BY m.id
-        ORDER BY m.id DESC
-        LIMIT 200;
-    """).fetchall()
+MEALS_PAGE_SIZE = 200
 
-    # 표 행 렌더
-    items = ""
-    for r in rows:
-        calc_label = (
-            "총액" if r["entry_mode"] == "total"
-            else f"상세(메인:{r['main_mode']}, 사이드:{r['side_mode']})"
-        )
-        actions = (
-            f"<div class='meals-actions d-inline-flex'>"
-            f"<a class='btn btn-sm btn-outline-secondary' href='{ url_for('meal_detail', meal_id=r['id']) }'>보기</a>"
-            f"<a class='btn btn-sm btn-outline-primary'   href='{ url_for('meal_edit',   meal_id=r['id']) }'>수정</a>"
-            f"<a class='btn btn-sm btn-outline-danger'    href='{ url_for('meal_delete', meal_id=r['id']) }' "
-            f"onclick='return confirm(\"삭제할까요? 자동정산 입금도 함께 제거됩니다.\");'>삭제</a>"
-            f"</div>"
-        )
-        items += (
-            "<tr>"
-            f"<td>#{r['id']}</td>"
-            f"<td>{r['dt']}</td>"
-            f"<td>{html_escape(r['payer_name'] or '(없음)')}</td>"
-            f"<td class='num'>{r['diners']}</td>"
-            f"<td class='text-truncate' style='max-width:280px'>{html_escape(r['diner_names'])}</td>"
-            f"<td>{calc_label}</td>"
-            f"<td class='num'>{r['team_total']:,}</td>"
-            f"<td class='num'>{r['guest_total']:,}</td>"
-            f"<td class='text-end'>{actions}</td>"
-            "</tr>"
-        )
+def _meals_filters(args):
+    def day(v):
+        try:
+            return str(date.fromisoformat((v or "").strip()))
+        except ValueError:
+            return ""  # 잘못된 날짜는 필터 없음으로
+    before = (args.get("before") or "").strip()
+    return {"from": day(args.get("from")), "to": day(args.get("to")),
+            "payer": (args.get("payer") or "").strip(), "diner": (args.get("diner") or "").strip(),
+            "before": int(before) if before.isdigit() else 0}
+
+def meals_list_query(f, limit=MEALS_PAGE_SIZE):
+    # 필터 + id 키셋으로 식사 limit 건을 먼저 고르고(page), 명단 집계는 그 식사들만 LATERAL 로
+    # → 이력이 늘어도 집계량은 limit 건 분량. limit=None(전체 목록)이면 id 역순으로 흘려보내며 집계
+    sql = "SELECT m.* FROM meals m"
+    where, params = [], []
+    if f["diner"]:
+        sql += f" JOIN meal_parts dp ON dp.meal_id = m.id AND dp.member_id = {MEMBER_ID_SQL}"
+        params.append(f["diner"])
+    if f["payer"]:
+        where.append(f"m.payer_id = {MEMBER_ID_SQL}"); params.append(f["payer"])
+    if f["from"]:
+        where.append("m.dt >= ?"); params.append(f["from"])
+    if f["to"]:
+        where.append("m.dt <= ?"); params.append(f["to"])
+    if f["before"]:
+        where.append("m.id < ?"); params.append(f["before"])
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY m.id DESC"
+    if limit:
+        sql += " LIMIT ?"; params.append(limit)
+    if storage.dialect == "sqlite":
+        # LATERAL 이 없어 식사별 상관 서브쿼리로 (명단은 이름순으로 정렬한 뒤 이어붙임)
+        return f"""
+        WITH page AS ({sql})
+        SELECT
+          page.id,
+          page.dt,
+          page.entry_mode,
+          page.main_mode,
+          page.side_mode,
+          pm.name AS payer_name,
+          COALESCE((SELECT SUM(p.total_amount) FROM meal_parts p WHERE p.meal_id = page.id), 0) AS team_total,
+          (SELECT COUNT(*) FROM meal_parts p WHERE p.meal_id = page.id) AS diners,
+          COALESCE((SELECT group_concat(name, ', ') FROM (
+            SELECT mb.name FROM meal_parts p JOIN members mb ON mb.id = p.member_id
+            WHERE p.meal_id = page.id ORDER BY mb.name)), '') AS diner_names,
+          page.guest_total
+        FROM page
+        LEFT JOIN members pm ON pm.id = page.payer_id
+        ORDER BY page.id DESC;
+    """, tuple(params)
+    return f"""
+        WITH page AS ({sql})
+        SELECT
+          page.id,
+          page.dt,
+          page.entry_mode,
+          page.main_mode,
+          page.side_mode,
+          pm.name AS payer_name,
+          agg.team_total,
+          agg.diners,
+          agg.diner_names,
+          page.guest_total
+        FROM page
+        LEFT JOIN members pm ON pm.id = page.payer_id
+        CROSS JOIN LATERAL (
+          SELECT COALESCE(SUM(p.total_amount), 0) AS team_total,
+                 COUNT(*)                          AS diners,
+                 COALESCE(string_agg(mb.name, ', ' ORDER BY mb.name), '') AS diner_names
+          FROM meal_parts p JOIN members mb ON mb.id = p.member_id
+          WHERE p.meal_id = page.id
+        ) agg
+        ORDER BY page.id DESC;
+    """, tuple(params)
+
+def _meal_row_html(r):
+    calc_label = (
+        "총액" if r["entry_mode"] == "total"
+        else f"상세(메인:{r['main_mode']}, 사이드:{r['side_mode']})"
+    )
+    actions = (
+        f"<div class='meals-actions d-inline-flex'>"
+        f"<a class='btn btn-sm btn-outline-secondary' href='{ url_for('meal_detail', meal_id=r['id']) }'>보기</a>"
+        f"<a class='btn btn-sm btn-outline-primary'   href='{ url_for('meal_edit',   meal_id=r['id']) }'>수정</a>"
+        f"<a class='btn btn-sm btn-outline-danger'    href='{ url_for('meal_delete', meal_id=r['id']) }' "
+        f"onclick='return confirm(\"삭제할까요? 자동정산 입금도 함께 제거됩니다.\");'>삭제</a>"
+        f"</div>"
+    )
+    return (
+        "<tr>"
+        f"<td>#{r['id']}</td>"
+        f"<td>{r['dt']}</td>"
+        f"<td>{html_escape(r['payer_name'] or '(없음)')}</td>"
+        f"<td class='num'>{r['diners']}</td>"
+        f"<td class='text-truncate' style='max-width:280px'>{html_escape(r['diner_names'])}</td>"
+        f"<td>{calc_label}</td>"
+        f"<td class='num'>{r['team_total']:,}</td>"
+        f"<td class='num'>{r['guest_total']:,}</td>"
+        f"<td class='text-end'>{actions}</td>"
+        "</tr>"
+    )
 
+def _meals_after_rows(f, count, last_id, limit):
+    # 행 뒤에 붙는 안내 행: 비었으면 '기록 없음', 페이지가 찼으면 다음 페이지 / 전체 목록 링크
+    if not count:
+        return "<tr><td colspan='9' class='text-center text-muted'>기록 없음</td></tr>"
+    if limit and count == limit:
+        keep = {k: f[k] or None for k in ("from", "to", "payer", "diner")}
+        return (f"<tr><td colspan='9'>"
+                f"<a class='btn btn-sm btn-outline-primary' href='{ url_for('meals', **keep, before=last_id) }'>더 보기</a> "
+                f"<a class='btn btn-sm btn-outline-secondary' href='{ url_for('meals_all', **keep) }'>전체 목록</a></td></tr>")
+    return ""
+
+def _meals_body(f, items, member_opts, full=False):
     body = f"""
     <div class="card shadow-sm">
       <div class="card-body">
         <div class="d-flex justify-content-between align-items-center mb-2">
-          <h5 class="card-title mb-0">식사 기록</h5>
+          <h5 class="card-title mb-0">식사 기록{' (전체)' if full else ''}</h5>
           <div class="d-flex gap-2">
             <a class="btn btn-success btn-sm"  href="{ url_for('meal') }">식사 등록</a>
             <a class="btn btn-outline-secondary btn-sm" href="{ url_for('home') }">메인으로</a>
           </div>
         </div>
 
+        <form method="get" action="{ url_for('meals_all' if full else 'meals') }" class="row g-2 align-items-end mb-2">
+          <div class="col-6 col-md-2"><label class="form-label">시작일</label><input class="form-control form-control-sm" type="date" name="from" value="{f['from']}"></div>
+          <div class="col-6 col-md-2"><label class="form-label">종료일</label><input class="form-control form-control-sm" type="date" name="to" value="{f['to']}"></div>
+          <div class="col-6 col-md-2"><label class="form-label">결제자</label>
+            <input class="form-control form-control-sm" name="payer" list="mealMemberList" value="{html_escape(f['payer'])}"></div>
+          <div class="col-6 col-md-2"><label class="form-label">식사자</label>
+            <input class="form-control form-control-sm" name="diner" list="mealMemberList" value="{html_escape(f['diner'])}"></div>
+          <datalist id="mealMemberList">{member_opts}</datalist>
+          <div class="col-12 col-md-4 d-flex gap-2"><button class="btn btn-primary btn-sm">조회</button>
+            <a class="btn btn-outline-secondary btn-sm" href="{ url_for('meals') }">초기화</a></div>
+        </form>
+
         <div class="table-scroll">
           <table class="table table-sm align-middle table-minwide table-sticky table-nowrap">
             <thead>
@@ -1222,48 +2594,84 @@ def meals():
                 <th class="text-end">관리</th>
               </tr>
             </thead>
-            <tbody>{items or "<tr><td colspan='9' class='text-center text-muted'>기록 없음</td></tr>"}</tbody>
+            <tbody>{items}</tbody>
           </table>
         </div>
       </div>
     </div>
     """
-    return render(body)
+    return body
+
+def _meals_queries(args):
+    # 팀원 목록도 쿼리로 받는다: page 는 asgi 이벤트 루프에서 실행되므로 member_datalist()(동기 조회)를 부르면 안 된다
+    return {"rows": meals_list_query(_meals_filters(args)), "members": (MEMBER_NAMES_SQL, ())}
+
+@read_view("meals", _meals_queries)
+def meals_page(args, data):
+    f = _meals_filters(args)
+    rows = data["rows"]
+    items = "".join(_meal_row_html(r) for r in rows)
+    items += _meals_after_rows(f, len(rows), rows[-1]["id"] if rows else None, MEALS_PAGE_SIZE)
+    return _meals_body(f, items, member_datalist_html(r["name"] for r in data["members"]))
+
+def _stream_meals(f, limit, full=False):
+    seen = {"count": 0, "last_id": None}
+    def rows():
+        for r in db_stream(*meals_list_query(f, limit)):
+            seen["count"] += 1; seen["last_id"] = r["id"]
+            yield _meal_row_html(r)
+    return render_stream(_meals_body(f, ROWS_MARK, member_datalist(), full), rows(),
+                         lambda: _meals_after_rows(f, seen["count"], seen["last_id"], limit))
+
+@app.get("/meals")
+def meals():
+    # 비동기 모드(asgi)는 meals_page 로 한 페이지를 렌더하고, 여기서는 같은 행을 흘려보낸다
+    return _stream_meals(_meals_filters(request.args), MEALS_PAGE_SIZE)
+
+@app.get("/meals/all")
+def meals_all():
+    # 필터에 맞는 식사 전체(LIMIT 없음). 행은 서버측 커서로 읽어 바로 보내므로 메모리는 건수와 무관
+    f = dict(_meals_filters(request.args), before=0)
+    return _stream_meals(f, None, full=True)
 
 # ------------------ 현황/정산 + 엑셀 버튼 ------------------
-@app.route("/status")
-def status():
-    balances = get_balances()
-    total_deposit = sum(b["deposit"] for b in balances)
-    total_used    = sum(b["used"]    for b in balances)
-    total_balance = sum(b["balance"] for b in balances)
-
-    rows = ""
-    for b in balances:
-        cls = "text-danger" if b["balance"] < 0 else ""
-        rows += (
-            f"<tr>"
-            f"<td>{b['name']}</td>"
-            f"<td class='num'>{b['deposit']:,}</td>"
-            f"<td class='num'>{b['used']:,}</td>"
-            f"<td class='num {cls}'>{b['balance']:,}</td>"
-            f"</tr>"
-        )
+STATUS_TOTALS = ("deposit", "used", "balance")
+
+def _status_row_html(b):
+    cls = "text-danger" if b["balance"] < 0 else ""
+    return (
+        f"<tr data-name='{html_escape(b['name'])}'>"
+        f"<td><a href='{ url_for('member_statement', name=b['name']) }'>{html_escape(b['name'])}</a></td>"
+        f"<td class='num c-deposit'>{b['deposit']:,}</td>"
+        f"<td class='num c-used'>{b['used']:,}</td>"
+        f"<td class='num c-balance {cls}'>{b['balance']:,}</td>"
+        f"</tr>"
+    )
+
+def _status_totals_script(totals):
+    # 흘려보낸 화면: 행을 다 보낸 뒤 위·아래 합계 칸을 채운다
+    sets = "".join(f"document.querySelectorAll('.t-{k}').forEach(el => el.textContent = '{totals[k]:,}');" for k in STATUS_TOTALS)
+    return f"<script>{sets}</script>"
 
+def _status_body(rows, cursor, totals=None):
+    # totals 가 없으면(흘려보내는 중) 합계 칸은 비워 두고 _status_totals_script 가 채운다
+    total_deposit, total_used, total_balance = (f"{totals[k]:,}" if totals else "…" for k in STATUS_TOTALS)
     body = f"""
     <div class="card shadow-sm">
       <div class="card-body">
         <div class="d-flex justify-content-between align-items-center mb-2">
           <h5 class="card-title mb-0">현황 / 정산</h5>
           <div class="d-flex gap-2">
+            <a class="btn btn-sm btn-outline-primary" href="{ url_for('settle') }">일괄 정산</a>
             <a class="btn btn-sm btn-outline-success" href="{ url_for('export_excel') }">엑셀 내보내기</a>
+            <a class="btn btn-sm btn-outline-secondary" href="{ url_for('jobs') }">작업</a>
           </div>
         </div>
 
         <div class="mb-2">
-          <span class="badge bg-secondary me-1">입금 합계: {total_deposit:,}원</span>
-          <span class="badge bg-secondary me-1">차감 합계: {total_used:,}원</span>
-          <span class="badge bg-dark">잔액 합계: {total_balance:,}원</span>
+          <span class="badge bg-secondary me-1">입금 합계: <span class="t-deposit">{total_deposit}</span>원</span>
+          <span class="badge bg-secondary me-1">차감 합계: <span class="t-used">{total_used}</span>원</span>
+          <span class="badge bg-dark">잔액 합계: <span class="t-balance">{total_balance}</span>원</span>
         </div>
 
         <div class="table-responsive">
@@ -1280,9 +2688,9 @@ def status():
             <tfoot>
               <tr class="fw-bold">
                 <td class='text-end'>합계</td>
-                <td class='num'>{total_deposit:,}</td>
-                <td class='num'>{total_used:,}</td>
-                <td class='num'>{total_balance:,}</td>
+                <td class='num t-deposit'>{total_deposit}</td>
+                <td class='num t-used'>{total_used}</td>
+                <td class='num t-balance'>{total_balance}</td>
               </tr>
             </tfoot>
           </table>
@@ -1292,18 +2700,333 @@ def status():
         </div>
       </div>
     </div>
+    {live_script(cursor)}
+    <script>
+      // 전체 잔액 중 값이 바뀐 팀원 행만 갱신하고 합계는 화면의 행들로 다시 계산
+      const fmt = v => Number(v).toLocaleString('ko-KR');
+      const num = el => Number(el.textContent.replace(/,/g, ''));
+      document.addEventListener('live:balance', function(e) {{
+        e.detail.rows.forEach(function(r) {{
+          const tr = document.querySelector('tr[data-name="' + CSS.escape(r.name) + '"]');
+          if (!tr || (num(tr.querySelector('.c-deposit')) === r.deposit && num(tr.querySelector('.c-used')) === r.used)) return;
+          tr.querySelector('.c-deposit').textContent = fmt(r.deposit);
+          tr.querySelector('.c-used').textContent = fmt(r.used);
+          const bal = tr.querySelector('.c-balance');
+          bal.textContent = fmt(r.balance);
+          bal.classList.toggle('text-danger', r.balance < 0);
+          tr.classList.add('table-warning'); setTimeout(() => tr.classList.remove('table-warning'), 1500);
+        }});
+        ['deposit', 'used', 'balance'].forEach(function(k) {{
+          let sum = 0;
+          document.querySelectorAll('tr[data-name] .c-' + k).forEach(el => sum += num(el));
+          document.querySelectorAll('.t-' + k).forEach(el => el.textContent = fmt(sum));
+        }});
+      }});
+    </script>
+    """
+    return body
+
+@read_view("status", lambda args: {"balances": (BALANCES_SQL, ()), "live": (LIVE_CURSOR_SQL, ())})
+def status_page(args, data):
+    balances = data["balances"]
+    totals = {k: sum(b[k] for b in balances) for k in STATUS_TOTALS}
+    return _status_body("".join(_status_row_html(b) for b in balances), data["live"][0], totals)
+
+@app.route("/status")
+def status():
+    totals = dict.fromkeys(STATUS_TOTALS, 0)
+    def rows():
+        for b in db_stream(BALANCES_SQL):
+            for k in STATUS_TOTALS:
+                totals[k] += b[k]
+            yield _status_row_html(b)
+    return render_stream(_status_body(ROWS_MARK, live_cursor()), rows(), lambda: _status_totals_script(totals))
+
+# ------------------ 팀원별 거래 내역 ------------------
+# 입금(+)과 식사 분담(-)을 UNION ALL 로 (날짜, 구분, id) 순으로 잇고, 누적 잔액은 SUM() OVER 로 DB 에서 계산.
+# 창 함수는 (날짜, 구분, id, 금액)만 훑고(ix_deposits_member_dt, ix_meal_parts_member_meal),
+# 메모·결제자 같은 표시용 값은 잘라낸 페이지 행에만 붙인다. 화면은 최신순 키셋(before=날짜~구분~id) 페이지.
+STATEMENT_PAGE_SIZE = 100
+STATEMENT_KINDS = {"deposit": "입금", "meal": "식사"}
+
+STATEMENT_SQL = """
+    WITH entries AS (
+      SELECT d.dt, 'deposit' AS kind, d.id, d.amount FROM deposits d WHERE d.member_id = ?
+      UNION ALL
+      SELECT m.dt, 'meal', m.id, -p.total_amount
+      FROM meal_parts p JOIN meals m ON m.id = p.meal_id WHERE p.member_id = ?
+    ), ledger AS (
+      SELECT dt, kind, id, amount,
+             SUM(amount) OVER (ORDER BY dt, kind, id ROWS UNBOUNDED PRECEDING) AS balance
+      FROM entries
+    ), page AS (
+      SELECT * FROM ledger {where} ORDER BY dt DESC, kind DESC, id DESC {limit}
+    )
+    SELECT page.*, d.note, pm.name AS payer_name
+    FROM page
+    LEFT JOIN deposits d ON page.kind = 'deposit' AND d.id = page.id
+    LEFT JOIN meals m ON page.kind = 'meal' AND m.id = page.id
+    LEFT JOIN members pm ON pm.id = m.payer_id
+    ORDER BY page.dt {order}, page.kind {order}, page.id {order};
+"""
+
+def statement_query(member_id, before=None, limit=STATEMENT_PAGE_SIZE):
+    """before: (날짜, 구분, id) 키 — 그보다 오래된 행부터 limit 건(최신순). limit=None 이면 전체(오래된 순)."""
+    params = [member_id, member_id]
+    where = ""
+    if before:
+        where = "WHERE (dt, kind, id) < (?, ?, ?)"; params += list(before)
+    if limit is None:
+        return STATEMENT_SQL.format(where=where, limit="", order="ASC"), tuple(params)
+    return STATEMENT_SQL.format(where=where, limit="LIMIT ?", order="DESC"), tuple(params + [limit])
+
+def _statement_cursor(v):
+    # "2026-10-19~meal~123" → ("2026-10-19", "meal", 123). 형식이 틀리면 첫 페이지로
+    parts = (v or "").split("~")
+    if len(parts) == 3 and parts[1] in STATEMENT_KINDS and parts[2].isdigit():
+        return parts[0], parts[1], int(parts[2])
+    return None
+
+def _statement_text(r):
+    if r["kind"] == "meal":
+        return f"식사 #{r['id']}" + (f" (결제: {r['payer_name']})" if r["payer_name"] else "")
+    return r["note"] or ""
+
+def _find_member(name):
+    return db_execute("SELECT id, name FROM members WHERE name=?;", (name,)).fetchone()
+
+@app.get("/member/<name>")
+def member_statement(name):
+    member = _find_member(name)
+    if not member:
+        flash("해당 팀원이 없습니다.", "danger"); return redirect(url_for("status"))
+    before = _statement_cursor(request.args.get("before"))
+    rows = db_execute(*statement_query(member["id"], before)).fetchall()
+    balance = get_balance_of(name)
+
+    items = ""
+    for r in rows:
+        link = (f"<a href='{ url_for('meal_detail', meal_id=r['id']) }'>{html_escape(_statement_text(r))}</a>"
+                if r["kind"] == "meal" else html_escape(_statement_text(r)))
+        items += (
+            f"<tr><td class='text-nowrap'>{r['dt']}</td>"
+            f"<td><span class='badge bg-{'primary' if r['kind'] == 'deposit' else 'secondary'}'>{STATEMENT_KINDS[r['kind']]}</span></td>"
+            f"<td>{link}</td>"
+            f"<td class='num {'text-danger' if r['amount'] < 0 else ''}'>{r['amount']:+,}</td>"
+            f"<td class='num {'text-danger' if r['balance'] < 0 else ''}'>{r['balance']:,}</td></tr>"
+        )
+    if not items:
+        items = "<tr><td colspan='5' class='text-muted'>내역이 없습니다.</td></tr>"
+    more = ""
+    if len(rows) == STATEMENT_PAGE_SIZE:
+        last = rows[-1]
+        cursor = f"{last['dt']}~{last['kind']}~{last['id']}"
+        more = f"<a class='btn btn-sm btn-outline-primary mt-2' href='{ url_for('member_statement', name=name, before=cursor) }'>더 보기</a>"
+    latest = f"<a class='small ms-2' href='{ url_for('member_statement', name=name) }'>최신 내역으로</a>" if before else ""
+    body = f"""
+    <div class="card shadow-sm">
+      <div class="card-body">
+        <div class="d-flex justify-content-between align-items-center mb-2">
+          <h5 class="card-title mb-0">{html_escape(name)} 거래 내역</h5>
+          <div class="d-flex gap-2">
+            <a class="btn btn-sm btn-outline-success" href="{ url_for('member_statement_csv', name=name) }">CSV 다운로드</a>
+            <a class="btn btn-sm btn-outline-secondary" href="{ url_for('status') }">현황</a>
+          </div>
+        </div>
+        <div class="mb-2"><span class="badge {'bg-danger' if balance < 0 else 'bg-dark'}">현재 잔액: {balance:,}원</span>
+          {latest}</div>
+        <div class="table-responsive">
+          <table class="table table-sm align-middle">
+            <thead><tr><th>날짜</th><th>구분</th><th>내용</th><th class='text-end'>금액</th><th class='text-end'>잔액</th></tr></thead>
+            <tbody>{items}</tbody>
+          </table>
+        </div>
+        {more}
+      </div>
+    </div>
+    """
+    return render(body)
+
+@app.get("/member/<name>/statement.csv")
+def member_statement_csv(name):
+    member = _find_member(name)
+    if not member:
+        flash("해당 팀원이 없습니다.", "danger"); return redirect(url_for("status"))
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(["dt", "kind", "id", "description", "amount", "balance"])
+    for r in db_execute(*statement_query(member["id"], limit=None)).fetchall():
+        w.writerow([r["dt"], r["kind"], r["id"], _statement_text(r), r["amount"], r["balance"]])
+    # 엑셀에서 한글이 깨지지 않도록 BOM 포함
+    return Response(buf.getvalue().encode("utf-8-sig"), mimetype="text/csv",
+                    headers={"Content-Disposition": f"attachment; filename*=UTF-8''{quote(name)}_statement.csv"})
+
+# ------------------ 일괄 정산 ------------------
+# 잔액을 0으로 만드는 최소 송금 계획. 잔액 합이 0이 아니면 차액은 '통장'(공금)이 주고받는다.
+# 통장은 이름이 아닌 None 으로 표시해 같은 이름의 팀원과 섞이지 않게 하고, 화면/메모에서만 SETTLE_POOL_LABEL 로 쓴다.
+SETTLE_POOL = None
+SETTLE_POOL_LABEL = "통장"
+SETTLE_EXACT_MAX = 14   # 이 이하(0 아닌 잔액 수)면 부분집합 DP로 최소 송금 수를 보장
+
+def _settle_greedy(parties):
+    # 최소 현금 흐름(탐욕): 가장 큰 채무자 ↔ 가장 큰 채권자를 차례로 맞춤 → 최대 k-1건
+    # 금액만으로 정렬(안정 정렬이라 같은 금액은 입력 순서 유지) — 통장(None)은 이름과 비교할 수 없다
+    debtors = sorted(((-b, n) for n, b in parties if b < 0), key=lambda t: t[0], reverse=True)
+    creditors = sorted(((b, n) for n, b in parties if b > 0), key=lambda t: t[0], reverse=True)
+    out, i, j = [], 0, 0
+    while i < len(debtors) and j < len(creditors):
+        (d, dn), (c, cn) = debtors[i], creditors[j]
+        amt = min(d, c)
+        out.append((dn, cn, amt))
+        debtors[i], creditors[j] = (d - amt, dn), (c - amt, cn)
+        if d == amt: i += 1
+        if c == amt: j += 1
+    return out
+
+def _settle_exact(parties):
+    # 송금 수 = k - (합이 0인 서로소 그룹의 최대 개수). dp[mask] = mask 를 나눌 수 있는 0합 그룹 수 최대
+    k = len(parties)
+    full = (1 << k) - 1
+    sums, dp = [0] * (full + 1), [0] * (full + 1)
+    for mask in range(1, full + 1):
+        low = mask & -mask
+        sums[mask] = sums[mask ^ low] + parties[low.bit_length() - 1][1]
+        best = 0
+        m = mask
+        while m:
+            b = m & -m
+            if dp[mask ^ b] > best:
+                best = dp[mask ^ b]
+            m ^= b
+        dp[mask] = best + (sums[mask] == 0)
+    # 역추적: 합이 0인 지점 사이에서 빠진 원소들이 한 그룹 → 그룹 안은 탐욕으로 (그룹 크기-1)건
+    out, group, mask = [], [], full
+    while mask:
+        target = dp[mask] - (sums[mask] == 0)
+        m = mask
+        while m:
+            b = m & -m
+            if dp[mask ^ b] == target:
+                break
+            m ^= b
+        group.append(parties[b.bit_length() - 1])
+        mask ^= b
+        if sums[mask] == 0:
+            out += _settle_greedy(group)
+            group = []
+    return out
+
+def plan_settlement(balances, solver="auto"):
+    """balances: {이름: 잔액}. return: [(보내는 사람, 받는 사람, 금액)] — 적용하면 모두 0."""
+    parties = [(n, b) for n, b in sorted(balances.items()) if b]
+    total = sum(b for _, b in parties)
+    if total:
+        parties.append((SETTLE_POOL, -total))
+    if solver == "exact" or (solver == "auto" and len(parties) <= SETTLE_EXACT_MAX):
+        return _settle_exact(parties)
+    return _settle_greedy(parties)
+
+def settle_label(name):
+    return SETTLE_POOL_LABEL if name is SETTLE_POOL else name
+
+def settlement_deposit_rows(transfers, dt):
+    # 송금 1건 = 보낸 사람 +금액, 받은 사람 -금액 (통장 쪽은 행 없음)
+    rows = []
+    for src, dst, amt in transfers:
+        if src is not SETTLE_POOL:
+            rows.append((dt, src, amt, f"[정산] {settle_label(dst)}에게 송금"))
+        if dst is not SETTLE_POOL:
+            rows.append((dt, dst, -amt, f"[정산] {settle_label(src)}에게서 수령"))
+    return rows
+
+def _settle_fingerprint(balances):
+    return hashlib.sha256(json.dumps(sorted(balances.items()), ensure_ascii=False).encode()).hexdigest()[:16]
+
+@app.route("/settle", methods=["GET", "POST"])
+def settle():
+    all_bal = {b["name"]: b["balance"] for b in get_balances()}
+    form = request.form if request.method == "POST" else request.args
+    chosen = form.getlist("names") or [n for n, b in all_bal.items() if b]
+    solver = form.get("solver") if form.get("solver") in ("auto", "greedy", "exact") else "auto"
+    if solver == "exact" and sum(1 for n in chosen if all_bal.get(n)) > SETTLE_EXACT_MAX + 2:
+        flash(f"최적 해는 잔액이 있는 인원 {SETTLE_EXACT_MAX}명 안팎까지만 지원합니다. 탐욕 해로 계산합니다.", "warning")
+        solver = "greedy"
+    balances = {n: all_bal[n] for n in chosen if n in all_bal}
+    t0 = datetime.now()
+    transfers = plan_settlement(balances, solver)
+    ms = (datetime.now() - t0).total_seconds() * 1000
+    fp = _settle_fingerprint(balances)
+
+    if request.method == "POST" and form.get("apply"):
+        if form.get("fp") != fp:
+            flash("미리보기 이후 잔액이 바뀌었습니다. 계획을 다시 확인하세요.", "warning")
+        elif transfers:
+            dt = str(date.today())
+            rows = settlement_deposit_rows(transfers, dt)
+            # 모든 입금 행을 한 문장/한 트랜잭션으로
+            db_execute(INSERT_DEPOSITS_SQL, tuple(list(col) for col in zip(*rows)))
+            log_audit("insert", "deposits", None, {"settlement": [list(t) for t in transfers]})
+            notify_balances(*[r[1] for r in rows])
+            get_db().commit()
+            flash(f"정산 완료: 송금 {len(transfers)}건, 입금 기록 {len(rows)}건.", "success")
+            return redirect(url_for("status"))
+
+    checks = "".join([
+        f"<label class='form-check form-check-inline'><input class='form-check-input' type='checkbox' name='names' value='{html_escape(n)}'"
+        f"{' checked' if n in balances else ''}> <span class='{'text-danger' if b < 0 else ''}'>{html_escape(n)} ({b:,})</span></label>"
+        for n, b in all_bal.items()
+    ])
+    solver_opts = "".join([f"<option value='{k}'{' selected' if k == solver else ''}>{lab}</option>"
+                           for k, lab in (("auto", "자동"), ("greedy", "탐욕(대규모)"), ("exact", "최적(소규모)"))])
+    plan_rows = "".join([
+        f"<tr><td>{html_escape(settle_label(a))}</td><td>→</td><td>{html_escape(settle_label(b))}</td><td class='num'>{amt:,}</td></tr>"
+        for a, b, amt in transfers
+    ])
+    hidden = "".join([f"<input type='hidden' name='names' value='{html_escape(n)}'>" for n in balances])
+    pool = -sum(balances.values())
+    body = f"""
+    <div class="card shadow-sm">
+      <div class="card-body">
+        <h5 class="card-title">일괄 정산</h5>
+        <form method="get" class="mb-3">
+          <div class="mb-2">{checks}</div>
+          <div class="d-flex gap-2 align-items-center">
+            <select class="form-select form-select-sm w-auto" name="solver">{solver_opts}</select>
+            <button class="btn btn-sm btn-outline-primary">미리보기</button>
+            <a class="btn btn-sm btn-outline-secondary" href="{ url_for('status') }">현황</a>
+          </div>
+        </form>
+        <div class="mb-2">
+          <span class="badge bg-secondary me-1">대상 {len(balances)}명</span>
+          <span class="badge bg-secondary me-1">송금 {len(transfers)}건</span>
+          <span class="badge bg-secondary me-1">{SETTLE_POOL_LABEL} 주고받을 차액: {pool:,}원</span>
+          <span class="badge bg-light text-dark">계산 {ms:.1f} ms</span>
+        </div>
+        <table class="table table-sm align-middle">
+          <thead><tr><th>보내는 사람</th><th></th><th>받는 사람</th><th class='text-end'>금액</th></tr></thead>
+          <tbody>{plan_rows or "<tr><td colspan='4' class='text-center text-muted'>정산할 잔액이 없습니다.</td></tr>"}</tbody>
+        </table>
+        <form method="post" onsubmit="return confirm('입금 내역으로 일괄 기록할까요?');">
+          {hidden}
+          <input type="hidden" name="solver" value="{solver}">
+          <input type="hidden" name="fp" value="{fp}">
+          <button class="btn btn-primary" name="apply" value="1"{'' if transfers else ' disabled'}>정산 적용</button>
+        </form>
+        <div class="text-muted small mt-2">* 송금 1건마다 보낸 사람 +금액, 받은 사람 -금액의 입금 행이 남습니다. ({SETTLE_POOL_LABEL}과의 송금은 해당 팀원 행만)</div>
+      </div>
+    </div>
     """
     return render(body)
 
 # ------------------ 엑셀 내보내기 ------------------
-@app.get("/export_excel")
-def export_excel():
+def build_excel_export():
+    from openpyxl import Workbook  # 무거운 모듈이라 첫 사용 시 로드
     wb = Workbook()
     ws1 = wb.active
     ws1.title = "members"
-    ws1.append(["name"])
-    for r in db_execute("SELECT name FROM members ORDER BY name;").fetchall():
-        ws1.append([r["name"]])
+    ws1.append(["id", "name"])
+    for r in db_execute("SELECT id, name FROM members ORDER BY name;").fetchall():
+        ws1.append([r["id"], r["name"]])
 
     def add_sheet(name, sql, cols):
         ws = wb.create_sheet(title=name)
@@ -1312,14 +3035,14 @@ def export_excel():
             ws.append([row.get(c) for c in cols])
 
     add_sheet("deposits",
-              "SELECT id,dt,name,amount,note FROM deposits ORDER BY id;",
-              ["id","dt","name","amount","note"])
+              DEPOSIT_SELECT + " ORDER BY d.id;",
+              ["id","dt","member_id","name","amount","note"])
     add_sheet("meals",
-              "SELECT id,dt,entry_mode,main_mode,side_mode,main_total,side_total,grand_total,payer_name,guest_total FROM meals ORDER BY id;",
-              ["id","dt","entry_mode","main_mode","side_mode","main_total","side_total","grand_total","payer_name","guest_total"])
+              MEAL_SELECT + " ORDER BY m.id;",
+              ["id","dt","entry_mode","main_mode","side_mode","main_total","side_total","grand_total","payer_id","payer_name","guest_total"])
     add_sheet("meal_parts",
-              "SELECT id,meal_id,name,main_amount,side_amount,total_amount FROM meal_parts ORDER BY id;",
-              ["id","meal_id","name","main_amount","side_amount","total_amount"])
+              MEAL_PARTS_SELECT + " ORDER BY p.id;",
+              ["id","meal_id","member_id","name","main_amount","side_amount","total_amount"])
     add_sheet("notices",
               "SELECT id,dt,content FROM notices ORDER BY id;",
               ["id","dt","content"])
@@ -1334,32 +3057,522 @@ def export_excel():
               ["name","losses"])
 
     buf = io.BytesIO()
-    wb.save(buf); buf.seek(0)
-    fname = f"lunch_book_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
-    return send_file(buf, as_attachment=True, download_name=fname, mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+    wb.save(buf)
+    return buf.getvalue(), f"lunch_book_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+
+# 같은 데이터로 만든 통합문서는 같으므로, 데이터 버전별로 웹 프로세스의 로컬 디스크에 보관해 두고 그대로 내려준다.
+# 버전 = data_versions 의 테이블별 변경 카운터(v12). 내보내는 테이블의 INSERT/UPDATE/DELETE 마다 트리거가
+# 같은 트랜잭션 안에서 올리므로, 기록 경로가 감사 로그를 남기는지와 상관없이 모든 수정이 새 버전이 된다.
+# 워커는 다른 서버에서 돌 수 있어 캐시는 결과를 내려받는 웹 쪽(job_download)이 채운다.
+EXPORT_CACHE_DIR = os.environ.get("EXPORT_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "lunch_exports")
+EXPORT_CACHE_MAX_MB = int(os.environ.get("EXPORT_CACHE_MAX_MB", "200"))   # 넘으면 가장 오래 안 쓴 파일부터 삭제
+def export_data_version():
+    rows = db_execute("SELECT tbl, version FROM data_versions ORDER BY tbl;").fetchall()
+    return hashlib.sha1("|".join(f"{r['tbl']}={r['version']}" for r in rows).encode()).hexdigest()[:16]
+
+class ExportCache:
+    """내보내기 파일 캐시. 파일명 <버전>__<다운로드 이름>, 마지막 사용 시각 = mtime (LRU)."""
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+
+    def _entries(self):
+        try:
+            return [e for e in os.scandir(self.root) if e.is_file() and "__" in e.name]
+        except FileNotFoundError:
+            return []
+
+    def get(self, version):
+        """return: (경로, 다운로드 이름) 또는 None. 찾으면 최근 사용으로 표시."""
+        for e in self._entries():
+            if e.name.startswith(version + "__"):
+                try:
+                    os.utime(e.path)
+                except FileNotFoundError:
+                    return None  # 다른 프로세스가 방금 지움
+                return e.path, e.name.split("__", 1)[1]
+        return None
+
+    def put(self, version, name, content):
+        if len(content) > self.max_bytes:
+            return
+        os.makedirs(self.root, exist_ok=True)
+        path = os.path.join(self.root, f"{version}__{name}")
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(content)
+        os.replace(tmp, path)  # 읽는 쪽은 완성된 파일만 본다
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            entries = sorted(self._entries(), key=lambda e: e.stat().st_mtime, reverse=True)
+            total = 0
+            for e in entries:
+                total += e.stat().st_size
+                if total > self.max_bytes:
+                    try:
+                        os.remove(e.path)
+                    except FileNotFoundError:
+                        pass
+
+export_cache = ExportCache(EXPORT_CACHE_DIR, EXPORT_CACHE_MAX_MB * 1024 * 1024)
+
+def enqueue_excel_export(version):
+    """같은 버전의 작업이 대기/실행 중이거나 결과가 남아 있으면 그 작업을 다시 쓴다. return: (작업 id, 결과 있음 여부)"""
+    row = db_execute("""SELECT id, status FROM jobs WHERE kind='export_excel' AND params=?
+                          AND (status IN ('queued', 'running') OR (status='done' AND result IS NOT NULL))
+                        ORDER BY id DESC LIMIT 1;""", (json.dumps({"version": version}),)).fetchone()
+    if row:
+        return row["id"], row["status"] == "done"
+    return enqueue_job("export_excel", {"version": version}), False
 
-# ------------------ 호구게임 공통: 참가자 파싱 ------------------
-def parse_players():
-    members = get_members()
-    selected = request.form.getlist("players")  # 멤버 선택
-    guest_raw = (request.form.get("guests") or "").strip()
-    guests = [x.strip() for x in guest_raw.split(",") if x.strip()] if guest_raw else []
-    players = selected + guests
-    players = [p for p in players if p]  # dedup 간단히 생략
-    return players, members
+@app.get("/export_excel")
+def export_excel():
+    # 데이터가 그대로면 캐시된 파일을 바로, 바뀌었으면 작업으로 다시 만든다 → 작업 화면에서 완료 후 다운로드
+    version = export_data_version()
+    hit = export_cache.get(version)
+    if hit:
+        return send_file(hit[0], as_attachment=True, download_name=hit[1], mimetype=XLSX_MIME)
+    job_id, done = enqueue_excel_export(version)
+    return redirect(url_for("job_download" if done else "job_detail", job_id=job_id))
+
+# ------------------ 분석용 내보내기 (Parquet) ------------------
+# `flask --app main export-parquet <폴더>`: 테이블마다 <폴더>/<테이블>/ 아래 Parquet 파일(zstd).
+# 날짜가 있는 큰 테이블은 월별(Hive 형식 month=YYYY-MM/) 파티션 → pandas.read_parquet("<폴더>/meals") 등으로 바로 읽힌다.
+# 텍스트로 저장된 dt 는 date32 / timestamp 로, games.participants(JSON 배열)는 list<string> 으로 타입을 붙인다.
+# 행은 서버측 커서(db_stream)로 PARQUET_BATCH_ROWS 건씩 읽어 바로 쓴다. 증분(기본): 월별 (행 수, 최대 id, 합계) 지문을
+# _manifest.json 에 남겨 두고 새로 생기거나 지문이 바뀐 달만 다시 쓴다(글자만 고친 수정은 --full 로).
+PARQUET_BATCH_ROWS = 50000
+PARQUET_MANIFEST = "_manifest.json"
+
+# columns: (SQL 식, 열 이름, 형식) — 형식: int32 / int64 / string / bool / date / list / ts:<strptime 형식>
+# month: 파티션 기준 날짜 열(없으면 파일 하나). check: 월별 지문에 더할 합계 식들
+ParquetTable = namedtuple("ParquetTable", "name source order columns month check")
+PARQUET_TABLES = [
+    ParquetTable("members", "members", "id", [("id", "id", "int32"), ("name", "name", "string")], None, ()),
+    ParquetTable("deposits", "deposits", "id",
+                 [("id", "id", "int32"), ("dt", "dt", "date"), ("member_id", "member_id", "int32"),
+                  ("amount", "amount", "int64"), ("note", "note", "string")],
+                 "dt", ("SUM(amount)", "SUM(member_id)")),
+    ParquetTable("meals", "meals", "id",
+                 [("id", "id", "int32"), ("dt", "dt", "date"), ("entry_mode", "entry_mode", "string"),
+                  ("main_mode", "main_mode", "string"), ("side_mode", "side_mode", "string"),
+                  ("main_total", "main_total", "int64"), ("side_total", "side_total", "int64"),
+                  ("grand_total", "grand_total", "int64"), ("guest_total", "guest_total", "int64"),
+                  ("payer_id", "payer_id", "int32")],
+                 "dt", ("SUM(grand_total + guest_total + main_total + side_total)", "SUM(COALESCE(payer_id, 0))")),
+    ParquetTable("meal_parts", "meal_parts p JOIN meals m ON m.id = p.meal_id", "p.id",
+                 [("p.id", "id", "int32"), ("p.meal_id", "meal_id", "int32"), ("p.member_id", "member_id", "int32"),
+                  ("p.main_amount", "main_amount", "int64"), ("p.side_amount", "side_amount", "int64"),
+                  ("p.total_amount", "total_amount", "int64")],
+                 "m.dt", ("SUM(p.total_amount)", "SUM(p.member_id)")),
+    ParquetTable("audit_logs", "audit_logs", "id",
+                 [("id", "id", "int32"), ("dt", "dt", "ts:%Y-%m-%d %H:%M:%S"), ("action", "action", "string"),
+                  ("target_table", "target_table", "string"), ("target_id", "target_id", "int32"),
+                  ("payload", "payload", "string")],
+                 "dt", ()),
+    ParquetTable("notices", "notices", "id",
+                 [("id", "id", "int32"), ("dt", "dt", "ts:%Y-%m-%d %H:%M"), ("content", "content", "string")], None, ()),
+    ParquetTable("games", "games", "id",
+                 [("id", "id", "int32"), ("dt", "dt", "ts:%Y-%m-%d %H:%M:%S"), ("game_type", "game_type", "string"),
+                  ("rule", "rule", "string"), ("participants", "participants", "list"), ("winner", "winner", "string"),
+                  ("loser", "loser", "string"), ("extra", "extra", "string")], None, ()),
+    ParquetTable("game_participants", "game_participants", "game_id, seat",
+                 [("game_id", "game_id", "int32"), ("seat", "seat", "int32"), ("name", "name", "string"),
+                  ("is_loser", "is_loser", "bool")], None, ()),
+    ParquetTable("hogu_stats", "hogu_stats", "name", [("name", "name", "string"), ("losses", "losses", "int32")], None, ()),
+    ParquetTable("hogu_daily", "hogu_daily", "day, game_type, name",
+                 [("day", "day", "date"), ("game_type", "game_type", "string"), ("name", "name", "string"),
+                  ("losses", "losses", "int32")], None, ()),
+    ParquetTable("meal_templates", "meal_templates", "id",
+                 [("id", "id", "int32"), ("name", "name", "string"), ("fields", "fields", "string"),
+                  ("updated_at", "updated_at", "ts:%Y-%m-%d %H:%M:%S")], None, ()),
+]
 
-# ------------------ 호구게임 대시보드 ------------------
-@app.get("/games")
-def games_home():
-    ranks = db_execute("SELECT name, losses FROM hogu_stats ORDER BY losses DESC, name;").fetchall()
-    rows = "".join([f"<tr><td>{i+1}</td><td>{html_escape(r['name'])}</td><td class='num'>{r['losses']}</td></tr>" for i,r in enumerate(ranks)])
+def _parquet_month_fingerprints(t):
+    checks = "".join(f", COALESCE({c}, 0) AS c{i}" for i, c in enumerate(t.check))
+    rows = db_execute(f"""SELECT substr({t.month}, 1, 7) AS month, COUNT(*) AS n, MAX({t.order}) AS max_id{checks}
+                          FROM {t.source} GROUP BY substr({t.month}, 1, 7);""").fetchall()
+    return {r["month"]: [str(v) for k, v in r.items() if k != "month"] for r in rows}
+
+def _arrow_column(pa, pc, kind, values):
+    if kind == "date":
+        return pc.strptime(pa.array(values, pa.string()), format="%Y-%m-%d", unit="s", error_is_null=True).cast(pa.date32())
+    if kind.startswith("ts:"):
+        return pc.strptime(pa.array(values, pa.string()), format=kind[3:], unit="ms", error_is_null=True)
+    if kind == "list":
+        return pa.array([json.loads(v) if v else None for v in values], pa.list_(pa.string()))
+    if kind == "bool":
+        return pa.array([None if v is None else bool(v) for v in values], pa.bool_())
+    return pa.array(values, {"int32": pa.int32(), "int64": pa.int64(), "string": pa.string()}[kind])
+
+class _ParquetFile:
+    # 임시 파일에 쓰고 close 때 제자리로 옮긴다(중간에 멈춰도 이전 파일이 남음)
+    def __init__(self, pq, path, schema):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.path, self.tmp = path, path + ".tmp"
+        self.writer = pq.ParquetWriter(self.tmp, schema, compression="zstd")
+        self.rows = 0
+
+    def write(self, batch):
+        self.writer.write_batch(batch)
+        self.rows += batch.num_rows
+
+    def close(self):
+        self.writer.close()
+        os.replace(self.tmp, self.path)
+
+def export_parquet_table(t, out_dir, months=None):
+    """테이블 t 를 out_dir/<이름>/ 에 쓴다. months: 다시 쓸 달 목록(파티션 테이블만, None 이면 전부). return: 쓴 행 수"""
+    import pyarrow as pa, pyarrow.compute as pc, pyarrow.parquet as pq  # 무거운 모듈이라 첫 사용 시 로드
+    kinds = {"date": pa.date32(), "list": pa.list_(pa.string()), "bool": pa.bool_(),
+             "int32": pa.int32(), "int64": pa.int64(), "string": pa.string()}
+    schema = pa.schema([(name, pa.timestamp("ms") if kind.startswith("ts:") else kinds[kind]) for _, name, kind in t.columns])
+    cols = ", ".join(f"{expr} AS {name}" for expr, name, _ in t.columns)
+    table_dir = os.path.join(out_dir, t.name)
+    if t.month:
+        sql, params = f"SELECT substr({t.month}, 1, 7) AS month, {cols} FROM {t.source}", ()
+        if months is not None:
+            sql += f" WHERE substr({t.month}, 1, 7) = ANY(?)"; params = (sorted(months),)
+        sql += f" ORDER BY 1, {t.order};"
+    else:
+        sql, params = f"SELECT '' AS month, {cols} FROM {t.source} ORDER BY {t.order};", ()
+
+    total, out, buf, month = 0, None, [], None
+    def flush():
+        if buf:
+            out.write(pa.RecordBatch.from_arrays(
+                [_arrow_column(pa, pc, kind, [r[name] for r in buf]) for _, name, kind in t.columns], schema=schema))
+            buf.clear()
+    for row in db_stream(sql, params, PARQUET_BATCH_ROWS):
+        if out is None or row["month"] != month:
+            if out is not None:
+                flush(); out.close(); total += out.rows
+            month = row["month"]
+            out = _ParquetFile(pq, os.path.join(table_dir, f"month={month}" if t.month else "", "part-0.parquet"), schema)
+        buf.append(row)
+        if len(buf) >= PARQUET_BATCH_ROWS:
+            flush()
+    if out is not None:
+        flush(); out.close(); total += out.rows
+    elif not t.month:
+        _ParquetFile(pq, os.path.join(table_dir, "part-0.parquet"), schema).close()  # 빈 테이블도 스키마는 남긴다
+    return total
+
+def export_parquet(out_dir, full=False, log=print):
+    """모든 테이블을 Parquet 으로. 증분이면 바뀐 달만 다시 쓴다. return: 새 manifest"""
+    path = os.path.join(out_dir, PARQUET_MANIFEST)
+    try:
+        with open(path) as f:
+            old = json.load(f)
+    except (FileNotFoundError, ValueError):
+        old = {}
+    if old.get("schema") != SCHEMA_VERSION:
+        full = True  # 스키마가 바뀌었으면 지문을 믿지 않는다
+    manifest = {"schema": SCHEMA_VERSION, "exported_at": _now_str(), "tables": {}}
+    for t in PARQUET_TABLES:
+        t0 = time.perf_counter()
+        if not t.month:
+            n = export_parquet_table(t, out_dir)
+            log(f"{t.name:<18} {n:>9,}행 · {time.perf_counter() - t0:.2f}초")
+            continue
+        prints = _parquet_month_fingerprints(t)
+        before = old.get("tables", {}).get(t.name, {}) if not full else {}
+        todo = sorted(m for m, fp in prints.items() if before.get(m) != fp)
+        n = export_parquet_table(t, out_dir, todo) if todo else 0
+        # 행이 모두 사라진 달의 파티션은 지운다
+        table_dir = os.path.join(out_dir, t.name)
+        for e in (os.scandir(table_dir) if os.path.isdir(table_dir) else []):
+            if e.is_dir() and e.name.startswith("month=") and e.name[6:] not in prints:
+                shutil.rmtree(e.path)
+        manifest["tables"][t.name] = prints
+        log(f"{t.name:<18} {n:>9,}행 · 파티션 {len(todo)}/{len(prints)}개 다시 씀 · {time.perf_counter() - t0:.2f}초")
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)  # 다 쓴 뒤에 기록 → 중간에 멈추면 다음 실행이 다시 쓴다
+    return manifest
+
+# ------------------ 백그라운드 작업 ------------------
+# 무거운 작업(내보내기/가져오기/재계산)은 jobs 테이블에 넣고 `flask --app main worker` 프로세스가 처리.
+# 워커는 FOR UPDATE SKIP LOCKED 로 한 건씩 가져가므로 여러 개 띄워도 중복 처리되지 않는다(SQLite 는 쓰기 잠금이 DB 전체라 그대로 안전).
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+JOB_KINDS = {"export_excel": "엑셀 내보내기", "rebuild_stats": "호구 통계 재계산", "import_deposits": "입금 CSV 가져오기"}
+JOB_STATUS_LABELS = {"queued": ("대기", "secondary"), "running": ("실행 중", "primary"),
+                     "done": ("완료", "success"), "failed": ("실패", "danger")}
+JOB_MAX_ATTEMPTS = 3
+JOB_STALE_MINUTES = 15      # 이 시간 넘게 running 이면 워커가 죽은 것으로 보고 재시도
+JOB_RESULT_TTL_DAYS = 7     # 결과 파일 보관 기간
+JOB_HANDLERS = {}
+
+def job_handler(kind):
+    # 핸들러: (params, input bytes) → {"content", "name", "mime", "message"} 중 필요한 것만
+    def deco(fn):
+        JOB_HANDLERS[kind] = fn
+        return fn
+    return deco
+
+def _now_str(delta=timedelta()):
+    return (datetime.now() + delta).strftime("%Y-%m-%d %H:%M:%S")
+
+def enqueue_job(kind, params=None, data=None):
+    cur = db_execute("INSERT INTO jobs(kind, params, input, created_at) VALUES (?,?,?,?) RETURNING id;",
+                     (kind, json.dumps(params or {}, ensure_ascii=False),
+                      storage.binary(data), _now_str()))
+    job_id = cur.fetchone()["id"]
+    storage.notify("jobs")  # 대기 중인 워커 깨우기 (커밋 시 전달)
+    get_db().commit()
+    return job_id
+
+JOB_CLAIM_SQL = """
+UPDATE jobs SET status='running', started_at=?, attempts=attempts+1
+WHERE id = (SELECT id FROM jobs WHERE status='queued' ORDER BY id FOR UPDATE SKIP LOCKED LIMIT 1)
+RETURNING id, kind, params, input;
+"""
+
+def run_next_job():
+    """대기 작업 1건 처리. return: 처리한 작업 id (없으면 None)"""
+    # 오래 멈춘 running 작업 회수(워커 비정상 종료) — 재시도 한도를 넘으면 실패 처리
+    db_execute("""UPDATE jobs SET status = CASE WHEN attempts < ? THEN 'queued' ELSE 'failed' END,
+                  error = CASE WHEN attempts < ? THEN error ELSE '워커 응답 없음' END
+                  WHERE status='running' AND started_at < ?;""",
+               (JOB_MAX_ATTEMPTS, JOB_MAX_ATTEMPTS, _now_str(-timedelta(minutes=JOB_STALE_MINUTES))))
+    job = db_execute(JOB_CLAIM_SQL, (_now_str(),)).fetchone()
+    get_db().commit()
+    if not job:
+        return None
+    try:
+        out = JOB_HANDLERS[job["kind"]](json.loads(job["params"]), bytes(job["input"]) if job["input"] is not None else None) or {}
+        content = out.get("content")
+        db_execute("""UPDATE jobs SET status='done', finished_at=?, message=?, result=?, result_name=?, result_mime=?, error=NULL
+                      WHERE id=?;""",
+                   (_now_str(), out.get("message"), storage.binary(content),
+                    out.get("name"), out.get("mime"), job["id"]))
+    except Exception:
+        get_db().rollback()
+        db_execute("UPDATE jobs SET status='failed', finished_at=?, error=? WHERE id=?;",
+                   (_now_str(), traceback.format_exc()[-2000:], job["id"]))
+    get_db().commit()
+    return job["id"]
+
+def purge_job_results():
+    db_execute("UPDATE jobs SET result=NULL WHERE result IS NOT NULL AND finished_at < ?;",
+               (_now_str(-timedelta(days=JOB_RESULT_TTL_DAYS)),))
+    get_db().commit()
+
+@job_handler("export_excel")
+def _job_export_excel(params, data):
+    content, name = build_excel_export()
+    return {"content": content, "name": name, "mime": XLSX_MIME}
+
+@job_handler("rebuild_stats")
+def _job_rebuild_stats(params, data):
+    rebuild_hogu_stats()
+    n = db_execute("SELECT COUNT(*) AS c, COALESCE(SUM(losses),0) AS s FROM hogu_stats;").fetchone()
+    return {"message": f"hogu_stats: {n['c']}명 / 총 {n['s']}회"}
+
+@job_handler("import_deposits")
+def _job_import_deposits(params, data):
+    # CSV(dt,name,amount[,note]) → deposits. 없는 팀원/형식 오류 행은 건너뜀. 한 트랜잭션.
+    members = set(get_members())
+    rows, skipped = [], 0
+    for rec in csv.reader(io.StringIO(data.decode("utf-8-sig"))):
+        if not rec or rec[0].strip().lower() in ("dt", "date", "날짜"):
+            continue
+        try:
+            dt, name, amount = str(date.fromisoformat(rec[0].strip())), rec[1].strip(), int(rec[2])
+        except (ValueError, IndexError):
+            skipped += 1; continue
+        if name not in members or amount == 0:
+            skipped += 1; continue
+        rows.append((dt, name, amount, (rec[3].strip() if len(rec) > 3 else "") or "CSV 가져오기"))
+    if rows:
+        db_execute(INSERT_DEPOSITS_SQL, tuple(list(col) for col in zip(*rows)))
+        log_audit("insert", "deposits", None, {"import_job": params.get("filename"), "rows": len(rows)})
+        notify_balances(*[r[1] for r in rows])
+    return {"message": f"{len(rows)}건 가져옴, {skipped}건 건너뜀"}
+
+def _job_status_badge(status):
+    label, color = JOB_STATUS_LABELS.get(status, (status, "secondary"))
+    return f"<span class='badge bg-{color}'>{label}</span>"
+
+@app.route("/jobs", methods=["GET", "POST"])
+def jobs():
+    if request.method == "POST":
+        kind = request.form.get("kind")
+        if kind == "import_deposits":
+            f = request.files.get("file")
+            if not f or not f.filename:
+                flash("CSV 파일을 선택하세요.", "warning"); return redirect(url_for("jobs"))
+            job_id = enqueue_job(kind, {"filename": f.filename}, f.read())
+        elif kind == "export_excel":
+            job_id, _done = enqueue_excel_export(export_data_version())
+        elif kind in JOB_KINDS:
+            job_id = enqueue_job(kind)
+        else:
+            flash("알 수 없는 작업입니다.", "danger"); return redirect(url_for("jobs"))
+        return redirect(url_for("job_detail", job_id=job_id))
+
+    rows = db_execute("""SELECT id, kind, status, created_at, finished_at, message, result_name, result IS NOT NULL AS has_result
+                         FROM jobs ORDER BY id DESC LIMIT 50;""").fetchall()
+    items = "".join([
+        f"<tr><td><a href='{ url_for('job_detail', job_id=r['id']) }'>#{r['id']}</a></td><td>{JOB_KINDS.get(r['kind'], r['kind'])}</td>"
+        f"<td>{_job_status_badge(r['status'])}</td><td>{r['created_at']}</td><td>{r['finished_at'] or ''}</td>"
+        f"<td>{html_escape(r['message'] or '')}</td><td class='text-end'>"
+        + (f"<a class='btn btn-sm btn-outline-success' href='{ url_for('job_download', job_id=r['id']) }'>다운로드</a>" if r["has_result"] else "")
+        + "</td></tr>"
+        for r in rows
+    ])
+    body = f"""
+    <div class="card shadow-sm">
+      <div class="card-body">
+        <h5 class="card-title">백그라운드 작업</h5>
+        <div class="d-flex gap-2 flex-wrap mb-3">
+          <form method="post"><input type="hidden" name="kind" value="export_excel"><button class="btn btn-sm btn-outline-success">엑셀 내보내기</button></form>
+          <form method="post"><input type="hidden" name="kind" value="rebuild_stats"><button class="btn btn-sm btn-outline-secondary">호구 통계 재계산</button></form>
+          <form method="post" enctype="multipart/form-data" class="d-flex gap-1">
+            <input type="hidden" name="kind" value="import_deposits">
+            <input class="form-control form-control-sm" type="file" name="file" accept=".csv,text/csv">
+            <button class="btn btn-sm btn-outline-primary text-nowrap">입금 CSV 가져오기</button>
+          </form>
+        </div>
+        <div class="form-text mb-2">CSV 형식: 날짜(YYYY-MM-DD), 이름, 금액, 메모(선택). 결과 파일은 {JOB_RESULT_TTL_DAYS}일간 보관됩니다. <a href="{ url_for('sql_stats') }">SQL 통계</a> · <a href="{ url_for('ledger_check') }">정합성 점검</a></div>
+        <div class="table-responsive">
+          <table class="table table-sm align-middle">
+            <thead><tr><th>ID</th><th>작업</th><th>상태</th><th>등록</th><th>완료</th><th>결과</th><th></th></tr></thead>
+            <tbody>{items or "<tr><td colspan='7' class='text-center text-muted'>작업 없음</td></tr>"}</tbody>
+          </table>
+        </div>
+      </div>
+    </div>
+    """
+    return render(body)
+
+@app.get("/jobs/<int:job_id>")
+def job_detail(job_id):
+    r = db_execute("""SELECT id, kind, status, attempts, created_at, started_at, finished_at, message, error, result_name,
+                             result IS NOT NULL AS has_result FROM jobs WHERE id=?;""", (job_id,)).fetchone()
+    if not r:
+        flash("해당 작업이 없습니다.", "danger"); return redirect(url_for("jobs"))
+    pending = r["status"] in ("queued", "running")
+    download = (f"<a class='btn btn-success' href='{ url_for('job_download', job_id=job_id) }'>{html_escape(r['result_name'])} 다운로드</a>"
+                if r["has_result"] else "")
+    body = f"""
+    <div class="card shadow-sm">
+      <div class="card-body">
+        <h5 class="card-title">작업 #{r['id']} · {JOB_KINDS.get(r['kind'], r['kind'])} {_job_status_badge(r['status'])}</h5>
+        <div class="small text-muted mb-2">등록 {r['created_at']} · 시작 {r['started_at'] or '-'} · 완료 {r['finished_at'] or '-'} · 시도 {r['attempts']}회</div>
+        {f"<div class='alert alert-info'>{html_escape(r['message'])}</div>" if r['message'] else ""}
+        {f"<pre class='small bg-light p-2'>{html_escape(r['error'])}</pre>" if r['error'] and r['status'] == 'failed' else ""}
+        {"<div class='text-muted mb-2'>처리 중입니다. 이 화면은 자동으로 새로고침됩니다.</div>" if pending else ""}
+        <div class="d-flex gap-2">{download}<a class="btn btn-outline-secondary" href="{ url_for('jobs') }">작업 목록</a></div>
+      </div>
+    </div>
+    {"<script>setTimeout(function(){ location.reload(); }, 2000);</script>" if pending else ""}
+    """
+    return render(body)
+
+@app.get("/jobs/<int:job_id>/download")
+def job_download(job_id):
+    r = db_execute("SELECT kind, params, result, result_name, result_mime FROM jobs WHERE id=? AND result IS NOT NULL;", (job_id,)).fetchone()
+    if not r:
+        flash("다운로드할 결과가 없습니다(만료되었거나 아직 처리 중).", "warning"); return redirect(url_for("job_detail", job_id=job_id))
+    version = json.loads(r["params"]).get("version")
+    if r["kind"] == "export_excel" and version and not export_cache.get(version):
+        export_cache.put(version, r["result_name"], bytes(r["result"]))
+    return send_file(io.BytesIO(bytes(r["result"])), as_attachment=True, download_name=r["result_name"],
+                     mimetype=r["result_mime"] or "application/octet-stream")
+
+NOT_PREPARED_BADGE = "<span class='badge bg-secondary'>PREPARE 안 함</span>"
+
+@app.get("/sql-stats")
+def sql_stats():
+    # 이 워커 프로세스의 문장별 누적 통계(워커마다 따로 센다)
+    with sql_registry.lock:
+        stmts = sorted(sql_registry.stmts.values(), key=lambda st: st.seconds, reverse=True)
+        rows = [(st.sql, st.calls, st.seconds, st.max_seconds, st.prepared_calls, st.preparable) for st in stmts]
+    items = "".join([
+        f"<tr><td><code class='small'>{html_escape(' '.join(sql.split())[:200])}</code></td><td class='num'>{calls:,}</td>"
+        f"<td class='num'>{seconds * 1000:,.1f}</td><td class='num'>{seconds * 1000 / calls if calls else 0:,.2f}</td>"
+        f"<td class='num'>{mx * 1000:,.2f}</td><td class='num'>{prepared:,}</td>"
+        f"<td>{'' if preparable else NOT_PREPARED_BADGE}</td></tr>"
+        for sql, calls, seconds, mx, prepared, preparable in rows
+    ])
+    body = f"""
+    <div class="card shadow-sm">
+      <div class="card-body">
+        <h5 class="card-title">SQL 통계 <span class="text-muted small">(워커 pid {os.getpid()}, 유휴 연결 {len(db_pool.idle)}개)</span></h5>
+        <div class="form-text mb-2">{DB_PREPARE_AFTER}번째 호출부터 연결마다 PREPARE 한 문장을 EXECUTE 로 실행합니다(0 = 사용 안 함). 시간은 문장 실행과 결과 수신까지입니다.</div>
+        <div class="table-responsive">
+          <table class="table table-sm align-middle">
+            <thead><tr><th>문장</th><th class="text-end">호출</th><th class="text-end">합계(ms)</th><th class="text-end">평균(ms)</th><th class="text-end">최대(ms)</th><th class="text-end">PREPARE 실행</th><th></th></tr></thead>
+            <tbody>{items or "<tr><td colspan='7' class='text-center text-muted'>기록 없음</td></tr>"}</tbody>
+          </table>
+        </div>
+        <a class="btn btn-outline-secondary" href="{ url_for('jobs') }">작업 목록</a>
+      </div>
+    </div>
+    """
+    return render(body)
+
+# ------------------ 호구게임 공통: 참가자 파싱 ------------------
+def parse_players():
     members = get_members()
-    opts = "".join([f"<option value='{m}'>{m}</option>" for m in members])
+    selected = request.form.getlist("players")  # 멤버 선택
+    guest_raw = (request.form.get("guests") or "").strip()
+    guests = [x.strip() for x in guest_raw.split(",") if x.strip()] if guest_raw else []
+    players = selected + guests
+    players = [p for p in players if p]  # dedup 간단히 생략
+    return players, members
+
+# ------------------ 호구게임 대시보드 ------------------
+LEADERBOARD_PERIODS = {"all": "전체", "month": "이번 달", "week": "이번 주"}
+
+def leaderboard_query(period="all", game_type=None):
+    # 누적·전체 종류는 hogu_stats, 그 외에는 hogu_daily 의 (일자) 범위 스캔 후 합산
+    if period == "all" and not game_type:
+        return "SELECT name, losses FROM hogu_stats WHERE losses > 0 ORDER BY losses DESC, name;", ()
+    today = date.today()
+    start = {"all": "", "month": str(today.replace(day=1)),
+             "week": str(today - timedelta(days=today.weekday()))}[period]
+    sql = "SELECT name, SUM(losses) AS losses FROM hogu_daily WHERE day >= ?"
+    params = [start]
+    if game_type:
+        sql += " AND game_type = ?"; params.append(game_type)
+    sql += " GROUP BY name ORDER BY losses DESC, name;"
+    return sql, tuple(params)
+
+def get_leaderboard(period="all", game_type=None):
+    return db_execute(*leaderboard_query(period, game_type)).fetchall()
+
+def _games_args(args):
+    period = args.get("period") if args.get("period") in LEADERBOARD_PERIODS else "all"
+    game_type = args.get("type") if args.get("type") in GAME_TYPES else None
+    return period, game_type
+
+@read_view("games_home", lambda args: {"ranks": leaderboard_query(*_games_args(args)), "live": (LIVE_CURSOR_SQL, ())})
+def games_page(args, data):
+    period, game_type = _games_args(args)
+    ranks = data["ranks"]
+    rows = "".join([f"<tr data-name='{html_escape(r['name'])}'><td>{i+1}</td><td>{html_escape(r['name'])}</td><td class='num'>{r['losses']}</td></tr>" for i,r in enumerate(ranks)])
+    live_rank = period == "all" and game_type is None  # 실시간 델타(누적 횟수)를 그대로 반영할 수 있는 탭
+
+    def tab(label, p, t, active):
+        cls = "btn-secondary" if active else "btn-outline-secondary"
+        return f"<a class='btn btn-sm {cls}' href='{url_for('games_home', period=p, type=t)}'>{label}</a>"
+    period_tabs = "".join([tab(lab, p, game_type, p == period) for p, lab in LEADERBOARD_PERIODS.items()])
+    type_tabs = tab("전체 게임", period, None, game_type is None) + "".join(
+        [tab(lab, period, t, t == game_type) for t, lab in GAME_TYPES.items()])
 
     body = f"""
     <div class="card shadow-sm">
       <div class="card-body">
         <h5 class="card-title">호구순위</h5>
+        <div id="liveGame" class="alert alert-info py-1 small d-none"></div>
+        <div class="d-flex gap-2 flex-wrap mb-1">{period_tabs}</div>
+        <div class="d-flex gap-2 flex-wrap mb-2">{type_tabs}</div>
         <table class="table table-sm">
           <thead><tr><th>순위</th><th>이름</th><th class='text-end'>걸린 횟수</th></tr></thead>
           <tbody>{rows or "<tr><td colspan='3' class='text-center text-muted'>기록 없음</td></tr>"}</tbody>
@@ -1370,130 +3583,487 @@ def games_home():
           <a class="btn btn-outline-primary btn-sm" href="{ url_for('dice_game') }">주사위게임</a>
           <a class="btn btn-outline-success btn-sm" href="{ url_for('ladder_game') }">사다리게임</a>
           <a class="btn btn-outline-dark btn-sm" href="{ url_for('oddcard_game') }">외톨이 카드</a>
+          <a class="btn btn-outline-secondary btn-sm" href="{ url_for('games_history') }">게임 기록</a>
+          <a class="btn btn-outline-secondary btn-sm" href="{ url_for('dice_fairness') }">룰 공정성 시뮬레이터</a>
+        </div>
+      </div>
+    </div>
+    {live_script(data["live"][0])}
+    <script>
+      const GAME_LABELS = {json.dumps(GAME_TYPES, ensure_ascii=False)};
+      const LIVE_RANK = {json.dumps(live_rank)};
+      document.addEventListener('live:game', function(e) {{
+        const g = e.detail;
+        const box = document.getElementById('liveGame');
+        box.textContent = '방금 끝난 ' + (GAME_LABELS[g.type] || g.type) + ' #' + g.id + ' · 호구: ' + g.loser;
+        box.classList.remove('d-none');
+        if (!LIVE_RANK || !g.loser) return;
+        const tbody = document.querySelector('table tbody');
+        let tr = tbody.querySelector('tr[data-name="' + CSS.escape(g.loser) + '"]');
+        if (!tr) {{
+          if (!tbody.querySelector('tr[data-name]')) tbody.innerHTML = '';
+          tr = document.createElement('tr'); tr.dataset.name = g.loser;
+          tr.innerHTML = '<td></td><td></td><td class="num"></td>';
+          tr.children[1].textContent = g.loser;
+          tbody.appendChild(tr);
+        }}
+        tr.children[2].textContent = g.losses;
+        const rows = Array.from(tbody.querySelectorAll('tr[data-name]'));
+        rows.sort((a, b) => Number(b.children[2].textContent) - Number(a.children[2].textContent)
+                            || a.dataset.name.localeCompare(b.dataset.name));
+        rows.forEach((r, i) => {{ r.children[0].textContent = i + 1; tbody.appendChild(r); }});
+      }});
+    </script>
+    """
+    return body
+
+@app.get("/games")
+def games_home():
+    return serve_read_view("games_home")
+
+# ------------------ 게임 기록 / 리플레이 ------------------
+GAMES_PAGE_SIZE = 50
+
+def _games_filters(args):
+    return {"player": (args.get("player") or "").strip(),
+            "type": args.get("type") if args.get("type") in GAME_TYPES else "",
+            "from": (args.get("from") or "").strip(), "to": (args.get("to") or "").strip(),
+            "before": int(args.get("before") or 0)}
+
+def query_games(f, limit=GAMES_PAGE_SIZE):
+    # 플레이어 필터는 game_participants(name, game_id) 인덱스로, 페이지는 id 키셋(before)으로
+    sql = "SELECT g.id, g.dt, g.game_type, g.rule, g.participants, g.loser, g.extra FROM games g"
+    where, params = [], []
+    if f["player"]:
+        sql += " JOIN game_participants gp ON gp.game_id = g.id AND gp.name = ?"
+        params.append(f["player"])
+    if f["type"]:
+        where.append("g.game_type = ?"); params.append(f["type"])
+    if f["from"]:
+        where.append("g.dt >= ?"); params.append(f["from"])
+    if f["to"]:
+        where.append("g.dt < ?"); params.append(str(date.fromisoformat(f["to"]) + timedelta(days=1)))
+    if f["before"]:
+        where.append("g.id < ?"); params.append(f["before"])
+    if where:
+        sql += " WHERE " + " AND ".join(where)
+    sql += " ORDER BY g.id DESC LIMIT ?;"
+    params.append(limit)
+    return db_execute(sql, tuple(params)).fetchall()
+
+@app.get("/api/games")
+def api_games():
+    try:
+        f = _games_filters(request.args)
+        limit = max(1, min(500, int(request.args.get("limit") or GAMES_PAGE_SIZE)))
+        rows = query_games(f, limit)
+    except ValueError:
+        return {"error": "invalid filter"}, 400
+    games = [{"id": r["id"], "dt": r["dt"], "game_type": r["game_type"], "rule": r["rule"],
+              "participants": json.loads(r["participants"]), "loser": r["loser"],
+              "extra": json.loads(r["extra"] or "{}")} for r in rows]
+    return {"games": games, "next_before": games[-1]["id"] if len(games) == limit else None}
+
+@app.get("/games/history")
+def games_history():
+    try:
+        f = _games_filters(request.args)
+        rows = query_games(f)
+    except ValueError:
+        flash("날짜 형식을 확인하세요.", "warning")
+        return redirect(url_for("games_history"))
+    items = "".join([
+        f"<tr><td>#{r['id']}</td><td>{r['dt']}</td><td>{GAME_TYPES.get(r['game_type'], r['game_type'])}</td>"
+        f"<td class='text-truncate' style='max-width:320px'>{html_escape(', '.join(json.loads(r['participants'])))}</td>"
+        f"<td>{html_escape(r['loser'] or '')}</td>"
+        f"<td class='text-end'><a class='btn btn-sm btn-outline-secondary' href='{ url_for('game_replay', game_id=r['id']) }'>리플레이</a></td></tr>"
+        for r in rows
+    ])
+    type_opts = "<option value=''>전체</option>" + "".join(
+        [f"<option value='{t}'{' selected' if t == f['type'] else ''}>{lab}</option>" for t, lab in GAME_TYPES.items()])
+    member_opts = member_datalist()
+    more = ""
+    if len(rows) == GAMES_PAGE_SIZE:
+        more = f"<a class='btn btn-sm btn-outline-primary' href='{ url_for('games_history', player=f['player'] or None, type=f['type'] or None, **{'from': f['from'] or None, 'to': f['to'] or None}, before=rows[-1]['id']) }'>더 보기</a>"
+    body = f"""
+    <div class="card shadow-sm">
+      <div class="card-body">
+        <h5 class="card-title">게임 기록</h5>
+        <form method="get" class="row g-2 align-items-end mb-3">
+          <div class="col-12 col-md-3"><label class="form-label">플레이어</label>
+            <input class="form-control" name="player" list="memberList" value="{html_escape(f['player'])}"><datalist id="memberList">{member_opts}</datalist></div>
+          <div class="col-6 col-md-2"><label class="form-label">게임</label><select class="form-select" name="type">{type_opts}</select></div>
+          <div class="col-6 col-md-2"><label class="form-label">시작일</label><input class="form-control" type="date" name="from" value="{f['from']}"></div>
+          <div class="col-6 col-md-2"><label class="form-label">종료일</label><input class="form-control" type="date" name="to" value="{f['to']}"></div>
+          <div class="col-6 col-md-3 d-flex gap-2"><button class="btn btn-primary">조회</button>
+            <a class="btn btn-outline-secondary" href="{ url_for('games_home') }">게임 홈</a></div>
+        </form>
+        <div class="table-responsive">
+          <table class="table table-sm align-middle">
+            <thead><tr><th>ID</th><th>일시</th><th>게임</th><th>참가자</th><th>호구</th><th></th></tr></thead>
+            <tbody>{items or "<tr><td colspan='6' class='text-center text-muted'>기록 없음</td></tr>"}</tbody>
+          </table>
         </div>
+        {more}
+      </div>
+    </div>
+    """
+    return render(body)
+
+def replay_game(row):
+    """저장된 데이터로 결과를 재구성. return: (재현된 최종 호구 또는 None, 렌더용 dict)"""
+    players = json.loads(row["participants"])
+    extra = json.loads(row["extra"] or "{}")
+    if row["game_type"] == "dice":
+        if "seed" in extra:
+            rolls, noise = dice_draw(extra["seed"], len(players), extra["max_dice"], extra.get("skips", []))
+            loser_index, detail = judge_dice_game(extra["rule_id"], rolls, noise)
+            rule = DICE_RULES[extra["rule_id"]]
+        else:
+            # 시드 도입 전 기록: 저장된 굴림 + 룰 문구, 당시 판정(앞자리 동점)으로 재계산
+            rolls = extra.get("rolls") or []
+            rule = next((r for r in DICE_RULE_LIST if row["rule"].startswith(r.text)), DICE_RULES["sum_max"])
+            if extra.get("rule_id") or not rolls:
+                return None, {"rolls": rolls, "rule": rule, "detail": ""}  # 동점 추첨 시드 없음 → 재현 불가
+            losers, _ = judge_dice(rule.id, [rolls], tie_break="first")
+            loser_index, detail = int(losers[0]), ""
+        return players[loser_index], {"rolls": rolls, "rule": rule, "detail": detail}
+    if row["game_type"] == "ladder":
+        if "seed" in extra:
+            data = generate_ladder(extra["input_players"], int(extra["seed"]))
+        else:
+            grid = [[] for _ in range(extra["rows"])]
+            for rc in extra["rungs"]:
+                grid[rc["r"]].append(rc["c"])
+            data = {"players": players, **extra, "end_cols": solve_ladder(len(players), grid), "final_loser": row["loser"]}
+        data["verify_url"] = url_for("game_replay", game_id=row["id"])
+        return data["final_loser"], data
+    if row["game_type"] == "oddcard":
+        if "seed" in extra:
+            data = generate_oddcard(players, int(extra["seed"]))
+            return data["final_loser"], data
+        data = {"players": players, "final_loser": row["loser"], **extra}
+        base_loser = next((p for p, c in extra.get("assignment", {}).items() if c == ODDCARD_LONER), None)
+        if base_loser is None:
+            return None, data
+        effect = extra.get("joker_effect")
+        if effect == "win":
+            return base_loser, data
+        if effect == "become_loser":
+            return extra["joker_person"], data
+        # 교환 상대는 기록 당시 무작위 → 유효한 교환 대상이었는지만 확인
+        winners = [p for p in players if p not in (base_loser, extra.get("joker_person"))]
+        return (row["loser"] if row["loser"] in (winners or [base_loser]) else winners[0]), data
+    return None, {}
+
+@app.get("/games/<int:game_id>/replay")
+def game_replay(game_id):
+    row = db_execute("SELECT * FROM games WHERE id=?;", (game_id,)).fetchone()
+    if not row:
+        flash("해당 게임 기록이 없습니다.", "danger"); return redirect(url_for("games_history"))
+    loser, data = replay_game(row)
+    if loser is None:
+        badge = "<span class='badge bg-secondary'>재현 정보 부족</span>"
+    elif loser == row["loser"]:
+        badge = "<span class='badge bg-success'>재현 결과 일치</span>"
+    else:
+        badge = f"<span class='badge bg-danger'>재현 불일치: {html_escape(loser)}</span>"
+    head = (f"<div class='mb-2'><b>#{row['id']}</b> · {row['dt']} · {GAME_TYPES.get(row['game_type'], row['game_type'])}"
+            f" · 기록된 호구: <b>{html_escape(row['loser'] or '')}</b> {badge}</div>")
+
+    if row["game_type"] == "oddcard":
+        return render_template_string(LONER_TEMPLATE, mode="play", data=data, members=[], replay_head=head)
+    if row["game_type"] == "ladder":
+        return render(head + render_template_string(LADDER_PLAY, data=data))
+
+    players = json.loads(row["participants"])
+    rows = "".join([
+        f"<tr class='{'table-danger' if p == row['loser'] else ''}'><td>{html_escape(p)}</td>"
+        f"<td class='num'>{' + '.join(map(str, eyes))} = <b>{sum(eyes)}</b></td></tr>"
+        for p, eyes in zip(players, data["rolls"])
+    ])
+    body = f"""
+    <div class="card shadow-sm">
+      <div class="card-body">
+        <h5 class="card-title">주사위 리플레이</h5>
+        {head}
+        <div class="mb-2 text-muted">룰: {html_escape(row['rule'])}</div>
+        <table class="table table-sm align-middle">
+          <thead><tr><th>이름</th><th class='text-end'>주사위 합</th></tr></thead>
+          <tbody>{rows}</tbody>
+        </table>
+        <a class="btn btn-outline-secondary" href="{ url_for('games_history') }">게임 기록</a>
       </div>
     </div>
     """
     return render(body)
 
 # ------------------ 주사위 게임 ------------------
-# 룰은 모두 "한 번씩 굴린 결과(사람별 1~3개 주사위 합/첫 눈)"만으로 판정 가능하게 구성
-DICE_RULES = [
+# 룰은 모두 "한 번씩 굴린 결과(사람별 1~3개 주사위 합/첫 눈)"만으로 판정 가능하게 구성.
+# 각 룰은 고정 id 로 등록되고, 굴림 배열 (G판, n명, d개) → 점수 (G, n) 함수로 표현한다.
+# 점수가 가장 큰 자리가 호구이며, 동점 처리는 룰마다 tie_break 로 명시한다.
+#   "first"  : 앞자리가 호구 (기존 list.index 판정)
+#   "random" : 동점자 중 균등 추첨 (점수가 정수이므로 [0,1) 난수를 더해 argmax)
+DiceRule = namedtuple("DiceRule", "id text score detail tie_break")
+
+DICE_RULE_LIST = [
     # 1) 합 최대가 호구
-    "합이 가장 큰 사람이 호구",
-    # 2) 합 최소가 호구, 단 첫 눈이 1이면 면책(그 다음 최소가 호구)
-    "최솟값이 호구 (1면책 규칙: 첫 눈이 1이면 면책하고 다음 최솟값이 호구)",
+    DiceRule("sum_max", "합이 가장 큰 사람이 호구",
+             lambda f, n: f["sum"],
+             lambda f, n: f"(합:{f['sum']})", "random"),
+    # 2) 첫 눈 최소가 호구, 단 첫 눈이 1이면 면책(그 다음 최소가 호구)
+    DiceRule("first_min_one_immune", "최솟값이 호구 (1면책 규칙: 첫 눈이 1이면 면책하고 다음 최솟값이 호구)",
+             lambda f, n: -f["np"].where(f["first"] == 1, 999, f["first"]),
+             lambda f, n: f"(첫 눈:{f['first']}, 1면책)" if 1 in f["first"] else f"(첫 눈:{f['first']})", "random"),
     # 3) 합이 10과 가장 먼 사람이 호구
-    "합이 10과 가장 먼 사람이 호구",
+    DiceRule("sum_far_from_10", "합이 10과 가장 먼 사람이 호구",
+             lambda f, n: abs(f["sum"] - 10),
+             lambda f, n: f"(합:{f['sum']}, 점수:{[abs(s-10) for s in f['sum']]})", "random"),
     # 4) 인원이 3명이면 첫 눈의 '4에 가장 가까운 사람'이 호구, 아니면 합 최대
-    "3명이면 첫 눈 4에 가장 가까운 사람이 호구 (아니면 합 최대)",
+    DiceRule("three_first_near_4", "3명이면 첫 눈 4에 가장 가까운 사람이 호구 (아니면 합 최대)",
+             lambda f, n: -abs(f["first"] - 4) if n == 3 else f["sum"],
+             lambda f, n: f"(첫 눈:{f['first']})" if n == 3 else f"(합:{f['sum']})", "random"),
     # 5) 한 사람의 '가장 큰 눈' 기준 최대가 호구
-    "가장 큰 눈 하나 기준 최대가 호구",
+    DiceRule("max_die_max", "가장 큰 눈 하나 기준 최대가 호구",
+             lambda f, n: f["max"],
+             lambda f, n: f"(개별최대:{f['max']})", "random"),
 ]
+DICE_RULES = {r.id: r for r in DICE_RULE_LIST}
+DICE_RULE_BY_TEXT = {r.text: r for r in DICE_RULE_LIST}  # 과거 기록(룰 문구) 조회용
+
+def _dice_features(rolls):
+    import numpy as np
+    return {"np": np, "sum": rolls.sum(axis=2, dtype=np.int16),
+            "first": rolls[:, :, 0].astype(np.int16), "max": rolls.max(axis=2).astype(np.int16)}
+
+def dice_scores(rule, rolls):
+    """rolls: (G, n, d) 정수 배열 → (G, n) 점수"""
+    return rule.score(_dice_features(rolls), rolls.shape[1])
+
+def judge_dice(rule_id, rolls, rng=None, tie_break=None, noise=None):
+    """배치 판정: (G, n, d) 굴림 → (호구 자리 (G,), 점수 (G, n)).
+    tie_break="random" 이면 동점 추첨용 [0,1) 난수 (G, n) 를 noise 로 받거나 numpy Generator(rng) 로 생성."""
+    import numpy as np
+    rule = DICE_RULES[rule_id]
+    rolls = np.asarray(rolls, dtype=np.int8)
+    scores = dice_scores(rule, rolls)
+    if (tie_break or rule.tie_break) == "random":
+        if noise is None:
+            noise = (rng if rng is not None else np.random.default_rng()).random(scores.shape)
+        return (scores + np.asarray(noise)).argmax(axis=1), scores
+    return scores.argmax(axis=1), scores
+
+def judge_dice_game(rule_id, rolls_per_player, noise):
+    """한 판 판정(라이브/리플레이 공용). return: (loser_index, extra_text)"""
+    import numpy as np
+    rule = DICE_RULES[rule_id]
+    losers, _ = judge_dice(rule_id, [rolls_per_player], noise=[noise])
+    feats = {k: v[0].tolist() for k, v in _dice_features(np.asarray([rolls_per_player], dtype=np.int8)).items() if k != "np"}
+    return int(losers[0]), rule.detail(feats, len(rolls_per_player))
+
+# ------------------ 주사위 커밋-리빌 ------------------
+# 굴림은 모두 서버가 시드로 결정한다. 시드 = HMAC(SECRET_KEY, nonce) 라서 페이지에 nonce 를 넣어도
+# 클라이언트는 시드를 알 수 없다. 시작 전에 sha256(시드)를 공개하고
+# 끝난 뒤 시드를 공개하면, 누구나 dice_draw(시드, ...) 로 굴림을 재현하고 커밋과 대조할 수 있다.
+# 진행 상태(순번·건너뛴 자리·종료)는 nonce 를 키로 dice_games 행에 둔다(v13).
+DICE_GAME_TTL_HOURS = 24  # 끝나지 않고 버려진 게임 상태 보관 시간
+
+def dice_seed_for(nonce):
+    return hmac.new(app.secret_key.encode(), nonce.encode(), hashlib.sha256).hexdigest()
+
+def dice_commit_for(seed):
+    return hashlib.sha256(seed.encode()).hexdigest()
+
+def dice_draw(seed, n_players, n_dice, skips=()):
+    """시드 → (굴림 [[..], ..], 동점 추첨 난수 [..]). 건너뛴 자리는 0 으로."""
+    rng = random.Random(seed)
+    rolls = [[rng.randint(1, 6) for _ in range(n_dice)] for _ in range(n_players)]
+    noise = [rng.random() for _ in range(n_players)]
+    for i in skips:
+        rolls[i] = [0] * n_dice
+    return rolls, noise
+
+def load_dice_game(nonce):
+    row = db_execute("SELECT * FROM dice_games WHERE nonce=?;", (nonce,)).fetchone() if nonce else None
+    if row is None:
+        return None
+    game = dict(row)
+    game["players"], game["skips"] = json.loads(game["players"]), json.loads(game["skips"])
+    game["commit"] = dice_commit_for(dice_seed_for(nonce))
+    return game
+
+def purge_dice_games():
+    db_execute("DELETE FROM dice_games WHERE created_at < ?;", (_now_str(-timedelta(hours=DICE_GAME_TTL_HOURS)),))
+    get_db().commit()
 
-def _compute_loser_by_rule(rule_text: str, rolls_per_player, players):
-    """
-    rolls_per_player: [[d1,d2,...], [d1,d2,...], ...]
-    players: [name, ...]
-    return: (loser_index, extra_text)
-    """
-    n = len(players)
-    sums = [sum(rs) for rs in rolls_per_player]
-    firsts = [rs[0] if rs else 0 for rs in rolls_per_player]
-    max_die = [max(rs) if rs else 0 for rs in rolls_per_player]
-
-    loser_index = None
-    extra = ""
-
-    if "합이 가장 큰" in rule_text and "가장 먼" not in rule_text:
-        # 1) 합 최대
-        m = max(sums)
-        loser_index = sums.index(m)
-        extra = f"(합:{sums})"
-
-    elif "최솟값이 호구" in rule_text:
-        # 2) 최솟값 + 1면책
-        if 1 in firsts:
-            tmp = [(999 if x == 1 else x) for x in firsts]
-            loser_index = tmp.index(min(tmp))
-            extra = f"(첫 눈:{firsts}, 1면책)"
-        else:
-            loser_index = firsts.index(min(firsts))
-            extra = f"(첫 눈:{firsts})"
-
-    elif "합이 10과 가장 먼" in rule_text:
-        # 3) |합-10| 최대
-        scores = [abs(s-10) for s in sums]
-        loser_index = scores.index(max(scores))
-        extra = f"(합:{sums}, 점수:{scores})"
-
-    elif "3명이면 첫 눈 4에 가장 가까운" in rule_text:
-        # 4) 3명 -> 첫 눈이 4에 가장 가까운 사람 / 아니면 합 최대
-        if n == 3:
-            scores = [abs(x-4) for x in firsts]
-            loser_index = scores.index(min(scores))
-            extra = f"(첫 눈:{firsts})"
-        else:
-            m = max(sums)
-            loser_index = sums.index(m)
-            extra = f"(합:{sums})"
-
-    elif "가장 큰 눈 하나 기준" in rule_text:
-        # 5) 각 사람의 단일 최대 눈 비교
-        m = max(max_die)
-        loser_index = max_die.index(m)
-        extra = f"(개별최대:{max_die})"
-
-    else:
-        # 백업: 합 최대
-        m = max(sums)
-        loser_index = sums.index(m)
-        extra = f"(합:{sums})"
+def audit_dice_games(rows):
+    """저장된 주사위 게임(시드 포함)을 일괄 재현·검증. (룰, 인원, 주사위 수) 묶음마다 벡터 판정 1회."""
+    import numpy as np
+    groups, problems, checked = {}, [], 0
+    for r in rows:
+        extra = json.loads(r["extra"] or "{}")
+        if "seed" not in extra:
+            continue
+        players = json.loads(r["participants"])
+        if dice_commit_for(extra["seed"]) != extra.get("commit"):
+            problems.append((r["id"], "커밋 불일치")); continue
+        rolls, noise = dice_draw(extra["seed"], len(players), extra["max_dice"], extra.get("skips", []))
+        if rolls != extra.get("rolls"):
+            problems.append((r["id"], "굴림 불일치")); continue
+        key = (extra["rule_id"], len(players), extra["max_dice"])
+        groups.setdefault(key, []).append((r, players, rolls, noise))
+    for (rule_id, _n, _d), items in groups.items():
+        losers, _ = judge_dice(rule_id, np.array([it[2] for it in items]), noise=np.array([it[3] for it in items]))
+        for (r, players, _, _), li in zip(items, losers.tolist()):
+            checked += 1
+            if players[li] != r["loser"]:
+                problems.append((r["id"], f"호구 불일치: 기록 {r['loser']} / 재현 {players[li]}"))
+    return checked, problems
+
+# ------------------ 주사위 룰 공정성 시뮬레이터 (NumPy) ------------------
+def simulate_dice_fairness(rule_id, n_players, n_dice, games, seed=None, tie_break=None, batch=500_000):
+    """룰 하나를 games 판 굴려 자리별 호구 확률과 95% 신뢰구간(Wilson)을 계산."""
+    import numpy as np
+    rule = DICE_RULES[rule_id]
+    rng = np.random.default_rng(seed)
+    counts = np.zeros(n_players, dtype=np.int64)
+    tie_decided = 0
+    done = 0
+    while done < games:
+        b = min(batch, games - done)
+        rolls = rng.integers(1, 7, size=(b, n_players, n_dice), dtype=np.int8)
+        losers, scores = judge_dice(rule_id, rolls, rng, tie_break)
+        counts += np.bincount(losers, minlength=n_players)
+        tie_decided += int(((scores == scores.max(axis=1, keepdims=True)).sum(axis=1) > 1).sum())
+        done += b
+    p = counts / games
+    z = 1.96
+    denom = 1 + z * z / games
+    center = (p + z * z / (2 * games)) / denom
+    half = z * np.sqrt(p * (1 - p) / games + z * z / (4 * games * games)) / denom
+    expected = 1 / n_players
+    se = np.sqrt(expected * (1 - expected) / games)
+    return {
+        "rule": rule.text, "tie_break": tie_break or rule.tie_break,
+        "players": n_players, "dice": n_dice, "games": games,
+        "tie_rate": tie_decided / games,
+        "seats": [{"seat": i + 1, "losses": int(counts[i]), "p": float(p[i]),
+                   "lo": float(center[i] - half[i]), "hi": float(center[i] + half[i]),
+                   "z": float((p[i] - expected) / se)} for i in range(n_players)],
+    }
 
-    return loser_index, extra
+TIE_BREAK_LABELS = {"first": "앞자리 호구", "random": "동점자 추첨"}
 
+def _fairness_table_html(res):
+    expected = 1 / res["players"]
+    rows = "".join([
+        f"<tr class='{'table-warning' if abs(s['z']) > 3 else ''}'><td>{s['seat']}번</td>"
+        f"<td class='num'>{s['losses']:,}</td><td class='num'>{s['p']*100:.3f}%</td>"
+        f"<td class='num'>{s['lo']*100:.3f}% ~ {s['hi']*100:.3f}%</td><td class='num'>{s['z']:+.1f}</td></tr>"
+        for s in res["seats"]
+    ])
+    return f"""
+    <div class="mb-1 small text-muted">{html_escape(res['rule'])} · {res['players']}명 · 주사위 {res['dice']}개 ·
+      {res['games']:,}판 · 동점 처리: {TIE_BREAK_LABELS[res['tie_break']]} · 기대값 {expected*100:.3f}% ·
+      동점으로 결정된 판 {res['tie_rate']*100:.2f}%</div>
+    <table class="table table-sm">
+      <thead><tr><th>자리</th><th class='text-end'>호구 횟수</th><th class='text-end'>확률</th>
+        <th class='text-end'>95% 신뢰구간</th><th class='text-end'>z</th></tr></thead>
+      <tbody>{rows}</tbody>
+    </table>"""
+
+@app.route("/admin/dice-fairness", methods=["GET","POST"])
+def dice_fairness():
+    f = request.form
+    rule_id = f.get("rule") if f.get("rule") in DICE_RULES else ""
+    tie_break = f.get("tie_break") if f.get("tie_break") in TIE_BREAK_LABELS else ""
+    n_players = max(2, min(12, int(f.get("players") or 4)))
+    n_dice = max(1, min(3, int(f.get("dice") or 3)))
+    games = max(1000, min(5_000_000, int(f.get("games") or 1_000_000)))  # 웹 요청은 500만 판 상한
+
+    results_html = ""
+    if request.method == "POST":
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            flash("numpy 가 설치되어 있지 않습니다. (pip install numpy)", "danger")
+            return redirect(url_for("dice_fairness"))
+        rule_ids = [rule_id] if rule_id else list(DICE_RULES)
+        t0 = datetime.now()
+        results_html = "".join([_fairness_table_html(simulate_dice_fairness(r, n_players, n_dice, games, tie_break=tie_break or None))
+                                for r in rule_ids])
+        results_html += f"<div class='text-muted small'>소요: {(datetime.now()-t0).total_seconds():.2f}초</div>"
+
+    rule_opts = "<option value=''>전체 룰</option>" + "".join(
+        [f"<option value='{r.id}'{' selected' if r.id == rule_id else ''}>{html_escape(r.text)}</option>" for r in DICE_RULE_LIST])
+    tie_opts = "<option value=''>룰 기본값</option>" + "".join(
+        [f"<option value='{k}'{' selected' if k == tie_break else ''}>{v}</option>" for k, v in TIE_BREAK_LABELS.items()])
+    body = f"""
+    <div class="card shadow-sm">
+      <div class="card-body">
+        <h5 class="card-title">주사위 룰 공정성 시뮬레이터</h5>
+        <p class="text-muted small">자리(순번)별 호구 확률을 몬테카를로로 추정합니다. |z| &gt; 3 인 자리는 노란색으로 표시됩니다.</p>
+        <form method="post" class="row g-2 align-items-end mb-3">
+          <div class="col-12 col-md-4"><label class="form-label">룰</label><select class="form-select" name="rule">{rule_opts}</select></div>
+          <div class="col-12 col-md-2"><label class="form-label">동점 처리</label><select class="form-select" name="tie_break">{tie_opts}</select></div>
+          <div class="col-4 col-md-1"><label class="form-label">인원</label><input class="form-control" type="number" name="players" min="2" max="12" value="{n_players}"></div>
+          <div class="col-4 col-md-1"><label class="form-label">주사위</label><input class="form-control" type="number" name="dice" min="1" max="3" value="{n_dice}"></div>
+          <div class="col-4 col-md-2"><label class="form-label">판 수</label><input class="form-control" type="number" name="games" min="1000" max="5000000" step="1000" value="{games}"></div>
+          <div class="col-12 col-md-2"><button class="btn btn-primary w-100">실행</button></div>
+        </form>
+        {results_html}
+        <a class="btn btn-outline-secondary btn-sm" href="{ url_for('games_home') }">게임 홈</a>
+      </div>
+    </div>
+    """
+    return render(body)
 
 @app.route("/games/dice", methods=["GET","POST"])
 def dice_game():
     members = get_members()
 
-    # 최종 저장 단계 (클라이언트가 전체 굴림을 끝내고 POST로 결과를 보냄)
-    final_payload = request.form.get("final_payload")
-    if final_payload:
-        try:
-            payload = json.loads(final_payload)
-            players = payload["players"]
-            rolls_per_player = payload["rolls"]
-            rule_text = payload["rule"]
-            max_dice = int(payload.get("max_dice", 1))
-        except Exception:
-            flash("결과 데이터가 올바르지 않습니다.", "danger")
+    # 최종 저장 단계: 모든 순번이 끝나면 서버가 시드로 굴림을 재현해 판정하고 시드를 공개
+    if request.form.get("finish"):
+        nonce = request.form.get("nonce") or ""
+        game = load_dice_game(nonce)
+        # 종료 표시도 조건부 UPDATE: 동시에 두 번 제출돼도 한 요청만 판정/저장한다(기록과 같은 트랜잭션으로 커밋)
+        claimed = game and db_execute(
+            "UPDATE dice_games SET finished=TRUE WHERE nonce=? AND turn=? AND NOT finished RETURNING nonce;",
+            (nonce, len(game["players"]))).fetchone()
+        if not claimed:
+            get_db().rollback()
+            done_id = find_recorded_game(f"dice:{nonce}")
+            if done_id:
+                flash("이미 기록된 게임입니다.", "info")
+                return redirect(url_for("game_replay", game_id=done_id))
+            flash("진행 중인 게임이 없거나 아직 끝나지 않았습니다.", "warning")
             return redirect(url_for("dice_game"))
+        players, max_dice = game["players"], game["max_dice"]
+        rule = DICE_RULES[game["rule_id"]]
+        seed = dice_seed_for(game["nonce"])
+        rolls_per_player, noise = dice_draw(seed, len(players), max_dice, game["skips"])
 
-        # 판정
-        loser_index, extra = _compute_loser_by_rule(rule_text, rolls_per_player, players)
+        # 판정 (서버 룰 엔진)
+        loser_index, extra = judge_dice_game(rule.id, rolls_per_player, noise)
         loser = players[loser_index]
-
-        # DB 기록
-        upsert_hogu_loss(loser, 1)
-        db_execute(
-            "INSERT INTO games(dt, game_type, rule, participants, loser, extra) VALUES (?,?,?,?,?,?);",
-            (
-                datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "dice",
-                f"{rule_text} {extra}",
-                json.dumps(players, ensure_ascii=False),
-                loser,
-                json.dumps({"rolls": rolls_per_player, "max_dice": max_dice}, ensure_ascii=False),
-            ),
-        )
-        get_db().commit()
+        rule_text = rule.text
+
+        # DB 기록 (시드로 재현 가능)
+        game_id, created = record_game_result(
+            "dice", f"{rule_text} {extra}", players, loser,
+            {"rolls": rolls_per_player, "max_dice": max_dice, "rule_id": rule.id,
+             "tie_break": rule.tie_break, "seed": seed, "commit": game["commit"], "skips": game["skips"]},
+            idem_key=f"dice:{game['nonce']}")
+        if not created:
+            flash("이미 기록된 게임입니다.", "info")
+            return redirect(url_for("game_replay", game_id=game_id))
 
         # 결과 화면 렌더 (다시하기/게임 홈 버튼 제공)
         rows = ""
         for i, p in enumerate(players):
             eyes = rolls_per_player[i]
-            rows += f"<tr{' class=\"table-danger\"' if i==loser_index else ''}><td>{html_escape(p)}</td><td class='num'>{' + '.join(map(str,eyes))} = <b>{sum(eyes)}</b></td></tr>"
+            row_cls = "table-danger" if i == loser_index else ""
+            rows += f"<tr class='{row_cls}'><td>{html_escape(p)}</td><td class='num'>{' + '.join(map(str,eyes))} = <b>{sum(eyes)}</b></td></tr>"
 
         body = f"""
         <div class="card shadow-sm">
@@ -1507,6 +4077,10 @@ def dice_game():
               </table>
             </div>
             <div class="alert alert-success"><b>호구:</b> {html_escape(loser)}</div>
+            <div class="small text-muted mb-2 text-break">
+              커밋(sha256): <code>{game['commit']}</code><br>
+              시드: <code>{seed}</code> · <a href="{ url_for('dice_verify', seed=seed, n=len(players), dice=max_dice, rule=rule.id, skips=','.join(map(str, game['skips']))) }">검증(JSON)</a>
+            </div>
             <div class="d-flex gap-2">
               <a class="btn btn-outline-secondary" href="{ url_for('games_home') }">게임 홈</a>
               <a class="btn btn-primary" href="{ url_for('dice_game') }">다시 하기</a>
@@ -1518,7 +4092,7 @@ def dice_game():
 
     # 게임 시작 폼 (GET)
     if request.method == "GET":
-        opts = "".join([f"<option value='{m}'>{m}</option>" for m in members])
+        opts = member_options()
         body = f"""
         <div class="card shadow-sm"><div class="card-body">
           <h5 class="card-title">주사위 게임</h5>
@@ -1552,17 +4126,25 @@ def dice_game():
     max_dice = int(request.form.get("max_dice") or 1)
     max_dice = 1 if max_dice < 1 else 3 if max_dice > 3 else max_dice
 
-    # 랜덤 룰 선택
-    rule_text = random.choice(DICE_RULES)
+    # 랜덤 룰 선택 (판정 조건은 서버 dice_games 행에 보관)
+    rule = DICE_RULES[random.choice(list(DICE_RULES))]
+    rule_text = rule.text
+    nonce = secrets.token_hex(16)
+    commit = dice_commit_for(dice_seed_for(nonce))
+    db_execute("INSERT INTO dice_games(nonce, players, rule_id, max_dice, created_at) VALUES (?,?,?,?,?);",
+               (nonce, json.dumps(players, ensure_ascii=False), rule.id, max_dice, _now_str()))
+    get_db().commit()
 
-    # 클라에서 턴별로 굴리고, 끝나면 결과를 서버로 다시 POST(final_payload)하여 저장
-    DATA = json.dumps({"players": players, "rule": rule_text, "max_dice": max_dice}, ensure_ascii=False)
+    # 순번마다 서버(/games/dice/turn)에 굴림을 요청하고, 끝나면 finish 로 POST 하여 판정/저장
+    DATA = json.dumps({"players": players, "rule": rule_text, "max_dice": max_dice, "nonce": nonce,
+                       "turn_url": url_for("dice_turn")}, ensure_ascii=False)
 
     body = f"""
     <div class="card shadow-sm">
       <div class="card-body">
         <h5 class="card-title">🎲 주사위 게임 - 턴 진행</h5>
         <div class="mb-2 text-muted">룰: {html_escape(rule_text)}</div>
+        <div class="mb-2 small text-muted text-break">커밋(sha256): <code>{commit}</code> — 게임이 끝나면 시드가 공개됩니다.</div>
 
         <div class="mb-2"><b>이번 순번:</b> <span id="turnName"></span></div>
 
@@ -1581,7 +4163,8 @@ def dice_game():
         </div>
 
         <form id="saveForm" method="post" class="d-none">
-          <input type="hidden" name="final_payload" id="final_payload">
+          <input type="hidden" name="finish" value="1">
+          <input type="hidden" name="nonce" value="{nonce}">
         </form>
 
         <style>
@@ -1630,24 +4213,37 @@ def dice_game():
           const ANIM_DURATION = 2000;  // 총 굴리는 시간(ms) - 2초
 
           rollBtn.addEventListener('click', doRoll);
-          skipBtn.addEventListener('click', () => {{
-            // 스킵: 전부 0 처리
-            results.push(Array(DATA.max_dice).fill(0));
-            appendResultLine(DATA.players[turn], Array(DATA.max_dice).fill(0));
-            markDoneRow(turn, Array(DATA.max_dice).fill(0));
+          skipBtn.addEventListener('click', async () => {{
+            // 스킵: 서버에 기록(전부 0 처리)
+            rollBtn.disabled = true;
+            skipBtn.disabled = true;
+            const eyes = await serverTurn('skip');
+            results.push(eyes);
+            appendResultLine(DATA.players[turn], eyes);
+            markDoneRow(turn, eyes);
             nextTurn();
           }});
 
+          async function serverTurn(action) {{
+            const resp = await fetch(DATA.turn_url, {{
+              method: 'POST', headers: {{'Content-Type': 'application/x-www-form-urlencoded'}},
+              body: 'action=' + action + '&turn=' + turn + '&nonce=' + DATA.nonce
+            }});
+            if (!resp.ok) {{ alert('게임 상태가 올바르지 않습니다. 다시 시작하세요.'); location.reload(); }}
+            return (await resp.json()).eyes;
+          }}
+
           function updateTurn() {{
             turnName.textContent = DATA.players[turn];
           }}
 
-          function doRoll() {{
+          async function doRoll() {{
             rollBtn.disabled = true;
             skipBtn.disabled = true;
 
             const row = rows[turn];
             const diceEls = Array.from(row.querySelectorAll('.die'));
+            const eyes = await serverTurn('roll');  // 실제 결과는 서버가 결정
 
             // 애니메이션(의미 없는 랜덤 숫자)
             const timer = setInterval(() => {{
@@ -1657,8 +4253,6 @@ def dice_game():
             setTimeout(() => {{
               clearInterval(timer);
 
-              // 실제 결과 생성
-              const eyes = Array.from({{length: DATA.max_dice}}, () => 1 + Math.floor(Math.random()*6));
               diceEls.forEach((el, i) => {{ el.classList.remove('spin'); el.textContent = eyes[i]; }});
               markDoneRow(turn, eyes);
               results.push(eyes);
@@ -1690,14 +4284,7 @@ def dice_game():
           }}
 
           function finishGame() {{
-            // 서버로 저장(최종 렌더는 서버가 해줌)
-            const payload = {{
-              players: DATA.players,
-              rolls: results,
-              rule: DATA.rule,
-              max_dice: DATA.max_dice
-            }};
-            document.getElementById('final_payload').value = JSON.stringify(payload);
+            // 서버에서 판정/저장(최종 렌더는 서버가 해줌)
             document.getElementById('saveForm').submit();
           }}
         </script>
@@ -1706,202 +4293,337 @@ def dice_game():
     """
     return render(body)
 
-@app.route("/games/ladder", methods=["GET","POST"])
-def ladder_game():
-    members = get_members()
+@app.post("/games/dice/turn")
+def dice_turn():
+    # 현재 순번의 굴림(또는 건너뛰기)을 서버가 확정해 돌려준다. 순번은 dice_games 행 기준으로만 진행.
+    game = load_dice_game(request.form.get("nonce"))
+    action = request.form.get("action")
+    if not game or game["finished"] or action not in ("roll", "skip") or game["turn"] >= len(game["players"]) \
+            or str(game["turn"]) != request.form.get("turn"):
+        return {"error": "invalid turn"}, 409
+    i = game["turn"]
+    skips = game["skips"] + [i] if action == "skip" else game["skips"]
+    # 읽은 뒤 다른 요청이 먼저 진행했으면 0행 → 거절
+    if db_execute("UPDATE dice_games SET turn=turn+1, skips=? WHERE nonce=? AND turn=? AND NOT finished RETURNING turn;",
+                  (json.dumps(skips), game["nonce"], i)).fetchone() is None:
+        get_db().rollback()
+        return {"error": "invalid turn"}, 409
+    get_db().commit()
+    if action == "skip":
+        eyes = [0] * game["max_dice"]
+    else:
+        eyes = dice_draw(dice_seed_for(game["nonce"]), len(game["players"]), game["max_dice"])[0][i]
+    return {"turn": i, "eyes": eyes, "done": i + 1 >= len(game["players"])}
 
-    # 템플릿들(Jinja — f-string 아님)
-    LADDER_FORM = """
-    <div class="card shadow-sm"><div class="card-body">
-      <h5 class="card-title">사다리 게임</h5>
-      <form method="post">
-        <div class="mb-2">
-          <label class="form-label">플레이어</label>
-          <select class="form-select" name="players" multiple size="8">
-            {% for m in members %}<option value="{{m}}">{{m}}</option>{% endfor %}
-          </select>
-          <div class="form-text">게스트는 아래에 쉼표로 입력(선택)</div>
-        </div>
-        <div class="mb-2">
-          <label class="form-label">게스트 (쉼표로 구분)</label>
-          <input class="form-control" name="guests" placeholder="예: 홍길동, 김게스트">
-        </div>
-        <div class="d-flex gap-2">
-          <button class="btn btn-primary">게임 시작</button>
-          <a class="btn btn-outline-secondary" href="{{ url_for('games_home') }}">뒤로</a>
-        </div>
-      </form>
-    </div></div>
-    """
+@app.get("/games/dice/verify")
+def dice_verify():
+    # 공개된 시드로 굴림/판정을 재계산 (n: 인원, dice: 주사위 수, rule: 룰 id, skips: 건너뛴 자리 0-based)
+    try:
+        seed = request.args["seed"]
+        n, d = int(request.args["n"]), int(request.args["dice"])
+        rule = DICE_RULES[request.args["rule"]]
+        skips = [int(x) for x in (request.args.get("skips") or "").split(",") if x.strip()]
+    except (KeyError, ValueError):
+        return {"error": "seed, n, dice, rule required"}, 400
+    rolls, noise = dice_draw(seed, n, d, skips)
+    loser_index, extra = judge_dice_game(rule.id, rolls, noise)
+    return {"commit": dice_commit_for(seed), "rolls": rolls, "tie_noise": noise,
+            "rule": rule.text, "loser_index": loser_index, "detail": extra}
+
+# ------------------ 사다리 게임 ------------------
+# 사다리는 시드 하나로 완전히 결정된다: generate_ladder(입력 순서의 플레이어, seed) 를
+# 다시 실행하면(파이썬 random.Random = Mersenne Twister) 누구나 같은 결과를 재현·검증할 수 있다.
+LADDER_RUNG_DENSITY = 0.35  # 0~1
+
+def ladder_rows_for(n):
+    return max(8, min(16, 6 + n*2))
+
+def build_ladder_rows(rng, n, rows, density=LADDER_RUNG_DENSITY):
+    """행마다 가로줄 열 목록. 같은 행에서 인접(연속) 가로줄 금지 → 행 배열로 O(1) 검사."""
+    grid = []
+    for _ in range(rows):
+        row = bytearray(n + 1)  # row[c] = 1 이면 c ↔ c+1 가로줄
+        cols = list(range(n - 1))
+        rng.shuffle(cols)
+        for c in cols:
+            if rng.random() < density and not row[c+1] and not (c and row[c-1]):
+                row[c] = 1
+        grid.append([c for c in range(n - 1) if row[c]])
+    return grid
+
+def solve_ladder(n, grid):
+    """열 → (그 열에 도착한) 시작 인덱스. 행 안의 가로줄은 서로 겹치지 않아 순서 무관 → O(n + 가로줄 수)"""
+    pos = list(range(n))
+    for row in grid:
+        for c in row:
+            pos[c], pos[c+1] = pos[c+1], pos[c]
+    return pos
+
+def generate_ladder(players, seed):
+    rng = random.Random(seed)
+    players = list(players)
+    rng.shuffle(players)  # 상단 이름 순서
+    N = len(players)
+    rows = ladder_rows_for(N)
+    grid = build_ladder_rows(rng, N, rows)
+    end_cols = solve_ladder(N, grid)
 
-    LADDER_PLAY = """
-    <div class="card shadow-sm">
-      <div class="card-body">
-        <div class="d-flex justify-content-between align-items-center mb-2">
-          <h5 class="card-title mb-0">사다리 게임</h5>
-          <div class="d-flex gap-2">
-            <a class="btn btn-outline-secondary btn-sm" href="{{ url_for('games_home') }}">뒤로</a>
-          </div>
-        </div>
+    # 하단 결과 슬롯 구성 (호구1/조커1/나머지 승리)
+    outcomes = ["승리"] * N
+    loser_col = rng.randrange(N)
+    joker_col = (loser_col + rng.randrange(1, N)) % N
+    outcomes[loser_col] = "호구"
+    outcomes[joker_col] = "조커"
+
+    who = {c: players[i] for i, c in enumerate(end_cols)}  # 결과 슬롯 → 사람
+    base_loser = who[loser_col]
+    joker_person = who[joker_col]
+
+    # 조커 효과
+    joker_effect = rng.choice(["win","become_loser","swap_random"])
+    final_loser = base_loser
+    if joker_effect == "become_loser":
+        final_loser = joker_person
+    elif joker_effect == "swap_random":
+        winners = [who[c] for c, lab in enumerate(outcomes) if lab == "승리"]
+        if winners:
+            final_loser = rng.choice(winners)
 
-        <div class="text-muted mb-2">위의 이름 순서는 랜덤입니다. <b>시작</b>을 누르면 전원이 동시에 내려갑니다.</div>
-        <div class="mb-2"><button id="startBtn" class="btn btn-success btn-sm">시작</button></div>
+    return {
+        "seed": str(seed),  # JS 정수 정밀도(2^53) 밖이라 문자열로 전달
+        "players": players,
+        "rows": rows,
+        "rungs": [{"r": r, "c": c} for r, row in enumerate(grid) for c in row],
+        "end_cols": end_cols,
+        "outcomes": outcomes,
+        "base_loser": base_loser,
+        "joker_person": joker_person,
+        "joker_effect": joker_effect,
+        "final_loser": final_loser,
+    }
 
-        <canvas id="ladder" width="900" height="520" class="w-100 border rounded"></canvas>
+@app.get("/games/ladder/verify")
+def ladder_verify():
+    # 시드 + 입력 플레이어(쉼표 구분, 셔플 전 순서)로 결과를 다시 계산해 JSON 으로 반환
+    try:
+        seed = int(request.args.get("seed", ""))
+    except ValueError:
+        return {"error": "seed must be an integer"}, 400
+    players = [p.strip() for p in (request.args.get("players") or "").split(",") if p.strip()]
+    if len(players) < 3:
+        return {"error": "players must list 3 or more names"}, 400
+    return generate_ladder(players, seed)
+
+def simulate_ladder_uniformity(n, ladders, seed=None):
+    """시작 열 → 결과 슬롯 분포를 집계해 균등성(카이제곱) 확인. 사람 단위 호구 분포도 함께."""
+    rng = random.Random(seed)
+    rows = ladder_rows_for(n)
+    counts = [[0] * n for _ in range(n)]
+    for _ in range(ladders):
+        for col, start in enumerate(solve_ladder(n, build_ladder_rows(rng, n, rows))):
+            counts[start][col] += 1
+    expected = ladders / n
+    chi2 = sum((c - expected) ** 2 / expected for row in counts for c in row)
+    dof = (n - 1) * (n - 1)
+    # 사람 단위: 상단 셔플 + 호구 슬롯 추첨까지 포함한 최종(조커 전) 호구 분포
+    base = [0] * n
+    for _ in range(ladders):
+        d = generate_ladder(list(range(n)), rng.getrandbits(64))
+        base[d["base_loser"]] += 1
+    chi2_people = sum((c - expected) ** 2 / expected for c in base)
+    return {"players": n, "rows": rows, "ladders": ladders, "matrix": counts,
+            "chi2": chi2, "dof": dof, "chi2_people": chi2_people, "dof_people": n - 1, "base_losers": base}
+
+# 템플릿들(Jinja — f-string 아님)
+LADDER_FORM = """
+<div class="card shadow-sm"><div class="card-body">
+  <h5 class="card-title">사다리 게임</h5>
+  <form method="post">
+    <div class="mb-2">
+      <label class="form-label">플레이어</label>
+      <select class="form-select" name="players" multiple size="8">
+        {% for m in members %}<option value="{{m}}">{{m}}</option>{% endfor %}
+      </select>
+      <div class="form-text">게스트는 아래에 쉼표로 입력(선택)</div>
+    </div>
+    <input type="hidden" name="token" value="{{ token }}">
+    <div class="mb-2">
+      <label class="form-label">게스트 (쉼표로 구분)</label>
+      <input class="form-control" name="guests" placeholder="예: 홍길동, 김게스트">
+    </div>
+    <div class="d-flex gap-2">
+      <button class="btn btn-primary">게임 시작</button>
+      <a class="btn btn-outline-secondary" href="{{ url_for('games_home') }}">뒤로</a>
+    </div>
+  </form>
+</div></div>
+"""
 
-        <div class="alert alert-warning mt-3 d-none" id="jokerBox"></div>
-        <div class="alert alert-info mt-2 d-none" id="resultBox"></div>
+LADDER_PLAY = """
+<div class="card shadow-sm">
+  <div class="card-body">
+    <div class="d-flex justify-content-between align-items-center mb-2">
+      <h5 class="card-title mb-0">사다리 게임</h5>
+      <div class="d-flex gap-2">
+        <a class="btn btn-outline-secondary btn-sm" href="{{ url_for('games_home') }}">뒤로</a>
       </div>
     </div>
 
-    <script>
-      const DATA = {{ data|tojson }};
+    <div class="text-muted mb-2">위의 이름 순서는 랜덤입니다. <b>시작</b>을 누르면 전원이 동시에 내려갑니다.</div>
+    <div class="mb-2"><button id="startBtn" class="btn btn-success btn-sm">시작</button></div>
 
-      const cvs = document.getElementById('ladder');
-      const ctx = cvs.getContext('2d');
-      const startBtn = document.getElementById('startBtn');
-      const W = cvs.width, H = cvs.height;
+    <canvas id="ladder" width="900" height="520" class="w-100 border rounded"></canvas>
 
-      // 레이아웃
-      const N = DATA.players.length;
-      const colGap = Math.min(120, Math.max(70, Math.floor((W - 100) / (N - 1))));
-      const left = Math.floor((W - colGap * (N - 1)) / 2);
-      const top = 60, bottom = H - 80;
-      const rows = DATA.rows;
-      const rowGap = Math.floor((bottom - top) / rows);
+    <div class="alert alert-warning mt-3 d-none" id="jokerBox"></div>
+    <div class="alert alert-info mt-2 d-none" id="resultBox"></div>
+  </div>
+</div>
 
-      const xOfCol = (c) => left + c * colGap;
-      const yOfRow = (r) => top + r * rowGap;
+<script>
+  const DATA = {{ data|tojson }};
 
-      const rungs = DATA.rungs; // [{r,c},...]
+  const cvs = document.getElementById('ladder');
+  const ctx = cvs.getContext('2d');
+  const startBtn = document.getElementById('startBtn');
+  const W = cvs.width, H = cvs.height;
 
-      // 텍스트
-      ctx.font = '14px system-ui, -apple-system, Segoe UI, Roboto, Apple SD Gothic Neo, Noto Sans KR';
-      ctx.textAlign = 'center';
-      ctx.textBaseline = 'middle';
+  // 레이아웃
+  const N = DATA.players.length;
+  const colGap = Math.min(120, Math.max(70, Math.floor((W - 100) / (N - 1))));
+  const left = Math.floor((W - colGap * (N - 1)) / 2);
+  const top = 60, bottom = H - 80;
+  const rows = DATA.rows;
+  const rowGap = Math.floor((bottom - top) / rows);
 
-      function drawBase() {
-        ctx.clearRect(0, 0, W, H);
+  const xOfCol = (c) => left + c * colGap;
+  const yOfRow = (r) => top + r * rowGap;
 
-        // 상단 이름
-        for (let i = 0; i < N; i++) {
-          ctx.fillStyle = '#222';
-          ctx.fillText(DATA.players[i], xOfCol(i), top - 25);
-        }
+  const rungs = DATA.rungs; // [{r,c},...]
 
-        // 세로줄
-        ctx.strokeStyle = '#2a6f97';
-        ctx.lineWidth = 2;
-        for (let i = 0; i < N; i++) {
-          ctx.beginPath(); ctx.moveTo(xOfCol(i), top); ctx.lineTo(xOfCol(i), bottom); ctx.stroke();
-        }
+  // 텍스트
+  ctx.font = '14px system-ui, -apple-system, Segoe UI, Roboto, Apple SD Gothic Neo, Noto Sans KR';
+  ctx.textAlign = 'center';
+  ctx.textBaseline = 'middle';
 
-        // 가로줄
-        ctx.strokeStyle = '#94d2bd';
-        ctx.lineWidth = 3;
-        rungs.forEach(rc => {
-          const y = yOfRow(rc.r);
-          ctx.beginPath(); ctx.moveTo(xOfCol(rc.c), y); ctx.lineTo(xOfCol(rc.c+1), y); ctx.stroke();
-        });
+  function drawBase() {
+    ctx.clearRect(0, 0, W, H);
 
-        // 하단 대기표시
-        ctx.fillStyle = '#666';
-        for (let i = 0; i < N; i++) ctx.fillText('대기', xOfCol(i), bottom + 25);
-      }
+    // 상단 이름
+    for (let i = 0; i < N; i++) {
+      ctx.fillStyle = '#222';
+      ctx.fillText(DATA.players[i], xOfCol(i), top - 25);
+    }
 
-      function computeEndColumns() {
-        // 시작열 i → 도착열 pos[i]
-        const pos = Array.from({length: N}, (_, i) => i);
-        for (let r = 0; r < rows; r++) {
-          rungs.forEach(rc => {
-            if (rc.r === r) {
-              const t = pos[rc.c];
-              pos[rc.c] = pos[rc.c+1];
-              pos[rc.c+1] = t;
-            }
-          });
-        }
-        return pos;
-      }
+    // 세로줄
+    ctx.strokeStyle = '#2a6f97';
+    ctx.lineWidth = 2;
+    for (let i = 0; i < N; i++) {
+      ctx.beginPath(); ctx.moveTo(xOfCol(i), top); ctx.lineTo(xOfCol(i), bottom); ctx.stroke();
+    }
 
-      drawBase();
-      const endCols = computeEndColumns();
-
-      // 애니메이션
-      let t0 = 0, req = null;
-      const DUR = 900; // ms
-
-      function drawFrame(p) {
-        drawBase();
-        // 내려가는 점
-        for (let i = 0; i < N; i++) {
-          const y = top + (bottom - top) * p;
-          let x = xOfCol(i);
-
-          const rFloat = (y - top) / rowGap;
-          const rNear = [Math.floor(rFloat)-1, Math.floor(rFloat), Math.ceil(rFloat), Math.ceil(rFloat)+1];
-
-          let moved = false;
-          rNear.forEach(rr => {
-            rungs.forEach(rc => {
-              if (rc.r === rr) {
-                const yy = yOfRow(rr);
-                if (Math.abs(yy - y) < 3.5) {
-                  if (i === rc.c) { x = xOfCol(i+1); moved = true; }
-                  else if (i === rc.c+1) { x = xOfCol(i-1); moved = true; }
-                }
-              }
-            });
-          });
-
-          ctx.fillStyle = moved ? '#e76f51' : '#1d3557';
-          ctx.beginPath(); ctx.arc(x, y, 6, 0, Math.PI*2); ctx.fill();
-        }
-      }
+    // 가로줄
+    ctx.strokeStyle = '#94d2bd';
+    ctx.lineWidth = 3;
+    rungs.forEach(rc => {
+      const y = yOfRow(rc.r);
+      ctx.beginPath(); ctx.moveTo(xOfCol(rc.c), y); ctx.lineTo(xOfCol(rc.c+1), y); ctx.stroke();
+    });
+
+    // 하단 대기표시
+    ctx.fillStyle = '#666';
+    for (let i = 0; i < N; i++) ctx.fillText('대기', xOfCol(i), bottom + 25);
+  }
+
+  drawBase();
+  const endCols = DATA.end_cols;  // 서버가 시드로 계산한 값
+
+  // 애니메이션
+  let t0 = 0, req = null;
+  const DUR = 900; // ms
+
+  function drawFrame(p) {
+    drawBase();
+    // 내려가는 점
+    for (let i = 0; i < N; i++) {
+      const y = top + (bottom - top) * p;
+      let x = xOfCol(i);
+
+      const rFloat = (y - top) / rowGap;
+      const rNear = [Math.floor(rFloat)-1, Math.floor(rFloat), Math.ceil(rFloat), Math.ceil(rFloat)+1];
+
+      let moved = false;
+      rNear.forEach(rr => {
+        rungs.forEach(rc => {
+          if (rc.r === rr) {
+            const yy = yOfRow(rr);
+            if (Math.abs(yy - y) < 3.5) {
+              if (i === rc.c) { x = xOfCol(i+1); moved = true; }
+              else if (i === rc.c+1) { x = xOfCol(i-1); moved = true; }
+            }
+          }
+        });
+      });
 
-      function step(ts){
-        if (!t0) t0 = ts;
-        const p = Math.min(1, (ts - t0)/DUR);
-        drawFrame(p);
-        if (p < 1) req = requestAnimationFrame(step);
-        else finish();
-      }
+      ctx.fillStyle = moved ? '#e76f51' : '#1d3557';
+      ctx.beginPath(); ctx.arc(x, y, 6, 0, Math.PI*2); ctx.fill();
+    }
+  }
+
+  function step(ts){
+    if (!t0) t0 = ts;
+    const p = Math.min(1, (ts - t0)/DUR);
+    drawFrame(p);
+    if (p < 1) req = requestAnimationFrame(step);
+    else finish();
+  }
+
+  function finish(){
+    ctx.font = 'bold 14px system-ui, -apple-system, Segoe UI, Roboto, Apple SD Gothic Neo, Noto Sans KR';
+    for (let i = 0; i < N; i++) {
+      ctx.fillStyle = '#111';
+      ctx.fillText(DATA.outcomes[endCols[i]], xOfCol(i), bottom + 25);
+    }
 
-      function finish(){
-        ctx.font = 'bold 14px system-ui, -apple-system, Segoe UI, Roboto, Apple SD Gothic Neo, Noto Sans KR';
-        for (let i = 0; i < N; i++) {
-          ctx.fillStyle = '#111';
-          ctx.fillText(DATA.outcomes[endCols[i]], xOfCol(i), bottom + 25);
-        }
+    const jokerBox = document.getElementById('jokerBox');
+    const resultBox = document.getElementById('resultBox');
 
-        const jokerBox = document.getElementById('jokerBox');
-        const resultBox = document.getElementById('resultBox');
+    let effectLabel = '';
+    if (DATA.joker_effect === 'win') effectLabel = '승리 🎉';
+    else if (DATA.joker_effect === 'become_loser') effectLabel = '호구와 체인지 → 조커가 호구';
+    else effectLabel = '임의 승리자와 호구 교체';
 
-        let effectLabel = '';
-        if (DATA.joker_effect === 'win') effectLabel = '승리 🎉';
-        else if (DATA.joker_effect === 'become_loser') effectLabel = '호구와 체인지 → 조커가 호구';
-        else effectLabel = '임의 승리자와 호구 교체';
+    jokerBox.classList.remove('d-none');
+    jokerBox.innerHTML = '조커: <b>' + DATA.joker_person + '</b> · 효과: <b>' + effectLabel + '</b>';
 
-        jokerBox.classList.remove('d-none');
-        jokerBox.innerHTML = '조커: <b>' + DATA.joker_person + '</b> · 효과: <b>' + effectLabel + '</b>';
+    resultBox.classList.remove('d-none');
+    resultBox.innerHTML = '기본 호구: ' + DATA.base_loser + ' → <b>최종 호구: ' + DATA.final_loser + '</b>'
+      + '<div class="small text-muted mt-1">시드: ' + DATA.seed + ' · <a href="' + DATA.verify_url + '">검증(JSON)</a></div>';
+  }
 
-        resultBox.classList.remove('d-none');
-        resultBox.innerHTML = '기본 호구: ' + DATA.base_loser + ' → <b>최종 호구: ' + DATA.final_loser + '</b>';
-      }
+  startBtn.addEventListener('click', () => {
+    if (req) cancelAnimationFrame(req);
+    t0 = 0; req = requestAnimationFrame(step);
+  });
+</script>
+"""
 
-      startBtn.addEventListener('click', () => {
-        if (req) cancelAnimationFrame(req);
-        t0 = 0; req = requestAnimationFrame(step);
-      });
-    </script>
-    """
+@app.route("/games/ladder", methods=["GET","POST"])
+def ladder_game():
+    members = get_members()
 
     # ---------- GET: 설정 폼 ----------
     if request.method == "GET":
-        body = render_template_string(LADDER_FORM, members=members)
+        body = render_template_string(LADDER_FORM, members=members, token=secrets.token_urlsafe(16))
         return render(body)
 
     # ---------- POST: 게임 데이터 생성 ----------
+    # 같은 폼의 재전송이면 새로 만들지 않고 기록된 게임을 보여줌
+    idem_key = f"ladder:{request.form['token']}" if request.form.get("token") else None
+    done_id = find_recorded_game(idem_key)
+    if done_id:
+        flash("이미 기록된 게임입니다.", "info")
+        return redirect(url_for("game_replay", game_id=done_id))
+
     # 선택 플레이어 + 게스트 파싱
     selected = request.form.getlist("players")
     guests = [g.strip() for g in (request.form.get("guests") or "").split(",") if g.strip()]
@@ -1910,70 +4632,20 @@ def ladder_game():
 
     if len(players) < 3:
         flash("플레이어를 3명 이상 선택/입력하세요.", "warning")
-        body = render_template_string(LADDER_FORM, members=members)
+        body = render_template_string(LADDER_FORM, members=members, token=secrets.token_urlsafe(16))
         return render(body)
 
-    # 랜덤 섞기(상단 이름 순서)
-    random.shuffle(players)
-    N = len(players)
-
-    # 사다리 가로줄 생성
-    rows = max(8, min(16, 6 + N*2))
-    rung_density = 0.35  # 0~1
-    rungs = []
-    for r in range(rows):
-        avail_cols = list(range(N-1))
-        random.shuffle(avail_cols)
-        for c in avail_cols:
-            if random.random() < rung_density:
-                # 인접 충돌 방지: 같은 행에서 연속 가로줄 금지
-                if any((rr['r']==r and abs(rr['c']-c)==1) for rr in rungs):
-                    continue
-                rungs.append({"r": r, "c": c})
-
-    # 하단 결과 슬롯 구성 (호구1/조커1/나머지 승리)
-    outcomes = ["승리"] * N
-    loser_col = random.randrange(N)
-    joker_col = (loser_col + random.randrange(1, N)) % N
-    while joker_col == loser_col:
-        joker_col = random.randrange(N)
-    outcomes[loser_col] = "호구"
-    outcomes[joker_col] = "조커"
-
-    # 도착 열 계산(서버에서도 계산해 기본/최종 호구 산출)
-    end_cols = list(range(N))
-    for r in range(rows):
-        for rc in rungs:
-            if rc["r"] == r:
-                end_cols[rc["c"]], end_cols[rc["c"]+1] = end_cols[rc["c"]+1], end_cols[rc["c"]]
-
-    base_loser = players[end_cols.index(loser_col)]
-    joker_person = players[end_cols.index(joker_col)]
-
-    # 조커 효과
-    joker_effect = random.choice(["win","become_loser","swap_random"])
-    final_loser = base_loser
-    if joker_effect == "win":
-        final_loser = base_loser
-    elif joker_effect == "become_loser":
-        final_loser = joker_person
-    else:
-        winners = [players[end_cols.index(c)]
-                   for c, lab in enumerate(outcomes)
-                   if lab == "승리"]
-        if winners:
-            final_loser = random.choice(winners)
-
-    data = {
-        "players": players,
-        "rows": rows,
-        "rungs": rungs,
-        "outcomes": outcomes,
-        "base_loser": base_loser,
-        "joker_person": joker_person,
-        "joker_effect": joker_effect,
-        "final_loser": final_loser,
-    }
+    seed = secrets.randbits(64)
+    data = generate_ladder(players, seed)
+    data["verify_url"] = url_for("ladder_verify", seed=seed, players=",".join(players))
+    game_id, created = record_game_result(
+        "ladder", f"사다리 (조커: {data['joker_effect']})", data["players"], data["final_loser"],
+        {"seed": seed, "input_players": players,
+         **{k: data[k] for k in ("rows", "rungs", "outcomes", "base_loser", "joker_person", "joker_effect")}},
+        idem_key=idem_key)
+    if not created:
+        flash("이미 기록된 게임입니다.", "info")
+        return redirect(url_for("game_replay", game_id=game_id))
 
     body = render_template_string(LADDER_PLAY, data=data)
     return render(body)
@@ -2039,6 +4711,7 @@ LONER_TEMPLATE = """
             <input class="form-control" name="guests" placeholder="예: 홍길동, 김게스트">
           </div>
 
+          <input type="hidden" name="token" value="{{ token }}">
           <button class="btn btn-primary w-100" type="submit">시작</button>
         </form>
       </div>
@@ -2048,6 +4721,7 @@ LONER_TEMPLATE = """
       <h5 class="m-0">외톨이 카드 – 공개</h5>
       <button id="revealBtn" class="btn btn-primary">모두 공개</button>
     </div>
+    {{ replay_head|default('')|safe }}
 
     <div class="grid" id="grid"></div>
 
@@ -2154,26 +4828,29 @@ def _parse_guest_line(text):
     raw = [t.strip() for t in re.split(r"[,\n]+", text) if t.strip()]
     return raw
 
-def _deal_cards(names):
-    animals = ["사자","호랑이","코끼리","코뿔소","원숭이","늑대","여우","팬더","토끼","수달",
-               "고래","돌고래","하마","치타","사슴","곰","양","염소","표범","기린"]
-    random.shuffle(animals)
-    pairs_needed = (len(names)-1)//2
-    deck = []
-    for i in range(pairs_needed):
-        deck += [animals[i], animals[i]]
-    deck.append("외톨이")
-    random.shuffle(deck)
-
-    assignment = {}
-    for n, card in zip(names, deck):
-        assignment[n] = card
-    return assignment
-
-def _pick_joker_effect():
-    return random.choice(["win","become_loser","swap_random"])
-
-def _apply_joker_rule(players, assignment, base_loser, joker_person, effect):
+ODDCARD_ANIMALS = ("사자","호랑이","코끼리","코뿔소","원숭이","늑대","여우","팬더","토끼","수달",
+                   "고래","돌고래","하마","치타","사슴","곰","양","염소","표범","기린")
+ODDCARD_LONER = "외톨이"
+ODDCARD_JOKER_EFFECTS = ("win", "become_loser", "swap_random")
+
+def oddcard_symbol(k, offset=0):
+    # k번째 짝의 그림: 동물 20종을 돌려 쓰고, 한 바퀴 넘으면 번호를 붙임 (사자, …, 사자2, …)
+    a = ODDCARD_ANIMALS[(offset + k) % len(ODDCARD_ANIMALS)]
+    lap = k // len(ODDCARD_ANIMALS)
+    return a if lap == 0 else f"{a}{lap + 1}"
+
+@lru_cache(maxsize=128)
+def _oddcard_base_deck(n):
+    # 짝 번호 0,0,1,1,… + 외톨이(-1). 인원별로 한 번만 만들고 복사해서 섞는다
+    return tuple([k >> 1 for k in range(n - 1)] + [-1])
+
+def deal_oddcard(n, rng):
+    """자리 i 의 카드(짝 번호, 외톨이는 -1). n 은 홀수. Fisher–Yates 한 번(O(n))."""
+    deck = list(_oddcard_base_deck(n))
+    rng.shuffle(deck)
+    return deck
+
+def _apply_joker_rule(players, assignment, base_loser, joker_person, effect, rng=random):
     final_loser = base_loser
     if effect == "win":
         return final_loser
@@ -2182,17 +4859,52 @@ def _apply_joker_rule(players, assignment, base_loser, joker_person, effect):
     else:
         winners = [p for p in players if p != base_loser and p != joker_person]
         if winners:
-            swap_with = random.choice(winners)
+            swap_with = rng.choice(winners)
             return swap_with
         return base_loser
 
+def generate_oddcard(players, seed):
+    # 배분·조커·교환 상대까지 모두 시드 하나로 결정 → 기록된 시드로 그대로 재현 가능
+    rng = random.Random(seed)
+    deck = deal_oddcard(len(players), rng)
+    offset = rng.randrange(len(ODDCARD_ANIMALS))
+    assignment = {p: ODDCARD_LONER if k < 0 else oddcard_symbol(k, offset) for p, k in zip(players, deck)}
+    base_loser = players[deck.index(-1)]
+    joker_person = rng.choice(players)
+    joker_effect = rng.choice(ODDCARD_JOKER_EFFECTS)
+    return {
+        "seed": str(seed),
+        "players": players,
+        "assignment": assignment,
+        "base_loser": base_loser,
+        "joker_person": joker_person,
+        "joker_effect": joker_effect,
+        "final_loser": _apply_joker_rule(players, assignment, base_loser, joker_person, joker_effect, rng),
+    }
+
+def simulate_oddcard_uniformity(n, deals, seed=None):
+    """자리별 외톨이 카드 빈도로 배분 균등성(카이제곱) 확인."""
+    rng = random.Random(seed)
+    counts = [0] * n
+    for _ in range(deals):
+        counts[deal_oddcard(n, rng).index(-1)] += 1
+    expected = deals / n
+    chi2 = sum((c - expected) ** 2 / expected for c in counts)
+    return {"players": n, "deals": deals, "counts": counts, "chi2": chi2, "dof": n - 1}
+
 @app.route("/oddcard", methods=["GET","POST"])
 @app.route("/games/oddcard", methods=["GET","POST"])
 def oddcard_game():
     members = get_members()
 
     if request.method == "GET":
-        return render_template_string(LONER_TEMPLATE, mode="form", members=members)
+        return render_template_string(LONER_TEMPLATE, mode="form", members=members, token=secrets.token_urlsafe(16))
+
+    idem_key = f"oddcard:{request.form['token']}" if request.form.get("token") else None
+    done_id = find_recorded_game(idem_key)
+    if done_id:
+        flash("이미 기록된 게임입니다.", "info")
+        return redirect(url_for("game_replay", game_id=done_id))
 
     selected = request.form.getlist("players")
     guests_line = request.form.get("guests","")
@@ -2203,28 +4915,545 @@ def oddcard_game():
         players = players[:-1]
 
     if len(players) < 3:
-        return render_template_string(LONER_TEMPLATE, mode="form", members=members)
+        return render_template_string(LONER_TEMPLATE, mode="form", members=members, token=secrets.token_urlsafe(16))
 
-    assignment = _deal_cards(players)
-    base_loser = next((p for p,c in assignment.items() if c == "외톨이"), None)
-    joker_person = random.choice(players)
-    joker_effect = _pick_joker_effect()
-    final_loser = _apply_joker_rule(players, assignment, base_loser, joker_person, joker_effect)
-
-    data = {
-        "players": players,
-        "assignment": assignment,
-        "base_loser": base_loser,
-        "joker_person": joker_person,
-        "joker_effect": joker_effect,
-        "final_loser": final_loser,
-    }
+    data = generate_oddcard(players, secrets.randbits(64))
+    game_id, created = record_game_result(
+        "oddcard", f"외톨이 카드 (조커: {data['joker_effect']})", players, data["final_loser"],
+        {k: data[k] for k in ("seed", "assignment", "base_loser", "joker_person", "joker_effect")},
+        idem_key=idem_key)
+    if not created:
+        flash("이미 기록된 게임입니다.", "info")
+        return redirect(url_for("game_replay", game_id=game_id))
 
     return render_template_string(LONER_TEMPLATE, mode="play", data=data, members=members)
 # ===== 외톨이게임 끝 =====
         
+# ------------------ 정합성 점검 ------------------
+# 원장 불변식을 테이블마다 한 번 훑는 집합 SQL 로 확인한다(식사·입금별 루프 없음). 위반은 id 와 함께 보고하고,
+# 고칠 값이 분명한 위반은 CHECK_REPAIR_BATCH 건씩 끊어 커밋하며 고친다.
+#  - meal_totals: 분담 합계 ↔ 식사 머리 값. 총액 모드는 팀원 몫 + 게스트 = 총액, 상세 모드는 균등 메인·사이드 합계.
+#    분담(잔액의 근거)을 기준으로 머리 값을 고친다. 분담이 없거나 분담 행(메인+사이드≠합계)이 어긋난 식사는 보고만.
+#    (총액 모드의 '개별 입력' 분배는 저장되지 않아, 합계를 총액과 다르게 입력한 식사도 여기 걸린다)
+#  - auto_deposits: 팀원이 결제하고 팀원 몫이 있는 식사마다 자동정산 입금이 정확히 1건(결제자, 팀원 몫 합계, 식사 날짜)
+#  - hogu: hogu_stats / hogu_daily ↔ games 집계
+CHECK_REPAIR_BATCH = 1000
+CHECK_SHOW = 50   # 화면에 보여줄 위반 건수(항목별)
+MANUAL_CHECK_BADGE = "<span class='badge bg-secondary'>수동 확인</span>"
+
+Violation = namedtuple("Violation", "key ref problem repairable")
+LedgerCheck = namedtuple("LedgerCheck", "label find repair")
+CheckResult = namedtuple("CheckResult", "key label violations seconds")
+
+CHECK_MEAL_TOTALS_SQL = """
+    SELECT m.id, m.entry_mode, m.main_mode, m.side_mode, m.grand_total, m.guest_total, m.main_total, m.side_total,
+           s.meal_id AS has_parts, s.total, s.main, s.side, s.bad_parts
+    FROM meals m
+    LEFT JOIN (SELECT meal_id, SUM(total_amount) AS total, SUM(main_amount) AS main, SUM(side_amount) AS side,
+                      SUM(CASE WHEN total_amount <> main_amount + side_amount THEN 1 ELSE 0 END) AS bad_parts
+               FROM meal_parts GROUP BY meal_id) s ON s.meal_id = m.id
+    WHERE s.meal_id IS NULL OR s.bad_parts > 0
+       OR (m.entry_mode = 'total' AND s.total + m.guest_total <> m.grand_total)
+       OR (m.entry_mode <> 'total' AND m.main_mode = 'equal' AND s.main <> m.main_total)
+       OR (m.entry_mode <> 'total' AND m.side_mode IN ('equal', 'custom') AND s.side <> m.side_total)
+    ORDER BY m.id;
+"""
+
+def _find_meal_totals():
+    out = []
+    for r in db_execute(CHECK_MEAL_TOTALS_SQL).fetchall():
+        if r["has_parts"] is None:
+            out.append(Violation(r["id"], f"식사 #{r['id']}", "분담 행 없음", False)); continue
+        if r["bad_parts"]:
+            out.append(Violation(r["id"], f"식사 #{r['id']}", f"분담 {r['bad_parts']}행: 메인 + 사이드 ≠ 합계", False)); continue
+        if r["entry_mode"] == "total":
+            problem = f"팀원 몫 {r['total']:,} + 게스트 {r['guest_total']:,} ≠ 총액 {r['grand_total']:,}"
+        else:
+            problems = []
+            if r["main_mode"] == "equal" and r["main"] != r["main_total"]:
+                problems.append(f"메인 합계 {r['main']:,} ≠ {r['main_total']:,}")
+            if r["side_mode"] in ("equal", "custom") and r["side"] != r["side_total"]:
+                problems.append(f"사이드 합계 {r['side']:,} ≠ {r['side_total']:,}")
+            problem = " · ".join(problems)
+        out.append(Violation(r["id"], f"식사 #{r['id']}", problem, True))
+    return out
+
+def _repair_meal_totals(ids):
+    db_execute("""
+        UPDATE meals SET
+          grand_total = CASE WHEN entry_mode = 'total'
+                             THEN (SELECT SUM(total_amount) FROM meal_parts p WHERE p.meal_id = meals.id) + guest_total
+                             ELSE grand_total END,
+          main_total = CASE WHEN entry_mode <> 'total' AND main_mode = 'equal'
+                            THEN (SELECT SUM(main_amount) FROM meal_parts p WHERE p.meal_id = meals.id)
+                            ELSE main_total END,
+          side_total = CASE WHEN entry_mode <> 'total' AND side_mode IN ('equal', 'custom')
+                            THEN (SELECT SUM(side_amount) FROM meal_parts p WHERE p.meal_id = meals.id)
+                            ELSE side_total END
+        WHERE id = ANY(?::int[]);""", (list(ids),))
+    log_audit("update", "meals", None, {"check": "meal_totals", "ids": list(ids)})
+
+AUTO_DEPOSIT_NOTE_SQL = "'[자동정산] 식사 #' || m.id || ' 선결제 상환(게스트 제외)'"   # insert_auto_deposit 의 메모와 같은 형식
+# 짝 없는 자동정산 입금. Postgres 는 NOT EXISTS 를 해시 안티 조인으로 푼다. SQLite 는 CTE 에 대한 상관 서브쿼리를
+# 행마다 다시 훑으므로(O(n²)) 한 번 만들어 두는 IN 목록을 쓴다 — exp.note 는 NOT NULL 인 m.id 로 만들어 NULL 이 없다.
+AUTO_DEPOSIT_ORPHAN_SQL = ("NOT EXISTS (SELECT 1 FROM exp WHERE exp.note = act.note)" if storage.dialect == "postgres"
+                           else "act.note NOT IN (SELECT note FROM exp)")
+
+CHECK_AUTO_DEPOSITS_SQL = f"""
+    WITH exp AS (
+      SELECT m.id AS meal_id, m.dt, m.payer_id, s.amount, {AUTO_DEPOSIT_NOTE_SQL} AS note
+      FROM meals m
+      JOIN (SELECT meal_id, SUM(total_amount) AS amount FROM meal_parts GROUP BY meal_id) s ON s.meal_id = m.id
+      WHERE m.payer_id IS NOT NULL AND s.amount > 0
+    ), act AS (
+      SELECT note, COUNT(*) AS n, MIN(id) AS dep_id, MIN(member_id) AS member_id, SUM(amount) AS amount, MIN(dt) AS dt
+      FROM deposits WHERE note LIKE '[자동정산] 식사 #%'
+      GROUP BY note
+    )
+    SELECT exp.meal_id, exp.dt AS exp_dt, pe.name AS exp_payer, exp.amount AS exp_amount,
+           act.note, act.n, act.dep_id, pa.name AS act_payer, act.amount AS act_amount, act.dt AS act_dt
+    FROM exp
+    LEFT JOIN act ON act.note = exp.note
+    LEFT JOIN members pe ON pe.id = exp.payer_id
+    LEFT JOIN members pa ON pa.id = act.member_id
+    WHERE act.note IS NULL OR act.n > 1
+       OR act.member_id <> exp.payer_id OR act.amount <> exp.amount OR act.dt <> exp.dt
+    UNION ALL
+    SELECT NULL, NULL, NULL, NULL, act.note, act.n, act.dep_id, pa.name, act.amount, act.dt
+    FROM act
+    LEFT JOIN members pa ON pa.id = act.member_id
+    WHERE {AUTO_DEPOSIT_ORPHAN_SQL}
+    ORDER BY 1, 7;
+"""
+
+def _find_auto_deposits():
+    out = []
+    for r in db_execute(CHECK_AUTO_DEPOSITS_SQL).fetchall():
+        # 고칠 때: 어긋난 자동정산 입금(메모 기준)을 지우고, 있어야 할 식사의 입금을 다시 만든다
+        key = (r["note"], r["meal_id"])
+        expected = f"{r['exp_payer']} · {r['exp_amount']:,}원 · {r['exp_dt']}" if r["meal_id"] else ""
+        if r["note"] is None:
+            out.append(Violation(key, f"식사 #{r['meal_id']}", f"자동정산 입금 없음 (기대: {expected})", True))
+        elif r["meal_id"] is None:
+            out.append(Violation(key, f"입금 #{r['dep_id']}", f"해당 식사가 없거나 결제자·팀원 몫이 없는데 자동정산 입금 {r['n']}건", True))
+        elif r["n"] > 1:
+            out.append(Violation(key, f"식사 #{r['meal_id']}", f"자동정산 입금 {r['n']}건 중복 (입금 #{r['dep_id']} 외)", True))
+        else:
+            out.append(Violation(key, f"식사 #{r['meal_id']}",
+                                 f"입금 #{r['dep_id']}: {r['act_payer']} · {r['act_amount']:,}원 · {r['act_dt']} (기대: {expected})", True))
+    return out
+
+def _repair_auto_deposits(keys):
+    notes = [note for note, _ in keys if note is not None]
+    meal_ids = [meal_id for _, meal_id in keys if meal_id is not None]
+    if notes:
+        db_execute("DELETE FROM deposits WHERE note = ANY(?::text[]);", (notes,))
+    if meal_ids:
+        db_execute(f"""
+            INSERT INTO deposits(dt, member_id, amount, note)
+            SELECT m.dt, m.payer_id, s.amount, {AUTO_DEPOSIT_NOTE_SQL}
+            FROM meals m
+            JOIN (SELECT meal_id, SUM(total_amount) AS amount FROM meal_parts
+                  WHERE meal_id = ANY(?::int[]) GROUP BY meal_id) s ON s.meal_id = m.id
+            WHERE m.payer_id IS NOT NULL AND s.amount > 0;""", (meal_ids,))
+    log_audit("update", "deposits", None, {"check": "auto_deposits", "removed_notes": len(notes), "meal_ids": meal_ids})
+
+CHECK_HOGU_SQL = """
+    WITH e AS (
+      SELECT substr(dt, 1, 10) AS day, game_type, loser AS name, COUNT(*) AS losses
+      FROM games WHERE loser IS NOT NULL AND loser <> ''
+      GROUP BY substr(dt, 1, 10), game_type, loser
+    )
+    SELECT 'hogu_stats' AS tbl, COALESCE(x.name, h.name) AS name, '' AS day, '' AS game_type,
+           COALESCE(x.losses, 0) AS expected, COALESCE(h.losses, 0) AS actual
+    FROM (SELECT name, SUM(losses) AS losses FROM e GROUP BY name) x
+    FULL JOIN hogu_stats h ON h.name = x.name
+    WHERE COALESCE(x.losses, 0) <> COALESCE(h.losses, 0)
+    UNION ALL
+    SELECT 'hogu_daily', COALESCE(e.name, h.name), COALESCE(e.day, h.day), COALESCE(e.game_type, h.game_type),
+           COALESCE(e.losses, 0), COALESCE(h.losses, 0)
+    FROM e
+    FULL JOIN hogu_daily h ON h.day = e.day AND h.game_type = e.game_type AND h.name = e.name
+    WHERE COALESCE(e.losses, 0) <> COALESCE(h.losses, 0)
+    ORDER BY 1, 2, 3, 4;
+"""
+
+def _find_hogu():
+    out = []
+    for r in db_execute(CHECK_HOGU_SQL).fetchall():
+        where = f" ({r['day']} {GAME_TYPES.get(r['game_type'], r['game_type'])})" if r["day"] else ""
+        out.append(Violation(r["name"], f"{r['tbl']} · {r['name']}{where}",
+                             f"기록 {r['actual']}회 ≠ 게임 집계 {r['expected']}회", True))
+    return out
+
+def _repair_hogu(names):
+    # 이름 단위로 두 롤업을 games 에서 다시 계산 (rebuild_hogu_stats 의 부분판)
+    names = sorted(set(names))
+    db_execute("DELETE FROM hogu_stats WHERE name = ANY(?::text[]);", (names,))
+    db_execute("""INSERT INTO hogu_stats(name, losses)
+                  SELECT loser, COUNT(*) FROM games WHERE loser = ANY(?::text[]) GROUP BY loser;""", (names,))
+    db_execute("DELETE FROM hogu_daily WHERE name = ANY(?::text[]);", (names,))
+    db_execute("""INSERT INTO hogu_daily(day, game_type, name, losses)
+                  SELECT substr(dt, 1, 10), game_type, loser, COUNT(*) FROM games
+                  WHERE loser = ANY(?::text[]) GROUP BY substr(dt, 1, 10), game_type, loser;""", (names,))
+
+LEDGER_CHECKS = {
+    "meal_totals": LedgerCheck("식사 합계", _find_meal_totals, _repair_meal_totals),
+    "auto_deposits": LedgerCheck("자동정산 입금", _find_auto_deposits, _repair_auto_deposits),
+    "hogu": LedgerCheck("호구 통계", _find_hogu, _repair_hogu),
+}
+
+def run_ledger_checks(keys=None):
+    results = []
+    for key in keys or LEDGER_CHECKS:
+        t0 = time.perf_counter()
+        violations = LEDGER_CHECKS[key].find()
+        get_db().rollback()
+        results.append(CheckResult(key, LEDGER_CHECKS[key].label, violations, time.perf_counter() - t0))
+    return results
+
+def repair_ledger(key, violations):
+    """고칠 수 있는 위반만 CHECK_REPAIR_BATCH 건씩 고치고 배치마다 커밋. return: 고친 건수"""
+    todo = list(dict.fromkeys(v.key for v in violations if v.repairable))
+    for i in range(0, len(todo), CHECK_REPAIR_BATCH):
+        LEDGER_CHECKS[key].repair(todo[i:i + CHECK_REPAIR_BATCH])
+        get_db().commit()
+    return len(todo)
+
+@app.route("/admin/check", methods=["GET", "POST"])
+def ledger_check():
+    if request.method == "POST":
+        key = request.form.get("check")
+        if key not in LEDGER_CHECKS:
+            flash("알 수 없는 점검 항목입니다.", "danger"); return redirect(url_for("ledger_check"))
+        fixed = repair_ledger(key, run_ledger_checks([key])[0].violations)
+        left = len(run_ledger_checks([key])[0].violations)
+        flash(f"{LEDGER_CHECKS[key].label}: {fixed}건 수정, 남은 위반 {left}건", "success" if not left else "warning")
+        return redirect(url_for("ledger_check"))
+
+    cards = ""
+    for res in run_ledger_checks():
+        fixable = sum(1 for v in res.violations if v.repairable)
+        rows = "".join([f"<tr><td class='text-nowrap'>{html_escape(v.ref)}</td><td>{html_escape(v.problem)}</td>"
+                        f"<td>{'' if v.repairable else MANUAL_CHECK_BADGE}</td></tr>"
+                        for v in res.violations[:CHECK_SHOW]])
+        more = (f"<div class='text-muted small'>외 {len(res.violations) - CHECK_SHOW:,}건</div>"
+                if len(res.violations) > CHECK_SHOW else "")
+        repair_btn = (f"<form method='post' class='d-inline'><input type='hidden' name='check' value='{res.key}'>"
+                      f"<button class='btn btn-sm btn-outline-danger'>{fixable:,}건 고치기</button></form>" if fixable else "")
+        badge = ("<span class='badge bg-success'>이상 없음</span>" if not res.violations
+                 else f"<span class='badge bg-danger'>위반 {len(res.violations):,}건</span>")
+        cards += f"""
+        <div class="mb-3">
+          <div class="d-flex align-items-center gap-2 mb-1">
+            <b>{res.label}</b> {badge} <span class="text-muted small">{res.seconds * 1000:,.0f} ms</span> {repair_btn}
+          </div>
+          {f'<table class="table table-sm align-middle"><tbody>{rows}</tbody></table>{more}' if res.violations else ''}
+        </div>"""
+    body = f"""
+    <div class="card shadow-sm">
+      <div class="card-body">
+        <h5 class="card-title">정합성 점검</h5>
+        <div class="form-text mb-3">식사 합계 · 자동정산 입금 · 호구 통계를 원본 기록과 대조합니다. 고치기는 분담/게임 기록을 기준으로 {CHECK_REPAIR_BATCH:,}건씩 커밋합니다.</div>
+        {cards}
+        <a class="btn btn-outline-secondary" href="{ url_for('jobs') }">작업 목록</a>
+      </div>
+    </div>
+    """
+    return render(body)
+
+# ------------------ 관리용 CLI (flask --app main <명령>) ------------------
+@app.cli.command("migrate")
+def migrate_command():
+    """스키마 마이그레이션 적용."""
+    applied = migrate()
+    print(f"적용된 버전: {applied}" if applied else f"이미 최신입니다. (v{SCHEMA_VERSION})")
+
+def rebuild_hogu_stats():
+    # 파생 테이블 hogu_daily / hogu_stats 를 games 에서 통째로 다시 계산 (한 트랜잭션)
+    db_execute("DELETE FROM hogu_daily;")
+    db_execute("""INSERT INTO hogu_daily(day, game_type, name, losses)
+                  SELECT substr(dt, 1, 10), game_type, loser, COUNT(*) FROM games
+                  WHERE loser IS NOT NULL AND loser <> ''
+                  GROUP BY 1, 2, 3;""")
+    db_execute("DELETE FROM hogu_stats;")
+    db_execute("""INSERT INTO hogu_stats(name, losses)
+                  SELECT name, SUM(losses) FROM hogu_daily GROUP BY name;""")
+    get_db().commit()
+
+@app.cli.command("worker")
+@click.option("--once", is_flag=True, help="대기 중인 작업만 처리하고 종료")
+@click.option("--poll", default=5.0, show_default=True, help="알림이 없을 때 다시 확인하는 간격(초)")
+def worker_command(once, poll):
+    """jobs 테이블의 백그라운드 작업 처리 (Procfile 의 worker 프로세스)."""
+    # 작업 등록 시의 NOTIFY jobs 로 바로 깨어나고, 알림을 놓쳐도 poll 초마다 다시 확인
+    listener = storage.listen(["jobs"])
+    print(f"worker 시작 (pid {os.getpid()})")
+    while True:
+        while (job_id := run_next_job()) is not None:
+            print(f"작업 #{job_id} 처리")
+        if once:
+            break
+        purge_job_results()
+        purge_dice_games()
+        listener.wait(poll)
+    listener.close()
+
+@app.cli.command("check")
+@click.option("--repair", is_flag=True, help="고칠 수 있는 위반을 배치로 고친 뒤 다시 점검")
+@click.option("--show", default=20, show_default=True, help="항목별로 출력할 위반 건수")
+def check_command(repair, show):
+    """원장 정합성 점검(식사 합계 · 자동정산 입금 · 호구 통계). 위반이 남으면 종료 코드 1."""
+    results = run_ledger_checks()
+    if repair:
+        for res in results:
+            if any(v.repairable for v in res.violations):
+                print(f"{res.label}: {repair_ledger(res.key, res.violations):,}건 수정")
+        results = run_ledger_checks()
+    for res in results:
+        print(f"[{'OK' if not res.violations else 'FAIL'}] {res.label:<10} 위반 {len(res.violations):,}건 · {res.seconds:.2f}초")
+        for v in res.violations[:show]:
+            print(f"    {v.ref}: {v.problem}{'' if v.repairable else ' (수동 확인)'}")
+    if any(res.violations for res in results):
+        raise SystemExit(1)
+
+@app.cli.command("export-parquet")
+@click.argument("out_dir")
+@click.option("--full", is_flag=True, help="지문과 상관없이 모든 파티션을 다시 씀")
+def export_parquet_command(out_dir, full):
+    """분석용 Parquet 내보내기(테이블별 폴더, 큰 테이블은 월별 파티션). 기본은 바뀐 달만 다시 쓰는 증분."""
+    t0 = time.perf_counter()
+    export_parquet(out_dir, full)
+    print(f"완료: {out_dir} ({time.perf_counter() - t0:.1f}초)")
+
+@app.cli.command("rebuild-stats")
+def rebuild_stats_command():
+    """games 로부터 hogu_stats/hogu_daily 재계산 + 원본 테이블 기준 잔액 요약."""
+    rebuild_hogu_stats()
+    n = db_execute("SELECT COUNT(*) AS c, COALESCE(SUM(losses),0) AS s FROM hogu_stats;").fetchone()
+    print(f"hogu_stats: {n['c']}명 / 총 {n['s']}회")
+    balances = get_balances()
+    negatives = sum(1 for b in balances if b["balance"] < 0)
+    print(f"잔액: 팀원 {len(balances)}명 · 입금 {sum(b['deposit'] for b in balances):,}원 · "
+          f"차감 {sum(b['used'] for b in balances):,}원 · 잔액 {sum(b['balance'] for b in balances):,}원 "
+          f"(마이너스 {negatives}명)")
+
+@app.cli.command("seed")
+@click.option("--members", "n_members", default=30, show_default=True, help="생성할 팀원 수")
+@click.option("--meals", "n_meals", default=1000, show_default=True, help="생성할 식사 수")
+@click.option("--days", default=730, show_default=True, help="식사 날짜 분포(오늘 기준 과거 N일)")
+@click.option("--seed", "rng_seed", default=None, type=int, help="난수 시드(재현용)")
+def seed_command(n_members, n_meals, days, rng_seed):
+    """부하 테스트용 합성 데이터를 COPY(SQLite 는 executemany)로 적재."""
+    rng = random.Random(rng_seed)
+    batch = 20000
+    today = date.today()
+
+    # 팀원: 배열 한 번으로 넣고 중복 무시 (WHERE TRUE 는 SQLite 의 INSERT … SELECT … ON CONFLICT 구문 모호성 회피)
+    names = [f"테스트{i:05d}" for i in range(1, n_members + 1)]
+    db_execute("INSERT INTO members(name) SELECT x.name FROM unnest(?::text[]) AS x(name) WHERE TRUE ON CONFLICT (name) DO NOTHING;",
+               (names,))
+    ids = {r["name"]: r["id"] for r in db_execute("SELECT id, name FROM members WHERE name = ANY(?);", (names,)).fetchall()}
+
+    # 식사 id 를 미리 잡아두고 meals / meal_parts / 자동정산 deposits 를 함께 생성
+    storage.lock_table("meals")
+    next_id = db_execute("SELECT COALESCE(MAX(id), 0) + 1 AS n FROM meals;").fetchone()["n"]
+    owed = {n: 0 for n in names}  # 팀원별 (사용액 - 자동정산 입금)
+    made = 0
+    while made < n_meals:
+        meals_rows, parts_rows, dep_rows = [], [], []
+        for _ in range(min(batch, n_meals - made)):
+            meal_id = next_id; next_id += 1
+            dt = str(today - timedelta(days=rng.randrange(days)))
+            diners = rng.sample(names, rng.randint(min(2, len(names)), min(8, len(names))))
+            guest_total = rng.choice([0, 0, 0, 0, 12000])
+            grand_total = sum(rng.randrange(8000, 15001, 500) for _ in diners) + guest_total
+            payer = rng.choice(diners)
+            shares = split_even(grand_total - guest_total, len(diners))
+            meals_rows.append((meal_id, dt, "total", "custom", "none", 0, 0, grand_total, ids[payer], guest_total))
+            for m, amt in zip(diners, shares):
+                parts_rows.append((meal_id, ids[m], amt, 0, amt))
+                owed[m] += amt
+            dep_rows.append((dt, ids[payer], grand_total - guest_total, f"[자동정산] 식사 #{meal_id} 선결제 상환(게스트 제외)"))
+            owed[payer] -= grand_total - guest_total
+        storage.copy_rows("meals", ["id", "dt", "entry_mode", "main_mode", "side_mode", "main_total", "side_total",
+                             "grand_total", "payer_id", "guest_total"], meals_rows)
+        storage.copy_rows("meal_parts", ["meal_id", "member_id", "main_amount", "side_amount", "total_amount"], parts_rows)
+        storage.copy_rows("deposits", ["dt", "member_id", "amount", "note"], dep_rows)
+        made += len(meals_rows)
+        print(f"식사 {made:,}/{n_meals:,}")
+
+    # 팀원별 충전 입금(대략 사용액만큼, 일부는 마이너스로 남김)
+    top_ups = [(str(today - timedelta(days=rng.randrange(days))), ids[n], amt + rng.choice([0, 10000, -5000]), "충전(seed)")
+               for n, amt in owed.items() if amt > 0]
+    storage.copy_rows("deposits", ["dt", "member_id", "amount", "note"], top_ups)
+    storage.sync_serial("meals")
+    get_db().commit()
+    print(f"완료: 팀원 {n_members}명, 식사 {n_meals:,}건, 충전 입금 {len(top_ups)}건")
+
+@app.cli.command("analyze")
+@click.option("--vacuum/--no-vacuum", default=True, show_default=True, help="ANALYZE 전에 VACUUM 수행")
+def analyze_command(vacuum):
+    """VACUUM/ANALYZE 후 테이블 크기 보고."""
+    if storage.dialect == "sqlite":
+        return _analyze_sqlite(vacuum)
+    conn = get_db()
+    conn.autocommit = True  # VACUUM 은 트랜잭션 밖에서만 가능
+    db_execute("VACUUM (ANALYZE);" if vacuum else "ANALYZE;")
+    conn.autocommit = False
+    rows = db_execute("""
+        SELECT c.relname AS name,
+               c.reltuples::BIGINT AS est_rows,
+               pg_size_pretty(pg_relation_size(c.oid)) AS heap,
+               pg_size_pretty(pg_indexes_size(c.oid)) AS indexes,
+               pg_size_pretty(pg_total_relation_size(c.oid)) AS total
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = current_schema() AND c.relkind = 'r'
+        ORDER BY pg_total_relation_size(c.oid) DESC;
+    """).fetchall()
+    print(f"{'table':<20}{'rows(est)':>12}{'heap':>12}{'indexes':>12}{'total':>12}")
+    for r in rows:
+        print(f"{r['name']:<20}{max(r['est_rows'], 0):>12,}{r['heap']:>12}{r['indexes']:>12}{r['total']:>12}")
+
+def _analyze_sqlite(vacuum):
+    conn = get_db()
+    conn.commit()
+    if vacuum:
+        conn.execute("VACUUM;")
+    conn.execute("ANALYZE;")
+    sizes = {r["name"]: r["bytes"] for r in db_execute("SELECT name, SUM(pgsize) AS bytes FROM dbstat GROUP BY name;").fetchall()}
+    tables = db_execute("""SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'
+                           ORDER BY name;""").fetchall()
+    indexes = db_execute("SELECT name, tbl_name FROM sqlite_master WHERE type = 'index';").fetchall()
+    rows = []
+    for t in tables:
+        heap = sizes.get(t["name"], 0)
+        idx = sum(sizes.get(i["name"], 0) for i in indexes if i["tbl_name"] == t["name"])
+        n = db_execute(f"SELECT COUNT(*) AS n FROM {t['name']};").fetchone()["n"]
+        rows.append((t["name"], n, heap, idx))
+    mb = lambda b: f"{b / 1024 / 1024:.1f} MB"
+    print(f"{'table':<20}{'rows':>12}{'heap':>12}{'indexes':>12}{'total':>12}")
+    for name, n, heap, idx in sorted(rows, key=lambda r: r[2] + r[3], reverse=True):
+        print(f"{name:<20}{n:>12,}{mb(heap):>12}{mb(idx):>12}{mb(heap + idx):>12}")
+
+MEALS_PLAN_CASES = {
+    "전체": {},
+    "결제자": {"payer": "?"},
+    "식사자": {"diner": "?"},
+    "최근 7일": {"from": "-7"},
+}
+
+def _plan_nodes(node):
+    yield node
+    for child in node.get("Plans", []):
+        yield from _plan_nodes(child)
+
+@app.cli.command("explain-meals")
+@click.option("--max-rows", default=MEALS_PAGE_SIZE * 10, show_default=True, help="계획 노드 하나가 다뤄도 되는 최대 행 수")
+def explain_meals_command(max_rows):
+    """식사 목록 쿼리의 실행 계획 점검: 필터별로 EXPLAIN ANALYZE 후, 어떤 노드도 max-rows 를 넘지 않는지 확인."""
+    if storage.dialect != "postgres":
+        raise click.ClickException("PostgreSQL 전용 명령입니다. (EXPLAIN ANALYZE 의 노드별 행 수 사용)")
+    total = db_execute("SELECT COUNT(*) AS n FROM meals;").fetchone()["n"]
+    busy = db_execute(MEAL_PARTS_SELECT + " WHERE p.meal_id = (SELECT MAX(id) FROM meals) LIMIT 1;").fetchone()
+    payer = db_execute(MEAL_SELECT + " WHERE m.payer_id IS NOT NULL ORDER BY m.id DESC LIMIT 1;").fetchone()
+    print(f"식사 {total:,}건 · 노드 허용 {max_rows:,}행")
+    failed = False
+    for label, case in MEALS_PLAN_CASES.items():
+        args = dict(case)
+        if args.get("payer"):
+            args["payer"] = payer["payer_name"] if payer else ""
+        if args.get("diner"):
+            args["diner"] = busy["name"] if busy else ""
+        if args.get("from"):
+            args["from"] = str(date.today() + timedelta(days=int(args["from"])))
+        sql, params = meals_list_query(_meals_filters(args))
+        plan = db_execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, params).fetchone()["QUERY PLAN"][0]
+        nodes = list(_plan_nodes(plan["Plan"]))
+        worst = max(nodes, key=lambda n: n["Actual Rows"] * n["Actual Loops"])
+        worst_rows = worst["Actual Rows"] * worst["Actual Loops"]
+        buffers = plan["Plan"].get("Shared Hit Blocks", 0) + plan["Plan"].get("Shared Read Blocks", 0)
+        ok = worst_rows <= max_rows
+        failed |= not ok
+        print(f"  [{'OK' if ok else 'FAIL'}] {label:<8} {plan['Execution Time']:8.2f} ms · 버퍼 {buffers:,} · "
+              f"최대 노드 {worst['Node Type']} {worst_rows:,}행")
+    if failed:
+        raise SystemExit(1)
+
+@app.cli.command("dice-fairness")
+@click.option("--games", default=1_000_000, show_default=True, help="룰·인원 조합마다 시뮬레이션할 판 수")
+@click.option("--players", default="2-8", show_default=True, help="인원 수 또는 범위 (예: 3, 2-8)")
+@click.option("--dice", default=3, show_default=True, help="1인당 주사위 개수(1~3)")
+@click.option("--rule", "rule_id", default=None, type=click.Choice(list(DICE_RULES)), help="룰 id (생략 시 전체)")
+@click.option("--tie-break", default=None, type=click.Choice(list(TIE_BREAK_LABELS)), help="동점 처리 (생략 시 룰 기본값)")
+@click.option("--seed", default=None, type=int)
+def dice_fairness_command(games, players, dice, rule_id, tie_break, seed):
+    """DICE_RULES 의 자리별 호구 확률 시뮬레이션 (NumPy 벡터화)."""
+    lo, _, hi = players.partition("-")
+    for rid in ([rule_id] if rule_id else list(DICE_RULES)):
+        for n in range(int(lo), int(hi or lo) + 1):
+            t0 = datetime.now()
+            res = simulate_dice_fairness(rid, n, dice, games, seed, tie_break)
+            secs = (datetime.now() - t0).total_seconds()
+            worst = max(res["seats"], key=lambda s: abs(s["z"]))
+            print(f"[{n}명] {rid} · {TIE_BREAK_LABELS[res['tie_break']]} ({games:,}판, {secs:.2f}초, 동점결정 {res['tie_rate']*100:.1f}%)")
+            for s in res["seats"]:
+                flag = " <- 편향" if abs(s["z"]) > 3 else ""
+                print(f"   {s['seat']:>2}번 {s['p']*100:7.3f}%  [{s['lo']*100:7.3f}, {s['hi']*100:7.3f}]  z={s['z']:+7.1f}{flag}")
+            print(f"   최대 편차: {worst['seat']}번 z={worst['z']:+.1f}")
+
+@app.cli.command("ladder-uniformity")
+@click.option("--players", default=5, show_default=True)
+@click.option("--ladders", default=20_000, show_default=True)
+@click.option("--seed", default=None, type=int)
+def ladder_uniformity_command(players, ladders, seed):
+    """사다리 순열(시작 열 → 도착 열)의 균등성 시뮬레이션."""
+    t0 = datetime.now()
+    res = simulate_ladder_uniformity(players, ladders, seed)
+    secs = (datetime.now() - t0).total_seconds()
+    print(f"{players}명 · {res['rows']}행 · 사다리 {ladders:,}개 ({secs:.2f}초)")
+    print(f"시작열 → 도착열 비율(%)  (균등 = {100 / players:.2f}%)")
+    for i, row in enumerate(res["matrix"][:20]):
+        print(f"  {i:>3}: " + " ".join(f"{c*100/ladders:5.1f}" for c in row[:20]))
+    # 카이제곱 근사 임계값: dof + 3*sqrt(2*dof) (대략 p≈0.001)
+    for label, chi2, dof in (("순열(열→열)", res["chi2"], res["dof"]), ("호구(사람)", res["chi2_people"], res["dof_people"])):
+        crit = dof + 3 * (2 * dof) ** 0.5
+        print(f"{label}: chi2={chi2:,.1f} dof={dof} → {'균등으로 볼 수 있음' if chi2 < crit else '균등하지 않음'} (기준 {crit:,.1f})")
+
+@app.cli.command("oddcard-uniformity")
+@click.option("--players", default=5, show_default=True, help="홀수")
+@click.option("--deals", default=1_000_000, show_default=True)
+@click.option("--seed", default=None, type=int)
+def oddcard_uniformity_command(players, deals, seed):
+    """외톨이 카드가 각 자리에 균등하게 가는지 시뮬레이션."""
+    if players < 3 or players % 2 == 0:
+        raise click.BadParameter("3 이상의 홀수여야 합니다.", param_hint="--players")
+    t0 = datetime.now()
+    res = simulate_oddcard_uniformity(players, deals, seed)
+    secs = (datetime.now() - t0).total_seconds()
+    print(f"{players}명 · {deals:,}회 배분 ({secs:.2f}초, {deals / secs:,.0f}회/초)")
+    print(f"자리별 외톨이 비율(%)  (균등 = {100 / players:.3f}%)")
+    for i, c in enumerate(res["counts"][:50]):
+        print(f"  {i:>3}: {c*100/deals:7.3f}")
+    crit = res["dof"] + 3 * (2 * res["dof"]) ** 0.5
+    print(f"chi2={res['chi2']:,.1f} dof={res['dof']} → {'균등으로 볼 수 있음' if res['chi2'] < crit else '균등하지 않음'} (기준 {crit:,.1f})")
+
+@app.cli.command("audit-dice")
+@click.option("--limit", default=None, type=int, help="최근 N건만 (생략 시 전체)")
+def audit_dice_command(limit):
+    """저장된 주사위 게임을 시드로 일괄 재현해 커밋/굴림/호구를 검증."""
+    sql = "SELECT id, participants, loser, extra FROM games WHERE game_type='dice' ORDER BY id DESC"
+    rows = db_execute(sql + (f" LIMIT {int(limit)};" if limit else ";")).fetchall()
+    t0 = datetime.now()
+    checked, problems = audit_dice_games(rows)
+    print(f"검증 {checked:,}건 / 조회 {len(rows):,}건 (시드 없는 과거 기록 제외) · {(datetime.now()-t0).total_seconds():.2f}초")
+    for gid, msg in problems:
+        print(f"  #{gid}: {msg}")
+    if problems:
+        raise SystemExit(1)
+
 # ------------------ 앱 실행 ------------------
 if __name__ == "__main__":
     with app.app_context():
-        init_db()
+        migrate()
     app.run(host="0.0.0.0", port=8000)